@@ -0,0 +1,161 @@
+"""
+高开销接口的准入控制
+按接口类别限制：并发上限（超出时直接拒绝，不排队）、令牌桶限流，以及相同参数的进行中请求合并；
+超限请求返回 429 并带 Retry-After，拒绝次数计入统计。
+限制按进程生效（多 worker 时每个 worker 各自计数）
+"""
+
+import asyncio
+import functools
+import math
+import time
+
+from fastapi import HTTPException
+from starlette.requests import Request
+
+# 各接口类别的默认限制：concurrency=同时执行数，rate=每秒补充令牌数，burst=令牌桶容量
+DEFAULT_POLICIES = {
+    # 主动探测上游（可能触发登录）：连接测试、连接健康检查、调试接口
+    "probe": {"concurrency": 2, "rate": 0.5, "burst": 4},
+    # 绕过控制器缓存直接请求上游的仪表盘数据
+    "upstream": {"concurrency": 4, "rate": 2, "burst": 6},
+    # 手动控制操作：恢复限速、重置连接
+    "control": {"concurrency": 2, "rate": 1, "burst": 5},
+    # 诊断：采样分析、tracemalloc 快照和比较，同一时刻只允许一个
+    "profile": {"concurrency": 1, "rate": 0.2, "burst": 3},
+}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._time = clock
+        self.tokens = self.burst
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._time()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self) -> float:
+        """取一个令牌：成功返回 0，否则返回需要等待的秒数"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        if self.rate <= 0:
+            return 60.0
+        return (1 - self.tokens) / self.rate
+
+
+class RouteClass:
+    """单个接口类别的并发、限流和合并状态"""
+
+    def __init__(self, name: str, policy: dict):
+        self.name = name
+        self.configure(policy)
+        self.in_flight = 0
+        self.pending = {}  # 合并键 -> 进行中请求的 Future
+        self.stats = {"admitted": 0, "coalesced": 0, "rejected_concurrency": 0, "rejected_rate": 0}
+
+    def configure(self, policy: dict):
+        self.policy = dict(policy)
+        self.bucket = TokenBucket(self.policy["rate"], self.policy["burst"])
+
+    def admit(self):
+        """检查并发和令牌；不允许时抛出 429"""
+        if self.in_flight >= self.policy["concurrency"]:
+            self.stats["rejected_concurrency"] += 1
+            raise _too_many(f"{self.name} 类接口并发已达上限 ({self.policy['concurrency']})", 1)
+        wait = self.bucket.take()
+        if wait > 0:
+            self.stats["rejected_rate"] += 1
+            raise _too_many(f"{self.name} 类接口请求过于频繁", wait)
+        self.stats["admitted"] += 1
+
+    def get_stats(self) -> dict:
+        self.bucket._refill()
+        return {
+            **self.stats,
+            "in_flight": self.in_flight,
+            "coalescing": len(self.pending),
+            "tokens": round(self.bucket.tokens, 2),
+            **self.policy
+        }
+
+
+def _too_many(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+def _coalesce_key(func, args: tuple, kwargs: dict):
+    """合并键：函数 + 参数；依赖 Request（结果与请求头相关）或参数不可哈希时不合并"""
+    if any(isinstance(v, Request) for v in (*args, *kwargs.values())):
+        return None
+    key = (func.__module__, func.__qualname__, args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class AdmissionController:
+    def __init__(self, policies: dict = None):
+        self.classes = {name: RouteClass(name, policy) for name, policy in (policies or DEFAULT_POLICIES).items()}
+
+    def configure(self, overrides: dict = None):
+        """按配置覆盖各类别的限制（web_settings.admission）"""
+        for name, policy in (overrides or {}).items():
+            merged = dict(DEFAULT_POLICIES.get(name, DEFAULT_POLICIES["probe"]))
+            merged.update(policy or {})
+            if name in self.classes:
+                self.classes[name].configure(merged)
+            else:
+                self.classes[name] = RouteClass(name, merged)
+
+    def limit(self, class_name: str, coalesce: bool = True):
+        """接口装饰器：准入检查后执行；coalesce=True 时相同参数的进行中请求共享同一个结果（不计入并发和限流）"""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                route = self.classes[class_name]
+                key = _coalesce_key(func, args, kwargs) if coalesce else None
+                if key is not None and key in route.pending:
+                    route.stats["coalesced"] += 1
+                    return await asyncio.shield(route.pending[key])
+                route.admit()
+                future = None
+                if key is not None:
+                    future = asyncio.get_running_loop().create_future()
+                    route.pending[key] = future
+                route.in_flight += 1
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException as e:
+                    if future is not None and not future.done():
+                        if isinstance(e, asyncio.CancelledError):
+                            future.cancel()
+                        else:
+                            future.set_exception(e)
+                            # 没有合并等待者时避免“exception was never retrieved”警告
+                            future.exception()
+                    raise
+                else:
+                    if future is not None and not future.done():
+                        future.set_result(result)
+                    return result
+                finally:
+                    route.in_flight -= 1
+                    if key is not None:
+                        route.pending.pop(key, None)
+            return wrapper
+        return decorator
+
+    def get_stats(self) -> dict:
+        return {name: route.get_stats() for name, route in self.classes.items()}
+
+
+admission = AdmissionController()
@@ -0,0 +1,178 @@
+"""
+多实例带宽预算分配
+把一个总限速按策略分配到各 qBittorrent 实例，避免总限速随实例数量线性增长：
+- weight: 按实例权重（qbittorrent_instances[].weight）分配
+- demand: 按实例实时速度（dl_info_speed / up_info_speed）比例分配
+- maxmin: 按需求的 max-min 公平分配（水位填充），用不满的份额让给其他实例
+每个实例有最低份额；份额变化超过阈值时才推送，只有各实例生效（已推送）的限速之和会超过总预算时，
+才额外推送未达阈值的份额减少
+"""
+
+import logging
+
+logger = logging.getLogger("qbit-controller")
+
+DEFAULT_BUDGET = {
+    "strategy": "weight",       # weight | demand | maxmin
+    "interval": 30,             # 重新分配间隔（秒）
+    "change_threshold": 0.15,   # 份额相对变化超过该比例才推送
+    "min_share": 64,            # 每个实例最低份额 KB/s
+    "saturation": 0.9,          # 实际速度达到份额的该比例视为“用满”（需求未知，可能更高）
+    "headroom": 1.2             # 未用满时的需求估计 = 实际速度 × headroom
+}
+
+DIRECTIONS = ("download", "upload")
+
+
+def get_budget_settings(settings: dict) -> dict:
+    """合并默认值后的预算分配配置"""
+    merged = dict(DEFAULT_BUDGET)
+    merged.update(settings.get("budget") or {})
+    return merged
+
+
+def split_by_weight(total: float, weights: dict) -> dict:
+    weight_sum = sum(weights.values())
+    if weight_sum <= 0:
+        return {name: total / len(weights) for name in weights}
+    return {name: total * weight / weight_sum for name, weight in weights.items()}
+
+
+def max_min_fair(total: float, demands: dict, weights: dict) -> dict:
+    """加权 max-min 公平分配：需求小于公平份额的实例按需求满足，剩余在其他实例间继续平分"""
+    allocation = {name: 0.0 for name in demands}
+    active = set(demands)
+    remaining = total
+    while active and remaining > 1e-9:
+        weight_sum = sum(weights[name] for name in active) or len(active)
+        unit = remaining / weight_sum
+        satisfied = [name for name in active if demands[name] - allocation[name] <= unit * weights[name]]
+        if not satisfied:
+            for name in active:
+                allocation[name] += unit * weights[name]
+            remaining = 0.0
+            break
+        for name in satisfied:
+            give = max(0.0, demands[name] - allocation[name])
+            allocation[name] += give
+            remaining -= give
+            active.discard(name)
+    if remaining > 1e-9:
+        # 所有需求都已满足：剩余预算按权重分配（限速是上限，不会浪费实际带宽）
+        for name, extra in split_by_weight(remaining, weights).items():
+            allocation[name] += extra
+    return allocation
+
+
+def allocate(total: float, weights: dict, rates: dict, current: dict, options: dict) -> dict:
+    """分配单个方向的总预算（KB/s）
+
+    weights: {实例: 权重}；rates: {实例: 实际速度 KB/s}；current: {实例: 当前份额 KB/s 或 None}
+    """
+    names = list(weights)
+    if not names:
+        return {}
+    minimum = float(options["min_share"])
+    if total <= minimum * len(names):
+        return split_by_weight(total, weights)
+
+    # 先保证最低份额，再分配剩余部分
+    spare = total - minimum * len(names)
+    strategy = options["strategy"]
+    if strategy == "demand":
+        demand_sum = sum(rates.get(name, 0.0) for name in names)
+        extra = ({name: spare * rates.get(name, 0.0) / demand_sum for name in names}
+                 if demand_sum > 0 else split_by_weight(spare, weights))
+    elif strategy == "maxmin":
+        demands = {}
+        for name in names:
+            rate = rates.get(name, 0.0)
+            share = current.get(name)
+            if share and rate >= share * options["saturation"]:
+                demands[name] = float("inf")  # 已用满份额，真实需求未知
+            else:
+                demands[name] = max(0.0, rate * options["headroom"] - minimum)
+        extra = max_min_fair(spare, demands, weights)
+    else:
+        extra = split_by_weight(spare, weights)
+    return {name: minimum + extra[name] for name in names}
+
+
+class BudgetAllocator:
+    """跟踪各实例已推送的份额，定期重新分配，只返回变化超过阈值的实例"""
+
+    def __init__(self):
+        self.shares = {}  # {实例名: {"download": KB/s, "upload": KB/s}}
+        self._last_run = None
+
+    def due(self, now: float, options: dict) -> bool:
+        return self._last_run is None or now - self._last_run >= options["interval"]
+
+    def plan(self, totals: dict, instances: list, rates: dict, options: dict, now: float) -> dict:
+        """计算新份额，返回需要推送的实例 {实例名: {"download": KB/s, "upload": KB/s}}
+
+        totals: {"download": KB/s, "upload": KB/s}，0 表示不限速；rates: {实例名: {"download": B/s, "upload": B/s}}
+        """
+        self._last_run = now
+        weights = {i["name"]: float(i.get("weight", 1.0)) for i in instances}
+        new_shares = {name: {} for name in weights}
+        for direction in DIRECTIONS:
+            total = float(totals.get(direction, 0))
+            if total <= 0:
+                for name in weights:
+                    new_shares[name][direction] = 0
+                continue
+            direction_rates = {name: rates.get(name, {}).get(direction, 0.0) / 1024 for name in weights}
+            current = {name: self.shares.get(name, {}).get(direction) for name in weights}
+            for name, share in allocate(total, weights, direction_rates, current, options).items():
+                new_shares[name][direction] = max(1, int(share))
+
+        changes = {}
+        threshold = options["change_threshold"]
+        for name, share in new_shares.items():
+            old = self.shares.get(name)
+            if old is None or any(self._changed(old.get(d), share[d], threshold) for d in DIRECTIONS):
+                changes[name] = share
+        self._enforce_budget(totals, new_shares, changes)
+        for name, share in changes.items():
+            self.shares[name] = share
+        for name in [n for n in self.shares if n not in weights]:
+            del self.shares[name]
+        return changes
+
+    @staticmethod
+    def _changed(old, new, threshold: float) -> bool:
+        if old is None or (old == 0) != (new == 0):
+            return True
+        if old == 0:
+            return False
+        return abs(new - old) / old > threshold
+
+    def _enforce_budget(self, totals: dict, new_shares: dict, changes: dict):
+        """推送后生效份额之和仍超过总预算时，依次加入超出最多的未推送减少，直到不超预算"""
+        while True:
+            effective = {name: changes.get(name) or self.shares[name] for name in new_shares}
+            candidate = None
+            for direction in DIRECTIONS:
+                total = float(totals.get(direction, 0))
+                if total <= 0 or sum(share[direction] for share in effective.values()) <= total:
+                    continue
+                held = [(effective[name][direction] - share[direction], name) for name, share in new_shares.items()
+                        if name not in changes and effective[name][direction] > share[direction]]
+                if held:
+                    candidate = max(held)[1]
+                    break
+            if candidate is None:
+                return
+            changes[candidate] = new_shares[candidate]
+
+    def forget(self, name: str):
+        """推送失败时丢弃记录，下次分配时重新推送"""
+        self.shares.pop(name, None)
+
+    def reset(self):
+        self.shares = {}
+        self._last_run = None
+
+    def get_state(self) -> dict:
+        return dict(self.shares)
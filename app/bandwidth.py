@@ -0,0 +1,178 @@
+"""
+带宽比例控制
+根据 Lucky 实时吞吐（速率引擎由流量计数器计算），结合 qBittorrent 实际速度，
+用 PI 控制器连续调整 qBittorrent 限速，使 WAN 总占用保持在配置的预算以内：
+收紧立即生效，放宽按最小间隔推送，变化小于死区时不推送，避免频繁调用 WebUI
+"""
+
+import logging
+
+logger = logging.getLogger("qbit-controller")
+
+DEFAULT_BANDWIDTH = {
+    "upload_budget": 0,         # WAN 上行总预算 KB/s（Lucky + qBittorrent），0=不控制
+    "download_budget": 0,       # WAN 下行总预算 KB/s，0=不控制
+    "min_upload": 128,          # qBittorrent 最低上传限速 KB/s，避免完全停止做种
+    "min_download": 512,        # qBittorrent 最低下载限速 KB/s
+    "kp": 0.1,                  # 比例系数
+    "ki": 0.05,                 # 积分系数（每秒）
+    "deadband": 0.1,            # 相对变化小于该比例时不推送
+    "min_push_interval": 10     # 放宽限速的最小推送间隔（秒）
+}
+
+
+# qBittorrent 实际速率达到已推送限速的该比例才视为限速在起作用，此时才累积积分
+INTEGRATE_USAGE_RATIO = 0.9
+
+
+def get_bandwidth_settings(settings: dict) -> dict:
+    """合并默认值后的带宽控制配置"""
+    merged = dict(DEFAULT_BANDWIDTH)
+    merged.update(settings.get("bandwidth") or {})
+    return merged
+
+
+class PIController:
+    """带前馈的 PI 控制器：输出为 qBittorrent 限速（bytes/s）
+
+    前馈项为“预算 - Lucky 实时速率”，串流开始时立即让出带宽；
+    PI 项根据实际 WAN 总占用修正未计入的开销。抗积分饱和：
+    - 输出不超过前馈余量（预算 - Lucky 速率），qBittorrent 空闲时限速不会漂移到整个预算
+    - 只在 qBittorrent 实际用满限速时积分（未用满时误差不反映限速的效果）
+    - 积分限制在 [out_min - 前馈, out_max - 前馈]，输出限幅时停止积分
+    """
+
+    def __init__(self, kp: float, ki: float, out_min: float, out_max: float):
+        self.kp = kp
+        self.ki = ki
+        self.out_min = out_min
+        self.out_max = out_max
+        self.integral = 0.0
+        self.output = out_max
+
+    def update(self, feedforward: float, error: float, dt: float, integrate: bool = True) -> float:
+        high = max(self.out_min, min(self.out_max, feedforward))
+        unclamped = feedforward + self.kp * error + self.integral
+        saturated_high = unclamped >= high and error > 0
+        saturated_low = unclamped <= self.out_min and error < 0
+        if integrate and not (saturated_high or saturated_low):
+            self.integral += self.ki * error * dt
+        self.integral = min(self.out_max - feedforward, max(self.out_min - feedforward, self.integral))
+        self.output = min(high, max(self.out_min, feedforward + self.kp * error + self.integral))
+        return self.output
+
+    def reset(self):
+        self.integral = 0.0
+        self.output = self.out_max
+
+
+class DirectionController:
+    """单个方向（上传/下载）的带宽控制：PI 计算 + 死区 + 推送限流"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pi = None
+        self.pushed = None          # 最近一次推送的限速 bytes/s，None 表示未控制
+        self.last_push_time = None
+        self.last_lucky_rate = 0.0
+        self.last_qbit_rate = 0.0
+
+    def update(self, budget: float, minimum: float, lucky_rate: float, qbit_rate: float,
+               dt: float, now: float, options: dict):
+        """计算新限速，需要推送时返回 bytes/s，否则返回 None"""
+        if self.pi is None or self.pi.out_max != budget or self.pi.out_min != minimum:
+            self.pi = PIController(options["kp"], options["ki"], minimum, budget)
+        self.pi.kp = options["kp"]
+        self.pi.ki = options["ki"]
+        self.last_lucky_rate = lucky_rate
+        self.last_qbit_rate = qbit_rate
+        error = budget - (lucky_rate + qbit_rate)
+        in_use = self.pushed is not None and qbit_rate >= self.pushed * INTEGRATE_USAGE_RATIO
+        target = self.pi.update(budget - lucky_rate, error, dt, integrate=in_use)
+
+        if self.pushed is None:
+            return self._push(target, now)
+        change = target - self.pushed
+        if abs(change) <= options["deadband"] * max(self.pushed, minimum):
+            return None
+        if change > 0 and self.last_push_time is not None and \
+                now - self.last_push_time < options["min_push_interval"]:
+            # 放宽限速需要间隔，收紧立即生效（保证串流优先）
+            return None
+        return self._push(target, now)
+
+    def _push(self, target: float, now: float) -> float:
+        self.pushed = target
+        self.last_push_time = now
+        return target
+
+    def reset(self):
+        self.pi = None
+        self.pushed = None
+        self.last_push_time = None
+
+    def get_state(self) -> dict:
+        return {
+            "limit_kbps": round(self.pushed / 1024, 1) if self.pushed is not None else None,
+            "pi_output_kbps": round(self.pi.output / 1024, 1) if self.pi else None,
+            "lucky_rate_kbps": round(self.last_lucky_rate / 1024, 1),
+            "qbit_rate_kbps": round(self.last_qbit_rate / 1024, 1)
+        }
+
+
+class BandwidthController:
+    """按 WAN 预算连续调节 qBittorrent 上传/下载限速"""
+
+    def __init__(self):
+        self.upload = DirectionController("upload")
+        self.download = DirectionController("download")
+        self._last_update = None
+        self.lucky_rates = {"in": 0.0, "out": 0.0}
+
+    def observe_lucky(self, rates: dict):
+        """输入 Lucky 实时速率 {"in": B/s, "out": B/s}（由速率引擎根据流量计数器计算）"""
+        self.lucky_rates = {"in": rates.get("in", 0.0), "out": rates.get("out", 0.0)}
+        return self.lucky_rates
+
+    def update(self, settings: dict, qbit_rates: dict, now: float) -> dict:
+        """计算新的 qBittorrent 总限速（bytes/s），只返回需要推送的方向 {"upload": x, "download": y}"""
+        options = get_bandwidth_settings(settings)
+        dt = now - self._last_update if self._last_update is not None else 0.0
+        self._last_update = now
+
+        changes = {}
+        # Lucky 反向代理：流出（TrafficOut）占用 WAN 上行，流入占用 WAN 下行
+        for controller, budget_key, min_key, lucky_rate, qbit_key in (
+            (self.upload, "upload_budget", "min_upload", self.lucky_rates["out"], "upload"),
+            (self.download, "download_budget", "min_download", self.lucky_rates["in"], "download")
+        ):
+            budget = float(options[budget_key]) * 1024
+            if budget <= 0:
+                if controller.pushed is not None:
+                    controller.reset()
+                    changes[controller.name] = 0
+                continue
+            minimum = min(float(options[min_key]) * 1024, budget)
+            limit = controller.update(budget, minimum, lucky_rate, qbit_rates.get(qbit_key, 0.0), dt, now, options)
+            if limit is not None:
+                changes[controller.name] = limit
+        return changes
+
+    @property
+    def is_limiting(self) -> bool:
+        """当前限速是否低于预算上限"""
+        return any(c.pi is not None and c.pushed is not None and c.pushed < c.pi.out_max
+                   for c in (self.upload, self.download))
+
+    def reset(self):
+        self.upload.reset()
+        self.download.reset()
+        self._last_update = None
+
+    def get_state(self) -> dict:
+        return {
+            "upload": self.upload.get_state(),
+            "download": self.download.get_state(),
+            "lucky_in_kbps": round(self.lucky_rates["in"] / 1024, 1),
+            "lucky_out_kbps": round(self.lucky_rates["out"] / 1024, 1)
+        }
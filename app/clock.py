@@ -0,0 +1,51 @@
+"""
+时钟抽象
+控制器通过时钟对象获取时间和休眠，生产环境使用系统时钟，
+仿真模式注入虚拟时钟，几小时的流量可以在几秒内回放
+"""
+
+import asyncio
+import time
+from datetime import datetime
+
+
+class SystemClock:
+    """系统时钟 - 真实时间"""
+
+    def time(self) -> float:
+        """单调时间（秒）"""
+        return time.monotonic()
+
+    def now(self) -> datetime:
+        """当前日期时间"""
+        return datetime.now()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+
+class VirtualClock:
+    """虚拟时钟 - sleep 只推进时间，不真正等待"""
+
+    def __init__(self, start: float = 0.0, epoch: datetime = None):
+        self._now = start
+        self._epoch = (epoch or datetime.now()).timestamp() - start
+
+    def time(self) -> float:
+        return self._now
+
+    def now(self) -> datetime:
+        return datetime.fromtimestamp(self._epoch + self._now)
+
+    def advance(self, seconds: float):
+        """手动推进时间"""
+        if seconds > 0:
+            self._now += seconds
+
+    async def sleep(self, seconds: float):
+        self.advance(seconds)
+        # 让出事件循环，保持与真实 sleep 相同的调度语义
+        await asyncio.sleep(0)
+
+
+system_clock = SystemClock()
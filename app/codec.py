@@ -0,0 +1,104 @@
+"""
+JSON 编解码层
+安装了 orjson 时使用 orjson 解析上游响应（Lucky 规则列表、qBittorrent 种子列表）和序列化 API 响应，
+否则回退到标准库 json；/api/* 路由直接返回已编码的响应，跳过 FastAPI 的 jsonable_encoder 逐层遍历
+"""
+
+import asyncio
+import functools
+import json
+import logging
+from datetime import date, datetime
+from enum import Enum
+from pathlib import PurePath
+
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from starlette.responses import Response
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    orjson = None
+    HAS_ORJSON = False
+
+logger = logging.getLogger("qbit-controller")
+
+BACKEND = "orjson" if HAS_ORJSON else "json"
+
+
+def _default(obj):
+    """orjson 不支持的类型：集合、路径、枚举、pydantic 模型等"""
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, PurePath):
+        return str(obj)
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
+
+
+if HAS_ORJSON:
+    _DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj) -> bytes:
+        try:
+            return orjson.dumps(obj, default=_default, option=_DUMPS_OPTIONS)
+        except TypeError:
+            # 少见类型（如 float 子类、超大整数）交给标准库路径处理
+            return _stdlib_dumps(jsonable_encoder(obj))
+else:
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj) -> bytes:
+        return _stdlib_dumps(jsonable_encoder(obj))
+
+
+def _stdlib_dumps(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+                      default=lambda o: o.isoformat() if isinstance(o, (date, datetime)) else str(o)).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """使用 codec.dumps 序列化的 JSON 响应"""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+class FastJSONRoute(APIRoute):
+    """/api/* 路由：端点返回的普通对象直接编码为 FastJSONResponse，不再经过 jsonable_encoder
+
+    声明了 response_model 的路由保留 FastAPI 的校验和序列化
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        response_model = kwargs.get("response_model")
+        if isinstance(response_model, DefaultPlaceholder):
+            response_model = response_model.value
+        if path.startswith("/api/") and response_model is None:
+            endpoint = _wrap_endpoint(endpoint, kwargs.get("status_code") or 200)
+        super().__init__(path, endpoint, **kwargs)
+
+
+def _wrap_endpoint(endpoint, status_code: int):
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            result = await endpoint(*args, **kwargs)
+            return result if isinstance(result, Response) else FastJSONResponse(result, status_code=status_code)
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            result = endpoint(*args, **kwargs)
+            return result if isinstance(result, Response) else FastJSONResponse(result, status_code=status_code)
+    return wrapper
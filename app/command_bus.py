@@ -0,0 +1,117 @@
+"""
+限速命令总线
+每个 qBittorrent 实例一个命令通道，同一时刻只有一个推送在执行：
+- 新的期望状态到达时取消仍在执行的旧推送（包括其重试等待），等旧推送退出后再开始新推送，
+  保证最后一次写入的总是控制器当前的期望状态
+- 与执行中推送目标相同的命令直接合并，等待同一个结果
+- 排队期间又被更新命令取代的命令不再执行
+"""
+
+import asyncio
+import logging
+
+logger = logging.getLogger("qbit-controller")
+
+
+class _Channel:
+    __slots__ = ("target", "task", "cancelling", "seq", "waiting", "applied", "last_error")
+
+    def __init__(self):
+        self.target = None      # 执行中（或最近一次）推送的目标
+        self.task = None
+        self.cancelling = None  # 已请求取消的推送任务
+        self.seq = 0            # 最新提交的序号
+        self.waiting = 0        # 等待中的提交数
+        self.applied = None     # 最近一次成功写入的目标
+        self.last_error = None
+
+
+class CommandBus:
+    """按实例串行化限速推送，最新命令优先"""
+
+    def __init__(self):
+        self._channels = {}
+        self.stats = {"submitted": 0, "coalesced": 0, "superseded": 0, "cancelled": 0, "applied": 0, "failed": 0}
+
+    def _channel(self, name: str) -> _Channel:
+        channel = self._channels.get(name)
+        if channel is None:
+            channel = self._channels[name] = _Channel()
+        return channel
+
+    async def submit(self, name: str, target, action) -> bool:
+        """提交实例的期望状态并等待结果
+
+        target: 可比较的期望状态（如 ("limits", 下载, 上传)），相同目标的命令合并；
+        action: 无参协程函数，执行实际推送并返回是否成功。
+        返回 True 表示写入成功，或该命令已被更新的命令取代（由新命令负责最终状态）
+        """
+        channel = self._channel(name)
+        self.stats["submitted"] += 1
+        channel.seq += 1
+        seq = channel.seq
+        channel.waiting += 1
+        try:
+            while channel.task is not None and not channel.task.done():
+                task = channel.task
+                if channel.target == target and channel.cancelling is not task:
+                    self.stats["coalesced"] += 1
+                    return await self._wait(task)
+                if channel.cancelling is not task:
+                    channel.cancelling = task
+                    task.cancel()
+                    self.stats["cancelled"] += 1
+                    logger.info(f"⏭️ {name} - 取消过期的限速推送: {channel.target}")
+                # 等旧推送（含正在进行的请求）退出后再写入，避免乱序
+                await asyncio.wait([task])
+                if channel.seq != seq:
+                    # 等待期间有更新的命令，本命令已过期
+                    self.stats["superseded"] += 1
+                    return True
+            channel.target = target
+            channel.task = asyncio.create_task(self._run(name, channel, target, action))
+            return await self._wait(channel.task)
+        finally:
+            channel.waiting -= 1
+
+    async def _run(self, name: str, channel: _Channel, target, action) -> bool:
+        try:
+            ok = await action()
+        except Exception as e:
+            channel.last_error = str(e)
+            self.stats["failed"] += 1
+            logger.error(f"❌ {name} - 限速推送异常: {e}")
+            return False
+        if ok:
+            channel.applied = target
+            channel.last_error = None
+            self.stats["applied"] += 1
+        else:
+            channel.last_error = "推送失败"
+            self.stats["failed"] += 1
+        return ok
+
+    async def _wait(self, task: asyncio.Task) -> bool:
+        try:
+            # shield：调用方被取消时不影响推送本身
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                # 推送被更新的命令取消
+                return True
+            raise
+
+    def get_state(self) -> dict:
+        instances = {}
+        depth = 0
+        for name, channel in self._channels.items():
+            in_flight = channel.task is not None and not channel.task.done()
+            depth += channel.waiting
+            instances[name] = {
+                "in_flight": in_flight,
+                "target": list(channel.target) if channel.target is not None else None,
+                "applied": list(channel.applied) if channel.applied is not None else None,
+                "waiting": channel.waiting,
+                "last_error": channel.last_error
+            }
+        return {**self.stats, "depth": depth, "instances": instances}
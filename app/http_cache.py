@@ -0,0 +1,117 @@
+"""
+仪表盘接口的条件请求和压缩
+ETag 由快照版本生成（快照对象被替换时版本加一），不对响应体做哈希；
+If-None-Match 命中时直接返回 304，编码后的响应体和 gzip/brotli 压缩结果按版本缓存，
+同一快照的重复轮询只做一次序列化和压缩
+"""
+
+import gzip
+import os
+import time
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+import codec
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    brotli = None
+    HAS_BROTLI = False
+
+# 小于该大小的响应不压缩（字节）
+MIN_COMPRESS_SIZE = 1024
+
+
+class _Entry:
+    __slots__ = ("content", "etag", "body", "encoded")
+
+    def __init__(self, content, etag: str):
+        self.content = content
+        self.etag = etag
+        self.body = None
+        self.encoded = {}
+
+
+class ResponseCache:
+    """按接口缓存当前快照的 ETag、编码结果和压缩结果"""
+
+    def __init__(self, min_size: int = MIN_COMPRESS_SIZE, gzip_level: int = 6, brotli_quality: int = 5):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        # 进程标识：多 worker 时各进程的快照版本互不混用
+        self._boot = f"{os.getpid():x}{int(time.time()) & 0xffff:04x}"
+        self._entries = {}
+        self._versions = {}
+        self.stats = {"200": 0, "304": 0, "encodes": 0, "compressions": 0}
+
+    def _entry(self, key: str, content) -> _Entry:
+        entry = self._entries.get(key)
+        if entry is None or entry.content is not content:
+            # 持有快照引用，保证对象身份比较可靠
+            version = self._versions.get(key, 0) + 1
+            self._versions[key] = version
+            entry = _Entry(content, f'"{key}-{self._boot}-{version}"')
+            self._entries[key] = entry
+        return entry
+
+    @staticmethod
+    def _matches(request: Request, etag: str) -> bool:
+        header = request.headers.get("if-none-match")
+        if not header:
+            return False
+        if header.strip() == "*":
+            return True
+        candidates = [tag.strip() for tag in header.split(",")]
+        # 比较时忽略弱校验前缀（压缩代理可能把强 ETag 改为弱 ETag）
+        return any(tag[2:] == etag if tag.startswith("W/") else tag == etag for tag in candidates)
+
+    @staticmethod
+    def _choose_encoding(request: Request):
+        accept = request.headers.get("accept-encoding", "")
+        offered = {part.split(";")[0].strip().lower() for part in accept.split(",")}
+        if HAS_BROTLI and "br" in offered:
+            return "br"
+        if "gzip" in offered:
+            return "gzip"
+        return None
+
+    def _encode(self, entry: _Entry, encoding: str) -> bytes:
+        data = entry.encoded.get(encoding)
+        if data is None:
+            if encoding == "br":
+                data = brotli.compress(entry.body, quality=self.brotli_quality)
+            else:
+                data = gzip.compress(entry.body, compresslevel=self.gzip_level, mtime=0)
+            entry.encoded[encoding] = data
+            self.stats["compressions"] += 1
+        return data
+
+    def respond(self, request: Request, key: str, content) -> Response:
+        """返回快照的 JSON 响应；content 与上次是同一对象时复用 ETag 和编码结果"""
+        entry = self._entry(key, content)
+        headers = {"ETag": entry.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if self._matches(request, entry.etag):
+            self.stats["304"] += 1
+            return Response(status_code=304, headers=headers)
+
+        if entry.body is None:
+            entry.body = codec.dumps(content)
+            self.stats["encodes"] += 1
+        body = entry.body
+        encoding = self._choose_encoding(request) if len(body) >= self.min_size else None
+        if encoding:
+            body = self._encode(entry, encoding)
+            headers["Content-Encoding"] = encoding
+        self.stats["200"] += 1
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "brotli": HAS_BROTLI, "min_compress_size": self.min_size,
+                "endpoints": {key: entry.etag for key, entry in self._entries.items()}}
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,305 @@
+"""
+统一 HTTP 客户端层
+LuckyMonitor 和 QBittorrentManager 共用：按上游主机（协议+主机+端口）建立独立连接池，
+每个连接池有自己的 keep-alive 参数、并发上限、DNS TTL 缓存和使用统计；
+每个主机单独跟踪连接健康，连接被重置或连续失败时只淘汰该主机的连接池，不影响其他设备和实例
+"""
+
+import asyncio
+import errno
+import inspect
+import logging
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import aiohttp
+
+try:
+    import aiodns  # noqa: F401  AsyncResolver 依赖 aiodns
+    HAS_AIODNS = True
+except ImportError:
+    HAS_AIODNS = False
+
+logger = logging.getLogger("qbit-controller")
+
+# aiohttp >= 3.10 的 TCPConnector 支持 happy eyeballs（RFC 8305）
+_CONNECTOR_PARAMS = inspect.signature(aiohttp.TCPConnector.__init__).parameters
+SUPPORTS_HAPPY_EYEBALLS = "happy_eyeballs_delay" in _CONNECTOR_PARAMS
+
+# 各上游类型的连接参数
+PROFILES = {
+    "lucky": {
+        # Lucky 每个轮询周期都会请求：快速失败，长 keep-alive 复用连接
+        "timeout": {"total": 5, "connect": 3, "sock_read": 4, "sock_connect": 3},
+        "max_connections": 8,
+        "keepalive_timeout": 30,
+    },
+    "qbit": {
+        "timeout": {"total": 15, "connect": 8, "sock_read": 10, "sock_connect": 8},
+        "max_connections": 12,
+        "keepalive_timeout": 60,
+    },
+}
+
+DEFAULT_PROFILE = {
+    "timeout": {"total": 10, "connect": 5},
+    "max_connections": 8,
+    "keepalive_timeout": 15,
+}
+
+
+# 连续传输层失败达到该次数后淘汰主机连接池
+EVICT_AFTER_FAILURES = 3
+
+_RESET_ERRNOS = {errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE}
+
+
+def is_connection_reset(exc: BaseException) -> bool:
+    """判断异常是否为连接被对端重置（连接池中的连接已失效）"""
+    if isinstance(exc, (ConnectionResetError, aiohttp.ServerDisconnectedError)):
+        return True
+    if isinstance(exc, OSError) and exc.errno in _RESET_ERRNOS:
+        return True
+    return "Connection reset" in str(exc)
+
+
+def host_key(url: str) -> str:
+    """上游主机标识：scheme://host:port"""
+    parts = urlsplit(url)
+    scheme = parts.scheme or "http"
+    port = parts.port or (443 if scheme == "https" else 80)
+    return f"{scheme}://{parts.hostname}:{port}"
+
+
+class HostHealth:
+    """单个上游主机的连接健康状态，连接池重建后保留"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.consecutive_failures = 0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.evictions = 0
+        self.last_error = None
+        self.last_error_at = None
+        self.last_success_at = None
+
+    def record_success(self):
+        self.total_requests += 1
+        self.consecutive_failures = 0
+        self.last_success_at = time.time()
+
+    def record_failure(self, exc: BaseException) -> bool:
+        """记录传输层失败，返回是否需要淘汰连接池"""
+        self.total_requests += 1
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        self.last_error = f"{type(exc).__name__}: {exc}"
+        self.last_error_at = time.time()
+        return is_connection_reset(exc) or self.consecutive_failures >= EVICT_AFTER_FAILURES
+
+    @property
+    def status(self) -> str:
+        if self.consecutive_failures == 0:
+            return "healthy"
+        if self.consecutive_failures < EVICT_AFTER_FAILURES:
+            return "degraded"
+        return "unhealthy"
+
+    def to_dict(self) -> dict:
+        return {
+            "host": self.key,
+            "status": self.status,
+            "consecutive_failures": self.consecutive_failures,
+            "total_requests": self.total_requests,
+            "total_failures": self.total_failures,
+            "evictions": self.evictions,
+            "last_error": self.last_error,
+            "last_error_at": datetime.fromtimestamp(self.last_error_at).isoformat() if self.last_error_at else None,
+            "last_success_at": datetime.fromtimestamp(self.last_success_at).isoformat() if self.last_success_at else None,
+        }
+
+
+class HostPool:
+    """单个上游主机的连接池"""
+
+    def __init__(self, profile_name: str, key: str, profile: dict, dns_ttl: int, happy_eyeballs_delay: float,
+                 health: HostHealth):
+        self.profile_name = profile_name
+        self.key = key
+        self.profile = profile
+        self.health = health
+        self.evict_pending = False
+        self.created_at = time.time()
+        self.metrics = {
+            "requests": 0,
+            "handshakes": 0,       # 新建 TCP/TLS 连接
+            "reused": 0,           # 复用 keep-alive 连接
+            "dns_resolutions": 0,
+            "dns_cache_hits": 0,
+            "request_errors": 0,
+        }
+
+        connector_args = {
+            "ssl": False,
+            "limit": profile["max_connections"],
+            "limit_per_host": profile["max_connections"],
+            "keepalive_timeout": profile["keepalive_timeout"],
+            "enable_cleanup_closed": True,
+            "use_dns_cache": True,
+            "ttl_dns_cache": dns_ttl,
+            "family": 0,  # 允许IPv4和IPv6
+        }
+        if HAS_AIODNS:
+            connector_args["resolver"] = aiohttp.AsyncResolver()
+        if SUPPORTS_HAPPY_EYEBALLS:
+            connector_args["happy_eyeballs_delay"] = happy_eyeballs_delay
+            connector_args["interleave"] = 1
+        self.connector = aiohttp.TCPConnector(**connector_args)
+
+        # 禁用代理；认证 Cookie 由调用方显式管理，会话不保存 Cookie，避免同主机多实例串用
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(**profile["timeout"]),
+            connector=self.connector,
+            raise_for_status=False,
+            trust_env=False,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            trace_configs=[self._trace_config()],
+            headers={'Connection': 'keep-alive', 'User-Agent': 'SpeedHiveHome/2.0'}
+        )
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        metrics = self.metrics
+        trace = aiohttp.TraceConfig()
+
+        def counter(name):
+            async def handler(session, ctx, params):
+                metrics[name] += 1
+            return handler
+
+        async def on_request_end(session, ctx, params):
+            # 收到 HTTP 响应即视为传输层正常（状态码由调用方处理）
+            self.health.record_success()
+
+        async def on_request_exception(session, ctx, params):
+            metrics["request_errors"] += 1
+            if self.health.record_failure(params.exception) and not self.evict_pending:
+                # 不在请求回调中关闭会话：标记后由下一次 get_session 重建
+                self.evict_pending = True
+                logger.info(f"🩺 {self.key} 连接异常 ({self.health.last_error})，连接池将被重建")
+
+        trace.on_request_start.append(counter("requests"))
+        trace.on_request_end.append(on_request_end)
+        trace.on_request_exception.append(on_request_exception)
+        trace.on_connection_create_end.append(counter("handshakes"))
+        trace.on_connection_reuseconn.append(counter("reused"))
+        trace.on_dns_resolvehost_end.append(counter("dns_resolutions"))
+        trace.on_dns_cache_hit.append(counter("dns_cache_hits"))
+        return trace
+
+    @property
+    def closed(self) -> bool:
+        return self.session.closed
+
+    async def close(self):
+        if not self.session.closed:
+            await self.session.close()
+
+    def get_stats(self) -> dict:
+        acquired = getattr(self.connector, "_acquired", ())
+        idle = sum(len(conns) for conns in getattr(self.connector, "_conns", {}).values())
+        return {
+            "profile": self.profile_name,
+            "host": self.key,
+            "in_use": len(acquired),
+            "idle": idle,
+            "max_connections": self.profile["max_connections"],
+            "keepalive_timeout": self.profile["keepalive_timeout"],
+            "age_seconds": round(time.time() - self.created_at, 1),
+            **self.metrics,
+        }
+
+
+class HttpClientPool:
+    """按 (类型, 主机) 管理连接池"""
+
+    def __init__(self, profiles: dict = None, dns_ttl: int = 300, happy_eyeballs_delay: float = 0.25):
+        self.profiles = profiles or PROFILES
+        self.dns_ttl = dns_ttl
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+        self._pools = {}
+        self._health = {}
+        # 在首次使用时创建：模块导入时尚无运行中的事件循环（Python 3.9 的 asyncio.Lock 会绑定到构造时的循环）
+        self._lock = None
+        self.resets = 0
+
+    def _health_for(self, key: str) -> HostHealth:
+        if key not in self._health:
+            self._health[key] = HostHealth(key)
+        return self._health[key]
+
+    async def get_session(self, profile: str, url: str) -> aiohttp.ClientSession:
+        """获取目标 URL 所在主机的会话（不存在、已关闭或被标记淘汰时重建）"""
+        key = (profile, host_key(url))
+        pool = self._pools.get(key)
+        if pool is not None and not pool.closed and not pool.evict_pending:
+            return pool.session
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None and pool.evict_pending:
+                await pool.close()
+                pool.health.evictions += 1
+                logger.info(f"🔄 已淘汰并重建连接池: {key[1]}")
+            if pool is None or pool.closed:
+                pool = HostPool(profile, key[1], self.profiles.get(profile, DEFAULT_PROFILE),
+                                self.dns_ttl, self.happy_eyeballs_delay, self._health_for(key[1]))
+                self._pools[key] = pool
+                logger.debug(f"✅ HTTP 连接池已创建: {profile} {key[1]}")
+        return pool.session
+
+    async def reset_host(self, url: str, profile: str = None) -> int:
+        """关闭指定主机的连接池，下次请求时重建；返回关闭的连接池数量"""
+        target = host_key(url)
+        closed = 0
+        for key in [k for k in self._pools if k[1] == target and (profile is None or k[0] == profile)]:
+            await self._pools.pop(key).close()
+            closed += 1
+        if closed:
+            self.resets += 1
+            logger.info(f"🔄 已重建连接池: {target}")
+        return closed
+
+    async def close(self, profile: str = None):
+        """关闭连接池（可按类型），应用退出时调用"""
+        for key in [k for k in self._pools if profile is None or k[0] == profile]:
+            await self._pools.pop(key).close()
+
+    def get_health(self, url: str = None) -> dict:
+        """主机连接健康状态；不指定 URL 时返回全部主机"""
+        if url is not None:
+            key = host_key(url)
+            return self._health[key].to_dict() if key in self._health else {"host": key, "status": "unknown"}
+        return {key: health.to_dict() for key, health in self._health.items()}
+
+    def has_active(self, profile: str) -> bool:
+        return any(k[0] == profile and not p.closed for k, p in self._pools.items())
+
+    def get_stats(self) -> dict:
+        pools = [pool.get_stats() for pool in self._pools.values()]
+        return {
+            "pools": pools,
+            "total_in_use": sum(p["in_use"] for p in pools),
+            "total_idle": sum(p["idle"] for p in pools),
+            "total_handshakes": sum(p["handshakes"] for p in pools),
+            "host_resets": self.resets,
+            "hosts": self.get_health(),
+            "dns_ttl": self.dns_ttl,
+            "async_dns": HAS_AIODNS,
+            "happy_eyeballs": SUPPORTS_HAPPY_EYEBALLS,
+        }
+
+
+http_pool = HttpClientPool()
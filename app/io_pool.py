@@ -0,0 +1,145 @@
+"""
+阻塞 I/O 线程池
+文件读写、YAML/JSON 解析等阻塞操作统一通过有界线程池执行，
+避免 Docker 卷上的磁盘延迟阻塞 HTTP 处理和控制周期；
+同一文件的读写通过串行通道（每个通道一个工作线程）按提交顺序执行，不会并发或乱序
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("qbit-controller")
+
+
+class IOPool:
+    """有界线程池 + 按操作名称统计耗时"""
+
+    def __init__(self, max_workers: int = 4, slow_threshold: float = 0.5):
+        self.max_workers = max(1, max_workers)
+        self.slow_threshold = slow_threshold  # 超过该耗时（秒）记录警告
+        self._executor = None
+        self._lanes = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._in_flight = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """延迟创建线程池"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="io-pool"
+                    )
+        return self._executor
+
+    def _record(self, op_name: str, wait_time: float, run_time: float, failed: bool):
+        """记录单次操作耗时（在工作线程中调用）"""
+        with self._lock:
+            stats = self._stats.get(op_name)
+            if stats is None:
+                stats = {
+                    "count": 0,
+                    "errors": 0,
+                    "total_time": 0.0,
+                    "max_time": 0.0,
+                    "last_time": 0.0,
+                    "total_wait": 0.0,
+                    "max_wait": 0.0
+                }
+                self._stats[op_name] = stats
+            stats["count"] += 1
+            stats["total_time"] += run_time
+            stats["last_time"] = run_time
+            stats["max_time"] = max(stats["max_time"], run_time)
+            stats["total_wait"] += wait_time
+            stats["max_wait"] = max(stats["max_wait"], wait_time)
+            if failed:
+                stats["errors"] += 1
+
+        if run_time + wait_time > self.slow_threshold:
+            logger.warning(f"🐢 I/O操作 {op_name} 耗时 {run_time * 1000:.0f}ms (排队 {wait_time * 1000:.0f}ms)")
+
+    def _get_lane(self, lane: str) -> ThreadPoolExecutor:
+        """延迟创建串行通道"""
+        executor = self._lanes.get(lane)
+        if executor is None:
+            with self._lock:
+                executor = self._lanes.get(lane)
+                if executor is None:
+                    executor = self._lanes[lane] = ThreadPoolExecutor(
+                        max_workers=1,
+                        thread_name_prefix=f"io-pool-{lane}"
+                    )
+        return executor
+
+    async def run(self, op_name: str, func, *args, **kwargs):
+        """在线程池中执行阻塞函数并返回结果"""
+        return await self._submit(self._get_executor(), op_name, functools.partial(func, *args, **kwargs))
+
+    async def run_serial(self, lane: str, op_name: str, func, *args, **kwargs):
+        """在串行通道中执行阻塞函数：同一通道的调用按提交顺序逐个执行"""
+        return await self._submit(self._get_lane(lane), op_name, functools.partial(func, *args, **kwargs))
+
+    async def _submit(self, executor: ThreadPoolExecutor, op_name: str, call):
+        submitted = time.perf_counter()
+
+        def timed_call():
+            started = time.perf_counter()
+            failed = False
+            try:
+                return call()
+            except Exception:
+                failed = True
+                raise
+            finally:
+                self._record(op_name, started - submitted, time.perf_counter() - started, failed)
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return await loop.run_in_executor(executor, timed_call)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def get_stats(self) -> dict:
+        """获取各操作的耗时统计（毫秒）"""
+        with self._lock:
+            operations = {}
+            for op_name, stats in self._stats.items():
+                count = stats["count"] or 1
+                operations[op_name] = {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "avg_ms": round(stats["total_time"] / count * 1000, 3),
+                    "max_ms": round(stats["max_time"] * 1000, 3),
+                    "last_ms": round(stats["last_time"] * 1000, 3),
+                    "avg_wait_ms": round(stats["total_wait"] / count * 1000, 3),
+                    "max_wait_ms": round(stats["max_wait"] * 1000, 3)
+                }
+            return {
+                "max_workers": self.max_workers,
+                "serial_lanes": sorted(self._lanes),
+                "in_flight": self._in_flight,
+                "operations": operations
+            }
+
+    def shutdown(self):
+        """关闭线程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        for executor in self._lanes.values():
+            executor.shutdown(wait=True)
+        self._lanes.clear()
+
+
+io_pool = IOPool(max_workers=int(os.environ.get("IO_POOL_WORKERS", "4")))
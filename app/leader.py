@@ -0,0 +1,166 @@
+"""
+多进程领导者选举
+uvicorn 以多 worker 运行时，只有持有 data/run/controller.lock 文件锁的进程运行 SpeedController；
+领导者在 data/run/controller.sock 上提供本地 socket 服务，其他 worker（跟随者）
+通过它读取控制器状态快照、转发控制命令，保证控制平面单写入者
+"""
+
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 平台：不支持多进程，始终为领导者
+    fcntl = None
+
+logger = logging.getLogger("qbit-controller")
+
+MAX_MESSAGE_SIZE = 32 * 1024 * 1024
+
+
+class LeaderUnavailable(Exception):
+    """领导者不可达（选举中或已退出）"""
+
+
+class LeaderElection:
+    """基于文件锁的领导者选举 + 本地 socket 状态/命令通道"""
+
+    def __init__(self, run_dir=Path("data/run"), retry_interval: float = 5):
+        self.run_dir = Path(run_dir)
+        self.lock_path = self.run_dir / "controller.lock"
+        self.socket_path = self.run_dir / "controller.sock"
+        self.retry_interval = retry_interval
+        self.is_leader = False
+        self._lock_fd = None
+        self._server = None
+        self._handlers = {}
+        self._campaign_task = None
+
+    def register(self, op: str, handler):
+        """注册领导者处理的操作：async handler(**params) -> dict"""
+        self._handlers[op] = handler
+
+    async def dispatch(self, op: str, **params) -> dict:
+        """在本进程执行已注册的操作"""
+        handler = self._handlers.get(op)
+        if handler is None:
+            raise KeyError(f"未知操作: {op}")
+        return await handler(**params)
+
+    def try_acquire(self) -> bool:
+        """尝试获取文件锁（非阻塞）"""
+        if self._lock_fd is not None:
+            return True
+        if fcntl is None:
+            return True
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._lock_fd = fd
+        return True
+
+    def start_campaign(self, on_elected):
+        """后台竞选：获得锁后启动 socket 服务并调用 on_elected()"""
+        self._campaign_task = asyncio.create_task(self._campaign(on_elected))
+        return self._campaign_task
+
+    async def _campaign(self, on_elected):
+        announced = False
+        while True:
+            if self.try_acquire():
+                self.is_leader = True
+                await self._start_server()
+                logger.info(f"👑 进程 {os.getpid()} 成为控制器领导者")
+                await on_elected()
+                return
+            if not announced:
+                logger.info(f"👥 进程 {os.getpid()} 作为跟随者运行，控制器由其他 worker 负责")
+                announced = True
+            await asyncio.sleep(self.retry_interval)
+
+    async def _start_server(self):
+        if fcntl is None:
+            return
+        try:
+            self.socket_path.unlink()
+        except FileNotFoundError:
+            pass
+        self._server = await asyncio.start_unix_server(
+            self._handle_connection, path=str(self.socket_path), limit=MAX_MESSAGE_SIZE
+        )
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            line = await reader.readline()
+            if not line:
+                return
+            request = json.loads(line)
+            handler = self._handlers.get(request.get("op"))
+            if handler is None:
+                response = {"__error__": 400, "detail": f"未知操作: {request.get('op')}"}
+            else:
+                try:
+                    response = await handler(**request.get("params", {}))
+                except Exception as e:
+                    status = getattr(e, "status_code", 500)
+                    response = {"__error__": status, "detail": getattr(e, "detail", str(e))}
+            writer.write(json.dumps(response, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"❌ 领导者请求处理失败: {e}")
+        finally:
+            writer.close()
+
+    async def call(self, op: str, timeout: float = 5, **params) -> dict:
+        """跟随者调用领导者的操作"""
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(str(self.socket_path), limit=MAX_MESSAGE_SIZE), timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise LeaderUnavailable(f"领导者不可达: {e}")
+        try:
+            writer.write(json.dumps({"op": op, "params": params}).encode("utf-8") + b"\n")
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise LeaderUnavailable(f"领导者无响应: {e}")
+        finally:
+            writer.close()
+        if not line:
+            raise LeaderUnavailable("领导者连接已关闭")
+        return json.loads(line)
+
+    async def release(self):
+        """关闭 socket 服务并释放文件锁"""
+        if self._campaign_task is not None and not self._campaign_task.done():
+            self._campaign_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            try:
+                self.socket_path.unlink()
+            except FileNotFoundError:
+                pass
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.is_leader = False
+
+    def get_status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "role": "leader" if self.is_leader else "follower",
+            "lock_file": str(self.lock_path)
+        }
@@ -0,0 +1,116 @@
+"""
+独立事件循环线程
+控制器可以运行在专用线程的事件循环中，Web 请求（大 JSON 响应、日志读取、连接探测）不会推迟限速决策：
+- Web 层通过 call()/submit() 把协程提交到控制器循环执行（线程安全的命令队列）
+- 只能在某个循环线程中访问的对象（如历史存储）用 LoopBound 把调用转交到其所属循环
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+
+logger = logging.getLogger("qbit-controller")
+
+
+class LoopThread:
+    """在后台线程中运行的事件循环"""
+
+    def __init__(self, name: str = "controller-loop"):
+        self.name = name
+        self.loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self.stats = {"commands": 0, "errors": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and self.loop is not None
+
+    @property
+    def in_thread(self) -> bool:
+        """当前是否在本循环线程中执行"""
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def start(self):
+        if self.running:
+            return
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        logger.info(f"🧵 独立事件循环线程已启动: {self.name}")
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.loop = loop
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+            self.loop = None
+
+    def submit(self, coro):
+        """把协程提交到循环线程，返回 concurrent.futures.Future"""
+        if not self.running:
+            coro.close()
+            raise RuntimeError(f"事件循环线程 {self.name} 未运行")
+        self.stats["commands"] += 1
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def call(self, coro, timeout: float = None):
+        """在循环线程中执行协程并在调用方的事件循环中等待结果"""
+        if self.in_thread:
+            return await coro
+        future = self.submit(coro)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            self.stats["errors"] += 1
+            raise
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+
+    async def stop(self, timeout: float = 5):
+        """取消循环中的剩余任务并停止线程"""
+        if not self.running:
+            return
+        loop = self.loop
+
+        async def _cancel_all():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            await self.call(_cancel_all(), timeout=timeout)
+        except Exception as e:
+            logger.warning(f"⚠️ 停止事件循环线程 {self.name} 时取消任务失败: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join, timeout)
+        self._thread = None
+        logger.info(f"🧵 独立事件循环线程已停止: {self.name}")
+
+    def get_stats(self) -> dict:
+        return {"name": self.name, "running": self.running, **self.stats}
+
+
+class LoopBound:
+    """把方法调用转交到目标对象所属的事件循环线程执行（不等待结果）"""
+
+    def __init__(self, target, loop: asyncio.AbstractEventLoop):
+        self._target = target
+        self._loop = loop
+
+    def __getattr__(self, name):
+        method = getattr(self._target, name)
+
+        def forward(*args, **kwargs):
+            self._loop.call_soon_threadsafe(functools.partial(method, *args, **kwargs))
+        return forward
@@ -1,22 +1,47 @@
+from datetime import datetime
+# 进程启动时间，用于统计启动到就绪的耗时
+STARTED_AT = datetime.now()
+
 import os
-import uvicorn
 import yaml
 import logging
 import aiohttp
 import asyncio
+import threading
 from pathlib import Path
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse
-from datetime import datetime
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+from typing import Optional
 import json
+import time
+from io_pool import io_pool
+from http_pool import HttpClientPool, http_pool
+from clock import system_clock
+from timeseries import TimeSeriesStore, downsample_buckets, lttb, active_periods
+import hashlib
+from leader import LeaderElection, LeaderUnavailable
+from targeting import TorrentThrottler, get_targeting_settings, chunk_hashes
+from bandwidth import BandwidthController
+from allocation import BudgetAllocator, get_budget_settings
+from rates import RateEngine, rate_engine
+from command_bus import CommandBus
+from telemetry import TelemetryPoller, get_telemetry_settings
+from loop_thread import LoopBound, LoopThread
+from admission import admission
+from tracing import tracer, to_otlp, get_tracing_settings
+from memory import MemoryMonitor
+from profiler import profiler, ProfilerBusy
+import codec
+from codec import FastJSONResponse, FastJSONRoute
+from http_cache import response_cache
 
 # 导入版本管理模块
 try:
-    from version import get_version_info, get_version_string
+    from version import get_version_info, format_version_string
+    # 只读取一次：优先使用构建时生成的 version_info.json，否则调用 git
     VERSION_INFO = get_version_info()
-    VERSION_STRING = get_version_string()
+    VERSION_STRING = format_version_string(VERSION_INFO)
 except ImportError:
     # 如果version.py不存在，使用默认版本
     VERSION_INFO = {
@@ -88,8 +113,11 @@ logger.info("=" * 60)
 app = FastAPI(
     title="SpeedHiveHome",
     description="基于Lucky设备状态的智能限速控制",
-    version=VERSION_INFO['version']
+    version=VERSION_INFO['version'],
+    default_response_class=FastJSONResponse
 )
+# /api/* 路由直接用快速 JSON 编码器序列化返回值
+app.router.route_class = FastJSONRoute
 
 # 创建必要的目录
 os.makedirs("app/static", exist_ok=True)
@@ -99,17 +127,28 @@ os.makedirs("data/logs", exist_ok=True)
 # 挂载静态文件
 try:
     app.mount("/static", StaticFiles(directory="app/static"), name="static")
-    templates = Jinja2Templates(directory="app/templates")
     print("✅ 静态文件设置成功")
 except Exception as e:
     print(f"⚠️ 静态文件设置警告: {e}")
 
+_templates = None
+
+def get_templates():
+    """首次渲染页面时才加载 Jinja2 模板引擎，缩短启动时间"""
+    global _templates
+    if _templates is None:
+        from fastapi.templating import Jinja2Templates
+        _templates = Jinja2Templates(directory="app/templates")
+    return _templates
+
 class ConfigManager:
     def __init__(self):
         self.config_file = Path("config/config.yaml")
         self.service_control_file = Path("data/config/service_control.json")
         # 动态服务控制状态 - 内存存储
         self._service_control_state = {}
+        # 控制器在独立线程运行时，服务发现与 Web 请求会同时访问服务控制状态
+        self._service_lock = threading.RLock()
         self.default_config = {
             "lucky_devices": [
                 {
@@ -156,19 +195,23 @@ class ConfigManager:
             if self.service_control_file.exists():
                 with open(self.service_control_file, 'r', encoding='utf-8') as f:
                     persisted_state = json.load(f)
-                self._service_control_state.update(persisted_state)
+                with self._service_lock:
+                    self._service_control_state.update(persisted_state)
                 print(f"✅ 加载了 {len(persisted_state)} 个已保存的服务控制状态")
             else:
                 print("📝 服务控制文件不存在，使用空状态")
         except Exception as e:
             print(f"❌ 加载服务控制状态失败: {e}")
     
-    def _save_persisted_service_control(self):
-        """保存服务控制状态到文件"""
+    def _save_persisted_service_control(self, state: dict = None):
+        """保存服务控制状态到文件（未指定 state 时在锁内复制当前状态）"""
+        if state is None:
+            with self._service_lock:
+                state = dict(self._service_control_state)
         try:
             self.service_control_file.parent.mkdir(parents=True, exist_ok=True)
             with open(self.service_control_file, 'w', encoding='utf-8') as f:
-                json.dump(self._service_control_state, f, ensure_ascii=False, indent=2)
+                json.dump(state, f, ensure_ascii=False, indent=2)
             return True
         except Exception as e:
             print(f"❌ 保存服务控制状态失败: {e}")
@@ -196,17 +239,26 @@ class ConfigManager:
             print(f"❌ 配置文件保存失败: {e}")
             return False
     
+    async def load_config_async(self):
+        """在I/O线程池中加载配置文件，不阻塞事件循环"""
+        return await io_pool.run("config.load", self.load_config)
+    
+    async def save_config_async(self, config):
+        """在I/O线程池中保存配置文件"""
+        return await io_pool.run("config.save", self.save_config, config)
+    
     def get_service_control_status(self, service_key: str) -> bool:
         """获取服务控制状态 - 动态处理，支持多种服务名称匹配"""
-        # 如果服务在内存状态中，使用保存的状态
-        if service_key in self._service_control_state:
-            return self._service_control_state[service_key]
-        
-        # 尝试模糊匹配（支持大小写不敏感匹配）
-        service_key_lower = service_key.lower()
-        for stored_key, status in self._service_control_state.items():
-            if stored_key.lower() == service_key_lower:
-                return status
+        with self._service_lock:
+            # 如果服务在内存状态中，使用保存的状态
+            if service_key in self._service_control_state:
+                return self._service_control_state[service_key]
+            
+            # 尝试模糊匹配（支持大小写不敏感匹配）
+            service_key_lower = service_key.lower()
+            for stored_key, status in self._service_control_state.items():
+                if stored_key.lower() == service_key_lower:
+                    return status
         
         # 新服务默认禁用（避免意外触发限速）
         return False
@@ -214,13 +266,22 @@ class ConfigManager:
     def set_service_control_status(self, service_key: str, enabled: bool):
         """设置服务控制状态 - 动态处理"""
         # 更新内存状态
-        self._service_control_state[service_key] = enabled
+        with self._service_lock:
+            self._service_control_state[service_key] = enabled
         # 持久化到文件
         return self._save_persisted_service_control()
     
+    async def set_service_control_status_async(self, service_key: str, enabled: bool):
+        """设置服务控制状态 - 文件写入在I/O线程池中执行"""
+        with self._service_lock:
+            self._service_control_state[service_key] = enabled
+        # 串行通道按提交顺序写入，写入时才复制状态：Web 请求和控制器线程的服务发现同时保存时，最后一次写入的总是最新状态
+        return await io_pool.run_serial("service_control", "service_control.save", self._save_persisted_service_control)
+    
     def get_all_service_control_status(self):
         """获取所有服务控制状态"""
-        return self._service_control_state.copy()
+        with self._service_lock:
+            return self._service_control_state.copy()
     
     def discover_and_initialize_services(self, detected_services):
         """发现并初始化新服务"""
@@ -241,11 +302,12 @@ class ConfigManager:
                 possible_names.append(service_remark)
             
             # 检查是否有任何名称不在服务控制状态中
-            for name in possible_names:
-                if name and name not in self._service_control_state:
-                    # 新服务默认禁用（避免意外触发限速）
-                    self._service_control_state[name] = False
-                    new_services.append(name)
+            with self._service_lock:
+                for name in possible_names:
+                    if name and name not in self._service_control_state:
+                        # 新服务默认禁用（避免意外触发限速）
+                        self._service_control_state[name] = False
+                        new_services.append(name)
         
         # 延迟保存，避免频繁文件I/O
         if new_services:
@@ -259,57 +321,35 @@ class ConfigManager:
         """异步保存服务控制状态"""
         try:
             await asyncio.sleep(0.1)  # 短暂延迟，避免频繁保存
-            self._save_persisted_service_control()
+            await io_pool.run_serial("service_control", "service_control.save", self._save_persisted_service_control)
         except Exception as e:
             print(f"❌ 异步保存服务控制状态失败: {e}")
 
 class LuckyMonitor:
-    def __init__(self, config_manager):
+    def __init__(self, config_manager, pool=None):
         self.config_manager = config_manager
-        self.session = None
-        self._session_created = False
-    
-    async def get_session(self):
-        """获取或创建 HTTP 会话（连接池复用）"""
-        if self.session is None or self.session.closed:
-            # 配置连接池和超时 - 增强连接韧性
-            timeout = aiohttp.ClientTimeout(
-                total=5,            # 减少总超时到5秒，快速失败
-                connect=3,          # 连接超时减少到3秒
-                sock_read=4,        # 读取超时减少到4秒
-                sock_connect=3      # 套接字连接超时减少到3秒
-            )
-            connector = aiohttp.TCPConnector(
-                verify_ssl=False,
-                limit=15,           # 连接池大小增加到15
-                limit_per_host=8,   # 每个主机的连接数增加到8
-                enable_cleanup_closed=True,
-                family=0  # 允许IPv4和IPv6
-            )
-            # 禁用代理，避免代理问题影响Lucky设备连接
-            self.session = aiohttp.ClientSession(
-                timeout=timeout,
-                connector=connector,
-                raise_for_status=False,
-                trust_env=False,  # 不信任环境变量中的代理设置
-                headers={'Connection': 'keep-alive', 'User-Agent': 'SpeedHiveHome/2.0'}
-            )
-            self._session_created = True
-            logger.debug("✅ Lucky Monitor HTTP 会话已创建（已禁用代理，增强连接韧性）")
-        return self.session
+        # HTTP 连接池：默认使用进程共享的连接池，独立线程中的控制器使用自己的连接池
+        self.pool = pool or http_pool
+        # 响应内容哈希短路：{api_url: (摘要, 上次解析结果)}，内容未变化时跳过解码和解析
+        self._payload_cache = {}
+        self.parse_stats = {"fetches": 0, "parsed": 0, "skipped": 0}
+    
+    async def get_session(self, api_url: str):
+        """获取设备所在主机的 HTTP 会话（共享连接池，按主机隔离）"""
+        return await self.pool.get_session("lucky", api_url)
     
     async def test_connection(self, api_url: str):
         """测试Lucky设备连接"""
         try:
             print(f"🔍 测试Lucky连接: {api_url}")
-            session = await self.get_session()
+            session = await self.get_session(api_url)
             async with session.get(api_url) as response:
                 content = await response.text()
                 print(f"📡 Lucky响应状态: {response.status}")
                 print(f"📡 Lucky响应内容: {content[:500]}...")
                 
                 if response.status == 200:
-                    data = await response.json()
+                    data = await response.json(loads=codec.loads)
                     return {
                         "success": True,
                         "status": "connected",
@@ -338,12 +378,15 @@ class LuckyMonitor:
                 "message": error_msg
             }
     
+    @tracer.traced("lucky.fetch")
     async def get_device_connections(self, device_config: dict, max_retries: int = 2):
         """获取Lucky设备连接数 - 带重试机制和超时控制"""
+        tracer.annotate(device=device_config.get("name"))
         for attempt in range(max_retries):
+            tracer.annotate(attempt=attempt + 1)
             try:
-                session = await self.get_session()
                 api_url = device_config["api_url"]
+                session = await self.get_session(api_url)
                 
                 if attempt > 0:
                     logger.info(f"🔄 {device_config['name']} - 重试采集数据 (尝试 {attempt + 1}/{max_retries})")
@@ -352,19 +395,38 @@ class LuckyMonitor:
                 # 设置更短的超时时间，快速失败
                 timeout = aiohttp.ClientTimeout(total=8, connect=3, sock_read=5)
                 async with session.get(api_url, timeout=timeout) as response:
+                    tracer.annotate(http_status=response.status)
                     if response.status == 200:
-                        data = await response.json()
-                        connections = self._parse_connections(data)
-                        weighted_connections = connections * device_config.get("weight", 1.0)
+                        raw = await response.read()
+                        tracer.annotate(bytes=len(raw))
+                        self.parse_stats["fetches"] += 1
+                        digest = hashlib.blake2b(raw, digest_size=16).digest()
+                        cached = self._payload_cache.get(api_url)
+                        if cached is not None and cached[0] == digest:
+                            # 响应与上次逐字节相同：复用上次的解析结果
+                            self.parse_stats["skipped"] += 1
+                            sample = dict(cached[1])
+                            sample["weighted_connections"] = sample["connections"] * device_config.get("weight", 1.0)
+                            sample["last_update"] = datetime.now().isoformat()
+                            sample["attempt"] = attempt + 1
+                            sample["unchanged"] = True
+                            tracer.annotate(unchanged=True, connections=sample["connections"])
+                            return sample
                         
-                        
-                        # 解析详细的连接信息和服务信息
-                        detailed_connections = self._parse_detailed_connections(data)
-                        services_info = self._parse_lucky_services(data)
+                        with tracer.span("lucky.parse", bytes=len(raw)) as span:
+                            data = codec.loads(raw)
+                            self.parse_stats["parsed"] += 1
+                            connections = self._parse_connections(data)
+                            weighted_connections = connections * device_config.get("weight", 1.0)
+                            
+                            # 解析详细的连接信息和服务信息
+                            detailed_connections = self._parse_detailed_connections(data)
+                            services_info = self._parse_lucky_services(data)
+                            span.set(rules=len(detailed_connections), services=len(services_info))
                         total_download_bytes = sum(conn.get("download_bytes", 0) for conn in detailed_connections)
                         total_upload_bytes = sum(conn.get("upload_bytes", 0) for conn in detailed_connections)
                         
-                        return {
+                        result = {
                             "success": True,
                             "device_name": device_config["name"],
                             "connections": connections,
@@ -377,10 +439,16 @@ class LuckyMonitor:
                             "upload_bytes": total_upload_bytes,
                             "detailed_connections": detailed_connections,
                             "services": services_info,
-                            "attempt": attempt + 1
+                            "attempt": attempt + 1,
+                            "unchanged": False,
+                            "digest": digest.hex()
                         }
+                        self._payload_cache[api_url] = (digest, result)
+                        tracer.annotate(unchanged=False, connections=connections)
+                        return result
                     else:
                         error_msg = f"HTTP {response.status}"
+                        tracer.annotate(error=error_msg)
                         if attempt == max_retries - 1:  # 最后一次尝试
                             print(f"❌ {device_config['name']} - {error_msg} (已重试{max_retries}次)")
                         return {
@@ -399,6 +467,7 @@ class LuckyMonitor:
                 
                 if attempt == max_retries - 1:  # 最后一次尝试
                     logger.error(f"❌ {device_config['name']} - 采集异常 ({error_type}): {error_msg} (已重试{max_retries}次)")
+                    tracer.annotate(error=f"{error_type}: {error_msg}")
                     return {
                         "success": False,
                         "device_name": device_config["name"],
@@ -412,14 +481,14 @@ class LuckyMonitor:
                     }
                 else:
                     logger.warning(f"⚠️ {device_config['name']} - 连接错误 ({error_type}): {error_msg}, 将在 {2 * (attempt + 1)} 秒后重试")
-                    # 如果是连接重置错误，强制重新创建会话
+                    # 连接重置时连接池已被健康跟踪标记淘汰，下次请求只重建该设备主机的连接
                     if "Connection reset" in error_msg or "104" in error_msg:
-                        logger.info(f"🔄 {device_config['name']} - 检测到连接重置，重新创建HTTP会话")
-                        await self.close()
+                        logger.info(f"🔄 {device_config['name']} - 检测到连接重置，将重建该主机的连接池")
                         await asyncio.sleep(1)
             except Exception as e:
                 error_msg = str(e)
                 logger.error(f"❌ {device_config['name']} - 未知异常: {error_msg}")
+                tracer.annotate(error=error_msg)
                 return {
                     "success": False,
                     "device_name": device_config["name"],
@@ -511,12 +580,14 @@ class LuckyMonitor:
                             # 优先使用Remark字段作为服务名称，如果没有则使用Key字段
                             service_name = service_remark if service_remark else service_key
                             
-                            # 从statistics中获取实际连接数
+                            # 从statistics中获取实际连接数和流量计数器
                             actual_connections = 0
+                            proxy_stats = {}
                             if "statistics" in data and rule_key in data["statistics"]:
                                 rule_stats = data["statistics"][rule_key]
                                 if "ProxyList" in rule_stats and service_key in rule_stats["ProxyList"]:
-                                    actual_connections = rule_stats["ProxyList"][service_key].get("Connections", 0)
+                                    proxy_stats = rule_stats["ProxyList"][service_key]
+                                    actual_connections = proxy_stats.get("Connections", 0)
                             
                             # 使用实际连接数，如果没有则使用ProxyList中的连接数
                             final_connections = actual_connections if actual_connections > 0 else connections
@@ -527,6 +598,10 @@ class LuckyMonitor:
                                 "key": service_key,         # 保留Key字段作为技术标识符
                                 "remark": service_remark,   # 保留Remark字段
                                 "connections": final_connections,
+                                "download_bytes": proxy_stats.get("TrafficIn", 0),
+                                "upload_bytes": proxy_stats.get("TrafficOut", 0),
+                                "download_speed": proxy_stats.get("InSpeed", 0),
+                                "upload_speed": proxy_stats.get("OutSpeed", 0),
                                 "service_type": service_type,
                                 "enabled": enabled,
                                 "locations": locations,
@@ -670,28 +745,77 @@ class LuckyMonitor:
             traceback.print_exc()
             return []
     
+    def get_parse_stats(self) -> dict:
+        """响应解析统计：内容未变化而跳过解析的比例"""
+        fetches = self.parse_stats["fetches"]
+        return {
+            **self.parse_stats,
+            "skip_ratio": round(self.parse_stats["skipped"] / fetches, 4) if fetches else 0.0,
+            "devices": len(self._payload_cache)
+        }
+    
     async def close(self):
-        """关闭会话并释放资源"""
-        if self.session and not self.session.closed:
-            await self.session.close()
-            logger.debug("🔒 Lucky Monitor HTTP 会话已关闭")
-        self.session = None
-        self._session_created = False
+        """关闭所有 Lucky 连接池并释放资源"""
+        await self.pool.close("lucky")
+        logger.debug("🔒 Lucky Monitor HTTP 连接池已关闭")
+
+# 启动预热中单个 Lucky 设备 / qBittorrent 实例（建连、登录、读取当前限速）的最长等待时间（秒），
+# 不可达的主机不会推迟其他来源和首次限速决策
+WARM_UP_TIMEOUT = 5
 
 class SpeedController:
     """智能限速控制器 - 核心控制逻辑"""
-    def __init__(self, config_manager, lucky_monitor, qbit_manager):
+    def __init__(self, config_manager, lucky_monitor, qbit_manager, clock=None, history=None, rates=None, targeting_state=None):
         self.config_manager = config_manager
         self.lucky_monitor = lucky_monitor
         self.qbit_manager = qbit_manager
+        # 时钟可注入：仿真模式使用虚拟时钟
+        self.clock = clock or system_clock
+        # Lucky 流量计数器 -> 速率
+        self.rates = rates or RateEngine(clock=self.clock)
+        # 连接数历史存储（可选）
+        self.history = history
+        self._cycle_samples = {}
+        # 每个 Lucky 接口最近一次执行服务发现时的响应摘要
+        self._discovered = {}
+        # 定向限速：只限制匹配分类/标签/Tracker的种子（修改记录持久化到 targeting_state）
+        self.torrent_throttler = TorrentThrottler(qbit_manager, targeting_state)
+        # 比例带宽控制：按 WAN 预算连续调整限速
+        self.bandwidth = BandwidthController()
+        # 多实例总预算分配
+        self.allocator = BudgetAllocator()
+        # 按实例串行化限速推送，最新命令优先
+        self.commands = CommandBus()
         self.is_limited = False
         self.limit_timer = 0
         self.normal_timer = 0
         self.total_connections = 0
+        # 预热结果和重启后首次限速生效耗时（从控制器启动计时）
+        self.warm_up_state = None
+        self._warm_up_task = None
+        self.started_at = None
+        self.first_throttle_after = None
+        # 首次成功采集的时间（就绪检查使用）
+        self.first_collection_at = None
+        self._collection_ok = False
         self.running = False
         self.last_action_time = None
+        # 独立线程运行时每个周期发布一次状态快照，Web 层只读取快照
+        self.publish_snapshots = False
+        self.state_snapshot = None
         logger.info("🎮 速度控制器初始化完成")
     
+    def use_clients(self, lucky_monitor, qbit_manager):
+        """替换 Lucky/qBittorrent 客户端（控制器迁移到独立事件循环时使用该循环自己的客户端）"""
+        self.lucky_monitor = lucky_monitor
+        self.qbit_manager = qbit_manager
+        self.torrent_throttler.qbit_manager = qbit_manager
+    
+    def publish_state(self):
+        """发布状态快照（整体替换引用，其他线程读取到的总是完整快照）"""
+        if self.publish_snapshots:
+            self.state_snapshot = self.get_controller_state()
+    
     async def start(self):
         """启动控制循环"""
         if self.running:
@@ -699,8 +823,17 @@ class SpeedController:
             return
         
         self.running = True
+        self.started_at = self.clock.time()
+        self.publish_state()
         logger.info("🚀 启动自动限速控制循环...")
         
+        try:
+            # Lucky 数据就绪即进入控制循环，qBittorrent 预热与首个控制周期并行
+            with tracer.trace("controller.warm_up"):
+                await self.warm_up(wait_qbit=False)
+        except Exception as e:
+            logger.warning(f"⚠️ 预热失败: {e}")
+        
         try:
             while self.running:
                 await self._control_cycle()
@@ -708,93 +841,259 @@ class SpeedController:
             logger.error(f"❌ 控制循环异常: {e}", exc_info=True)
             self.running = False
     
+    async def warm_up(self, wait_qbit: bool = True):
+        """预热：并发建立所有 Lucky 设备和 qBittorrent 实例的连接并登录，读取各实例当前限速
+        
+        首次限速决策不再承担建连、DNS 和登录开销；控制器按实例的实际限速恢复 is_limited，而不是假定未限速。
+        每个主机最多等待 WARM_UP_TIMEOUT 秒；wait_qbit=False 时 Lucky 数据就绪即返回，
+        qBittorrent 预热在后台完成后再恢复限速状态
+        """
+        started = self.clock.time()
+        config = await self.config_manager.load_config_async()
+        settings = config.get("controller_settings", {})
+        devices = config.get("lucky_devices", [])
+        instances = [i for i in config.get("qbittorrent_instances", []) if i.get("enabled", True)]
+        
+        self.warm_up_state = {
+            "duration": None,
+            "lucky_devices": 0,
+            "qbit_instances": None,
+            "current_limits": {},
+            "restored_limited": self.is_limited
+        }
+        qbit_task = asyncio.create_task(self._warm_up_instances(settings, instances, started))
+        
+        lucky_results = await asyncio.gather(
+            *(asyncio.wait_for(self.lucky_monitor.get_device_connections(device), WARM_UP_TIMEOUT) for device in devices),
+            return_exceptions=True
+        )
+        for device, result in zip(devices, lucky_results):
+            if isinstance(result, asyncio.TimeoutError):
+                logger.warning(f"⚠️ {device.get('name')} - 预热超时（{WARM_UP_TIMEOUT}秒）")
+        
+        targeted = await io_pool.run_serial("targeting", "targeting.load", self.torrent_throttler.load)
+        if targeted:
+            logger.info(f"🎯 加载了 {targeted} 个定向限速种子的修改记录")
+        self._restore_targeted_state(settings)
+        
+        self.warm_up_state.update({
+            "lucky_devices": sum(1 for r in lucky_results if isinstance(r, dict) and r.get("success")),
+            "restored_limited": self.is_limited
+        })
+        logger.info(f"🔥 Lucky 预热完成: {self.warm_up_state['lucky_devices']}/{len(devices)} 个 Lucky 设备, "
+                    f"耗时 {self.clock.time() - started:.2f}s")
+        self._note_first_throttle()
+        
+        if wait_qbit:
+            await qbit_task
+        else:
+            self._warm_up_task = qbit_task
+    
+    async def _warm_up_instances(self, settings: dict, instances: list, started: float):
+        """预热 qBittorrent 实例并按当前限速恢复限速状态（独立 trace，可能在首个控制周期之后完成）"""
+        with tracer.trace("controller.warm_up.qbit", instances=len(instances)):
+            results = await asyncio.gather(
+                *(asyncio.wait_for(self.qbit_manager.warm_up(instance), WARM_UP_TIMEOUT) for instance in instances),
+                return_exceptions=True
+            )
+            limits = {}
+            for instance, result in zip(instances, results):
+                if isinstance(result, asyncio.TimeoutError):
+                    logger.warning(f"⚠️ {instance['name']} - 预热超时（{WARM_UP_TIMEOUT}秒）")
+                elif isinstance(result, Exception):
+                    logger.warning(f"⚠️ {instance['name']} - 预热失败: {result}")
+                elif result is not None:
+                    limits[instance["name"]] = result
+            
+            self._restore_limit_state(settings, limits)
+            self.warm_up_state.update({
+                "duration": round(self.clock.time() - started, 3),
+                "qbit_instances": len(limits),
+                "current_limits": limits,
+                "restored_limited": self.is_limited
+            })
+            logger.info(f"🔥 预热完成: {len(limits)}/{len(instances)} 个 qBittorrent 实例, 耗时 {self.warm_up_state['duration']:.2f}s")
+            self._note_first_throttle()
+            self.publish_state()
+    
+    def _restore_targeted_state(self, settings: dict):
+        """有上次运行定向限速的种子时按限速状态启动，由状态机在无连接时还原这些种子"""
+        if settings.get("control_mode", "binary") == "proportional" or not self.torrent_throttler.applied:
+            return
+        if not self.is_limited:
+            self.is_limited = True
+            logger.warning(f"🔒 {', '.join(self.torrent_throttler.applied)} 有上次运行定向限速的种子，以限速状态启动")
+    
+    def _restore_limit_state(self, settings: dict, limits: dict):
+        """实例的当前全局限速正是本控制器的限速值时，按限速状态启动（之后由状态机决定保持或恢复）
+        
+        用户在 qBittorrent 中手动设置的其他限速不视为限速状态，控制器不会在恢复时覆盖
+        """
+        if settings.get("control_mode", "binary") == "proportional" or settings.get("throttle_mode", "global") == "targeted":
+            # 比例模式由带宽控制器重新推送；定向模式不修改全局限速
+            return
+        if self.is_limited or not limits:
+            return
+        if settings.get("budget_mode", "per_instance") == "global":
+            # 总预算模式：各实例份额按整数 KB/s 向下取整，合计与总预算的差不超过实例数
+            totals = self._limited_totals(settings)
+            slack = len(limits)
+            matched = all(abs(sum(current[direction] for current in limits.values()) - totals[direction]) <= slack
+                          for direction in ("download", "upload"))
+            limited = list(limits) if matched else []
+        else:
+            target = (settings.get("limited_download", 1024), settings.get("limited_upload", 512))
+            limited = [name for name, current in limits.items() if (current["download"], current["upload"]) == target]
+        if limited:
+            self.is_limited = True
+            logger.warning(f"🔒 {', '.join(limited)} 当前为限速值，以限速状态启动")
+        normal = (settings.get("normal_download", 0), settings.get("normal_upload", 0))
+        manual = [name for name, current in limits.items()
+                  if name not in limited and (current["download"], current["upload"]) != normal]
+        if manual:
+            logger.info(f"ℹ️ {', '.join(manual)} 当前限速既非正常值也非限速值，视为手动设置，不作为限速状态")
+    
+    def _note_first_throttle(self):
+        """记录控制器启动到首次限速生效的耗时"""
+        if self.is_limited and self.first_throttle_after is None and self.started_at is not None:
+            self.first_throttle_after = round(self.clock.time() - self.started_at, 3)
+            logger.info(f"⏱️ 启动后首次限速生效: {self.first_throttle_after:.2f}s")
+    
     async def stop(self):
         """停止控制循环"""
         logger.info("⏹️ 停止控制循环...")
         self.running = False
+        if self._warm_up_task is not None and not self._warm_up_task.done():
+            self._warm_up_task.cancel()
+        self.publish_state()
     
     async def _control_cycle(self):
-        """单次控制周期"""
+        """单次控制周期（决策过程记录为一条 trace，不含轮询等待）"""
         try:
-            config = self.config_manager.load_config()
-            settings = config.get("controller_settings", {})
+            with tracer.trace("controller.cycle"):
+                poll_interval = await self._decide()
             
-            poll_interval = settings.get("poll_interval", 2)
-            limit_on_delay = settings.get("limit_on_delay", 5)
-            limit_off_delay = settings.get("limit_off_delay", 30)
-            
-            # 1. 采集所有 Lucky 设备的连接数
-            self.total_connections = await self._collect_total_connections(config)
+            # 3. 等待下次轮询
+            await self.clock.sleep(poll_interval)
             
-            # 加权限速逻辑：加权总连接数 > 0 即触发限速
-            has_connections = self.total_connections > 0
+        except Exception as e:
+            logger.error(f"❌ 控制周期执行失败: {e}", exc_info=True)
+            await self.clock.sleep(5)  # 出错后等待5秒再重试
+    
+    async def _decide(self) -> float:
+        """采集并执行状态机，返回本周期的轮询间隔"""
+        with tracer.span("config.load"):
+            config = await self.config_manager.load_config_async()
+        settings = config.get("controller_settings", {})
+        tracer.configure(get_tracing_settings(settings))
+        
+        poll_interval = settings.get("poll_interval", 2)
+        limit_on_delay = settings.get("limit_on_delay", 5)
+        limit_off_delay = settings.get("limit_off_delay", 30)
+        
+        # 1. 采集所有 Lucky 设备的连接数
+        self.total_connections = await self._collect_total_connections(config)
+        if self.first_collection_at is None and self._collection_ok:
+            self.first_collection_at = self.clock.now()
+            logger.info("✅ 首次采集完成，控制器已就绪")
+        
+        # 加权限速逻辑：加权总连接数 > 0 即触发限速
+        has_connections = self.total_connections > 0
+        
+        # 详细日志显示限速判断条件
+        logger.info(f"🔍 限速判断: 加权总连接数={self.total_connections:.1f} -> 触发限速={has_connections}")
+        
+        if settings.get("control_mode", "binary") == "proportional":
+            # 比例带宽控制模式：不使用开关状态机
+            await self._proportional_control(config, settings)
+        
+        # 2. 状态机逻辑
+        elif has_connections and not self.is_limited:
+            # 检测到连接，开始限速倒计时
+            self.limit_timer += poll_interval
+            self.normal_timer = 0
             
-            # 详细日志显示限速判断条件
-            logger.info(f"🔍 限速判断: 加权总连接数={self.total_connections:.1f} -> 触发限速={has_connections}")
+            logger.info(f"⚠️ 检测到 {self.total_connections:.1f} 个加权连接，限速倒计时: {self.limit_timer}/{limit_on_delay}秒")
             
-            # 2. 状态机逻辑
-            if has_connections and not self.is_limited:
-                # 检测到连接，开始限速倒计时
-                self.limit_timer += poll_interval
-                self.normal_timer = 0
-                
-                logger.info(f"⚠️ 检测到 {self.total_connections:.1f} 个加权连接，限速倒计时: {self.limit_timer}/{limit_on_delay}秒")
-                
-                if self.limit_timer >= limit_on_delay:
-                    # 触发限速
-                    await self._apply_limited_mode(settings)
-                    self.is_limited = True
-                    self.limit_timer = 0
-                    
-            elif not has_connections and self.is_limited:
-                # 无连接，开始恢复倒计时
-                self.normal_timer += poll_interval
+            if self.limit_timer >= limit_on_delay:
+                # 触发限速
+                await self._apply_limited_mode(settings)
+                self.is_limited = True
                 self.limit_timer = 0
                 
-                logger.info(f"✅ 无活跃连接，恢复倒计时: {self.normal_timer}/{limit_off_delay}秒")
-                
-                if self.normal_timer >= limit_off_delay:
-                    # 恢复全速
-                    await self._apply_normal_mode(settings)
-                    self.is_limited = False
-                    self.normal_timer = 0
-                    
-            elif has_connections and self.is_limited:
-                # 保持限速状态，重置恢复计时器
+        elif not has_connections and self.is_limited:
+            # 无连接，开始恢复倒计时
+            self.normal_timer += poll_interval
+            self.limit_timer = 0
+            
+            logger.info(f"✅ 无活跃连接，恢复倒计时: {self.normal_timer}/{limit_off_delay}秒")
+            
+            if self.normal_timer >= limit_off_delay:
+                # 恢复全速
+                await self._apply_normal_mode(settings)
+                self.is_limited = False
                 self.normal_timer = 0
-                logger.debug(f"🔒 保持限速状态，当前加权连接: {self.total_connections:.1f}")
                 
-            else:
-                # 保持正常状态，重置限速计时器
-                self.limit_timer = 0
-                logger.debug(f"✨ 保持正常状态，无活跃连接")
-            
-            # 3. 等待下次轮询
-            await asyncio.sleep(poll_interval)
+        elif has_connections and self.is_limited:
+            # 保持限速状态，重置恢复计时器
+            self.normal_timer = 0
+            logger.debug(f"🔒 保持限速状态，当前加权连接: {self.total_connections:.1f}")
+            if settings.get("throttle_mode", "global") == "targeted":
+                # 定向模式下定期匹配新加入的种子
+                await self._apply_targeted_limits(config, settings, force=False)
+            elif settings.get("budget_mode", "per_instance") == "global":
+                # 总预算模式下按实例实时速度定期重新分配
+                await self._apply_budget(config, settings, self._limited_totals(settings), force=False)
             
-        except Exception as e:
-            logger.error(f"❌ 控制周期执行失败: {e}", exc_info=True)
-            await asyncio.sleep(5)  # 出错后等待5秒再重试
+        else:
+            # 保持正常状态，重置限速计时器
+            self.limit_timer = 0
+            logger.debug(f"✨ 保持正常状态，无活跃连接")
+        
+        self._note_first_throttle()
+        tracer.annotate(
+            connections=self.total_connections,
+            mode=settings.get("control_mode", "binary"),
+            is_limited=self.is_limited,
+            limit_timer=self.limit_timer,
+            normal_timer=self.normal_timer
+        )
+        
+        # 记录本周期样本到历史存储
+        self._record_cycle_samples()
+        self.publish_state()
+        return poll_interval
     
+    @tracer.traced("lucky.collect")
     async def _collect_total_connections(self, config: dict) -> float:
         """采集所有设备的总连接数（根据服务级别控制和设备权重计算）"""
         devices = config.get("lucky_devices", [])
         total_weighted_connections = 0.0
         total_raw_connections = 0.0
+        samples = {}
+        now = self.clock.time()
+        collected = 0
         
         for device in devices:
             try:
                 result = await self.lucky_monitor.get_device_connections(device)
                 if result.get("success"):
+                    collected += 1
                     # 获取设备权重
                     device_weight = device.get("weight", 1.0)
                     
                     # 获取详细连接信息
                     detailed_connections = result.get("detailed_connections", [])
                     device_raw_connections = 0.0
+                    rate_keys = set()
                     
-                    # 首先发现并初始化新服务
-                    self.config_manager.discover_and_initialize_services(detailed_connections)
+                    # 首先发现并初始化新服务（与上次执行发现时的响应相同时服务列表也不会变化；
+                    # 响应缓存与预热、状态接口共用，unchanged 不代表控制器已对该响应执行过发现）
+                    digest = result.get("digest")
+                    if digest is None or self._discovered.get(result.get("api_url")) != digest:
+                        with tracer.span("services.discover", device=device.get("name"), connections=len(detailed_connections)):
+                            self.config_manager.discover_and_initialize_services(detailed_connections)
+                        self._discovered[result.get("api_url")] = digest
                     
                     # 只累加启用控制的服务连接数
                     service_control_state = self.config_manager.get_all_service_control_status()
@@ -812,8 +1111,15 @@ class SpeedController:
                         
                         if is_service_enabled:
                             device_raw_connections += conn.get("connections", 0)
+                            rate_key = f"lucky/{device.get('name')}/{service_key or service_name}"
+                            self.rates.observe(f"{rate_key}/in", conn.get("download_bytes", 0), now)
+                            self.rates.observe(f"{rate_key}/out", conn.get("upload_bytes", 0), now)
+                            rate_keys.update((f"{rate_key}/in", f"{rate_key}/out"))
                         else:
                             logger.debug(f"📊 {device.get('name')} - 服务 {service_name or service_key} 禁用，连接数: 0")
+                        
+                        if self.history is not None:
+                            samples[f"lucky/{device.get('name')}/svc/{service_name or service_key}"] = conn.get("connections", 0)
                     
                     # 计算加权连接数
                     device_weighted_connections = device_raw_connections * device_weight
@@ -822,37 +1128,176 @@ class SpeedController:
                     
                     total_raw_connections += device_raw_connections
                     total_weighted_connections += device_weighted_connections
+                    # 采集成功的设备丢弃已删除或禁用的服务；采集失败的设备保留序列，由 expire 按时间淘汰
+                    self.rates.forget(f"lucky/{device.get('name')}/", rate_keys)
+                    samples[f"lucky/{device.get('name')}/total"] = device_raw_connections
+                    samples[f"lucky/{device.get('name')}/in_rate"] = self.rates.total(f"lucky/{device.get('name')}/", "/in")
+                    samples[f"lucky/{device.get('name')}/out_rate"] = self.rates.total(f"lucky/{device.get('name')}/", "/out")
                     
             except Exception as e:
                 logger.error(f"❌ 采集设备 {device.get('name')} 失败: {e}")
         
         # 保存原始连接数到控制器实例，供API使用
         self.total_raw_connections = total_raw_connections
+        self._cycle_samples = samples
+        self.rates.expire("lucky/", now)
+        self._collection_ok = collected > 0 or not devices
+        tracer.annotate(devices=len(devices), collected=collected, raw_connections=total_raw_connections)
         
         # 使用加权连接数进行限速判断，但保留原始连接数用于日志显示
         logger.info(f"📊 原始总连接数: {total_raw_connections:.1f}, 加权总连接数: {total_weighted_connections:.1f}")
         return total_weighted_connections
     
     
+    def _record_cycle_samples(self):
+        """将本周期的设备/服务连接数和限速状态追加到历史存储"""
+        if self.history is None:
+            return
+        samples = self._cycle_samples
+        samples["controller/weighted_connections"] = self.total_connections
+        samples["controller/raw_connections"] = getattr(self, 'total_raw_connections', self.total_connections)
+        samples["controller/is_limited"] = 1 if self.is_limited else 0
+        try:
+            # 使用注入的时钟：仿真回放时历史样本落在虚拟时间上（clock.time() 是单调时间，历史存储需要墙钟时间戳）
+            self.history.append(self.clock.now().timestamp(), samples)
+        except Exception as e:
+            logger.error(f"❌ 记录历史样本失败: {e}")
+        self._cycle_samples = {}
+    
+    @tracer.traced("controller.proportional")
+    async def _proportional_control(self, config: dict, settings: dict):
+        """比例带宽控制：Lucky 流量 + qBittorrent 实际速度 -> PI -> qBittorrent 限速"""
+        now = self.clock.time()
+        lucky_rates = self.bandwidth.observe_lucky({
+            "in": self.rates.total("lucky/", "/in"),
+            "out": self.rates.total("lucky/", "/out")
+        })
+        instances = [i for i in config.get("qbittorrent_instances", []) if i.get("enabled", True)]
+        
+        instance_rates = await self._instance_rates(instances, max_age=0)
+        qbit_rates = {
+            "upload": sum(r["upload"] for r in instance_rates.values()),
+            "download": sum(r["download"] for r in instance_rates.values())
+        }
+        
+        changes = self.bandwidth.update(settings, qbit_rates, now)
+        if instances and (changes or self.allocator.due(now, get_budget_settings(settings))):
+            # 总限速按预算策略分配到各实例（KB/s，0 表示不限速）
+            totals = {}
+            for direction, normal_key in (("download", "normal_download"), ("upload", "normal_upload")):
+                total = getattr(self.bandwidth, direction).pushed
+                totals[direction] = total / 1024 if total else settings.get(normal_key, 0)
+            if changes:
+                logger.info(f"📉 带宽控制 - Lucky 上行 {lucky_rates['out'] / 1024:.0f} KB/s, qB 上行 {qbit_rates['upload'] / 1024:.0f} KB/s -> "
+                            f"总限速 下载: {totals['download']:.0f} KB/s, 上传: {totals['upload']:.0f} KB/s")
+            # 总限速变化时立即重新分配，不等分配间隔（否则已记录的新总限速不会被推送）
+            await self._apply_budget(config, settings, totals, force=bool(changes), rates=instance_rates)
+        
+        self.is_limited = self.bandwidth.is_limiting
+        if self.history is not None:
+            self._cycle_samples["bandwidth/lucky_out"] = lucky_rates["out"]
+            self._cycle_samples["bandwidth/lucky_in"] = lucky_rates["in"]
+            self._cycle_samples["bandwidth/qbit_upload"] = qbit_rates["upload"]
+            self._cycle_samples["bandwidth/qbit_download"] = qbit_rates["download"]
+            if self.bandwidth.upload.pushed is not None:
+                self._cycle_samples["bandwidth/upload_limit"] = self.bandwidth.upload.pushed
+            if self.bandwidth.download.pushed is not None:
+                self._cycle_samples["bandwidth/download_limit"] = self.bandwidth.download.pushed
+    
+    @staticmethod
+    def _limited_totals(settings: dict) -> dict:
+        return {"download": settings.get("limited_download", 1024), "upload": settings.get("limited_upload", 512)}
+    
+    async def _instance_rates(self, instances: list, max_age: float, smoothed: bool = False) -> dict:
+        """各实例实时速度 {实例名: {"download": B/s, "upload": B/s}}，优先使用缓存的传输信息"""
+        rates = {}
+        for instance in instances:
+            info = await self.qbit_manager.get_transfer_info(instance, max_age=max_age)
+            if info:
+                rates[instance["name"]] = self.qbit_manager.get_rates(instance, info, smoothed=smoothed)
+        return rates
+    
+    @tracer.traced("controller.budget")
+    async def _apply_budget(self, config: dict, settings: dict, totals: dict, force: bool = True, rates: dict = None) -> int:
+        """把总预算分配到各实例并推送份额变化超过阈值的实例，返回推送成功的实例数"""
+        options = get_budget_settings(settings)
+        now = self.clock.time()
+        if not force and not self.allocator.due(now, options):
+            return 0
+        if force:
+            self.allocator.reset()
+        
+        instances = [i for i in config.get("qbittorrent_instances", []) if i.get("enabled", True)]
+        if rates is None:
+            rates = await self._instance_rates(instances, max_age=options["interval"], smoothed=True)
+        changes = self.allocator.plan(totals, instances, rates, options, now)
+        
+        success_count = 0
+        for instance in instances:
+            share = changes.get(instance["name"])
+            if share is None:
+                continue
+            logger.info(f"⚖️ {instance['name']} 预算份额 ({options['strategy']}) - 下载: {share['download']} KB/s, 上传: {share['upload']} KB/s")
+            if await self._push_limits(instance, share["download"], share["upload"]):
+                success_count += 1
+            else:
+                self.allocator.forget(instance["name"])
+                logger.error(f"❌ {instance['name']} 预算份额设置失败")
+        if changes:
+            self.last_action_time = self.clock.now()
+        return success_count
+    
+    @tracer.traced("controller.targeted")
+    async def _apply_targeted_limits(self, config: dict, settings: dict, force: bool = True) -> int:
+        """对所有实例应用定向限速，返回成功的实例数"""
+        targeting = get_targeting_settings(settings)
+        success_count = 0
+        for instance in config.get("qbittorrent_instances", []):
+            if not instance.get("enabled", True):
+                continue
+            try:
+                if await self._push_targeted(instance, targeting, force):
+                    success_count += 1
+                else:
+                    logger.error(f"❌ {instance['name']} 定向限速设置失败")
+            except Exception as e:
+                logger.error(f"❌ {instance['name']} 定向限速异常: {e}")
+        return success_count
+    
+    @tracer.traced("controller.apply_limited")
     async def _apply_limited_mode(self, settings: dict):
         """应用限速模式"""
+        if settings.get("throttle_mode", "global") == "targeted":
+            targeting = get_targeting_settings(settings)
+            logger.warning(f"🚨 进入定向限速模式 - 单种下载: {targeting['download_limit']} KB/s, 单种上传: {targeting['upload_limit']} KB/s")
+            config = await self.config_manager.load_config_async()
+            success_count = await self._apply_targeted_limits(config, settings)
+            self.last_action_time = self.clock.now()
+            logger.info(f"📊 定向限速应用完成: {success_count} 个实例成功")
+            return
+        
         download_limit = settings.get("limited_download", 1024)
         upload_limit = settings.get("limited_upload", 512)
         
-        logger.warning(f"🚨 进入限速模式 - 下载: {download_limit} KB/s, 上传: {upload_limit} KB/s")
-        
-        config = self.config_manager.load_config()
+        config = await self.config_manager.load_config_async()
         instances = config.get("qbittorrent_instances", [])
         
+        if settings.get("budget_mode", "per_instance") == "global":
+            # 总预算模式：限速值为所有实例合计，按策略分配
+            logger.warning(f"🚨 进入限速模式（总预算）- 下载: {download_limit} KB/s, 上传: {upload_limit} KB/s")
+            success_count = await self._apply_budget(config, settings, self._limited_totals(settings))
+            logger.info(f"📊 总预算分配完成: {success_count} 个实例成功")
+            return
+        
+        logger.warning(f"🚨 进入限速模式 - 下载: {download_limit} KB/s, 上传: {upload_limit} KB/s")
+        
         success_count = 0
         for instance in instances:
             if not instance.get("enabled", True):
                 continue
                 
             try:
-                success = await self.qbit_manager.set_speed_limits(
-                    instance, download_limit, upload_limit
-                )
+                success = await self._push_limits(instance, download_limit, upload_limit)
                 if success:
                     success_count += 1
                     logger.info(f"✅ {instance['name']} 限速设置成功")
@@ -861,17 +1306,22 @@ class SpeedController:
             except Exception as e:
                 logger.error(f"❌ {instance['name']} 限速设置异常: {e}")
         
-        self.last_action_time = datetime.now()
+        self.last_action_time = self.clock.now()
+        tracer.annotate(instances=len(instances), succeeded=success_count)
         logger.info(f"📊 限速应用完成: {success_count}/{len(instances)} 个实例成功")
     
+    @tracer.traced("controller.apply_normal")
     async def _apply_normal_mode(self, settings: dict):
         """应用正常模式（全速）"""
         download_limit = settings.get("normal_download", 0)
         upload_limit = settings.get("normal_upload", 0)
+        # 定向模式只还原被修改过的种子，不写全局限速
+        restore_global = settings.get("throttle_mode", "global") != "targeted"
         
+        self.allocator.reset()
         logger.info(f"🎉 恢复全速模式 - 下载: {'不限速' if download_limit == 0 else str(download_limit) + ' KB/s'}, 上传: {'不限速' if upload_limit == 0 else str(upload_limit) + ' KB/s'}")
         
-        config = self.config_manager.load_config()
+        config = await self.config_manager.load_config_async()
         instances = config.get("qbittorrent_instances", [])
         
         success_count = 0
@@ -882,7 +1332,7 @@ class SpeedController:
                 continue
                 
             # 尝试恢复，带重试机制
-            success = await self._restore_instance_with_retry(instance, download_limit, upload_limit)
+            success = await self._restore_instance_with_retry(instance, download_limit, upload_limit, restore_global=restore_global)
             
             if success:
                 success_count += 1
@@ -891,30 +1341,62 @@ class SpeedController:
                 failed_instances.append(instance)
                 logger.error(f"❌ {instance['name']} 恢复全速失败")
         
-        self.last_action_time = datetime.now()
+        self.last_action_time = self.clock.now()
+        tracer.annotate(instances=len(instances), succeeded=success_count)
         logger.info(f"📊 全速恢复完成: {success_count}/{len(instances)} 个实例成功")
         
         # 如果有失败的实例，记录并尝试降级处理
         if failed_instances:
-            await self._handle_failed_instances(failed_instances, download_limit, upload_limit)
+            await self._handle_failed_instances(failed_instances, download_limit, upload_limit, restore_global)
+    
+    async def _push_limits(self, instance: dict, download_limit: int, upload_limit: int) -> bool:
+        """经命令总线推送实例限速：新的期望状态会取消仍在执行的旧推送"""
+        return await self.commands.submit(
+            instance["name"], ("limits", download_limit, upload_limit),
+            lambda: self.qbit_manager.set_speed_limits(instance, download_limit, upload_limit)
+        )
+    
+    async def _push_targeted(self, instance: dict, targeting: dict, force: bool = True) -> bool:
+        """经命令总线应用定向限速：与全局推送、恢复共用实例通道，恢复命令会取消仍在执行的定向推送"""
+        return await self.commands.submit(
+            instance["name"], ("targeted", targeting["download_limit"], targeting["upload_limit"]),
+            lambda: self.torrent_throttler.apply(instance, targeting, self.clock.time(), force=force)
+        )
+    
+    async def _restore_instance_with_retry(self, instance: dict, download_limit: int, upload_limit: int, max_retries: int = 3,
+                                           restore_global: bool = True) -> bool:
+        """带重试机制的实例恢复（整个重试过程作为一条命令，可被更新的限速命令取消）
+        
+        restore_global=False 时只还原定向限速的种子，不写全局限速
+        """
+        return await self.commands.submit(
+            instance["name"], ("restore", download_limit, upload_limit, restore_global),
+            lambda: self._restore_attempts(instance, download_limit, upload_limit, max_retries, restore_global)
+        )
     
-    async def _restore_instance_with_retry(self, instance: dict, download_limit: int, upload_limit: int, max_retries: int = 3) -> bool:
-        """带重试机制的实例恢复"""
+    @tracer.traced("qbit.restore")
+    async def _restore_attempts(self, instance: dict, download_limit: int, upload_limit: int, max_retries: int,
+                                restore_global: bool = True) -> bool:
+        tracer.annotate(instance=instance["name"], download=download_limit, upload=upload_limit, restore_global=restore_global)
         for attempt in range(max_retries):
+            tracer.annotate(attempt=attempt + 1)
             try:
                 logger.info(f"🔄 {instance['name']} - 恢复尝试 {attempt + 1}/{max_retries}")
                 
+                # 先还原定向限速修改过的种子
+                if not await self.torrent_throttler.restore(instance):
+                    raise RuntimeError("定向限速种子还原失败")
+                if not restore_global:
+                    logger.info(f"✅ {instance['name']} - 定向限速种子已还原 (尝试 {attempt + 1})")
+                    return True
+                
                 # 如果是重试，先清除可能的过期缓存
                 if attempt > 0:
-                    instance_key = f"{instance['host']}_{instance['username']}"
-                    if instance_key in self.qbit_manager.cookies:
-                        del self.qbit_manager.cookies[instance_key]
-                    if instance_key in self.qbit_manager.sid_cache:
-                        del self.qbit_manager.sid_cache[instance_key]
+                    self.qbit_manager.invalidate_auth(instance)
                     logger.info(f"🔄 {instance['name']} - 已清除缓存，准备重新认证")
                     
                     # 等待一段时间再重试
-                    await asyncio.sleep(2 * attempt)
+                    await self.clock.sleep(2 * attempt)
                 
                 success = await self.qbit_manager.set_speed_limits(instance, download_limit, upload_limit)
                 
@@ -928,9 +1410,11 @@ class SpeedController:
                 logger.error(f"❌ {instance['name']} - 恢复异常 (尝试 {attempt + 1}): {e}")
         
         logger.error(f"❌ {instance['name']} - 所有重试均失败")
+        tracer.annotate(error="所有重试均失败")
         return False
     
-    async def _handle_failed_instances(self, failed_instances: list, download_limit: int, upload_limit: int):
+    async def _handle_failed_instances(self, failed_instances: list, download_limit: int, upload_limit: int,
+                                       restore_global: bool = True):
         """处理恢复失败的实例"""
         logger.warning(f"🚨 {len(failed_instances)} 个实例恢复失败，开始降级处理")
         
@@ -943,8 +1427,12 @@ class SpeedController:
                 test_result = await self.qbit_manager.test_connection(instance)
                 if test_result.get("success"):
                     logger.info(f"✅ {instance_name} - 连接测试成功，尝试最后一次恢复")
-                    # 最后一次尝试
-                    success = await self.qbit_manager.set_speed_limits(instance, download_limit, upload_limit)
+                    # 最后一次尝试（定向模式只还原种子，不写全局限速）
+                    if restore_global:
+                        success = await self._push_limits(instance, download_limit, upload_limit)
+                    else:
+                        success = await self._restore_instance_with_retry(instance, download_limit, upload_limit,
+                                                                          max_retries=1, restore_global=False)
                     if success:
                         logger.info(f"✅ {instance_name} - 最终恢复成功")
                         continue
@@ -963,10 +1451,9 @@ class SpeedController:
         """记录失败的实例到文件"""
         try:
             failed_file = Path("data/logs/failed_instances.json")
-            failed_file.parent.mkdir(parents=True, exist_ok=True)
             
             failure_record = {
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": self.clock.now().isoformat(),
                 "instance": instance,
                 "target_limits": {
                     "download": download_limit,
@@ -976,31 +1463,39 @@ class SpeedController:
                 "status": "failed"
             }
             
-            # 读取现有记录
-            existing_records = []
-            if failed_file.exists():
-                try:
-                    with open(failed_file, 'r', encoding='utf-8') as f:
-                        existing_records = json.load(f)
-                except:
-                    existing_records = []
-            
-            # 添加新记录
-            existing_records.append(failure_record)
-            
-            # 只保留最近50条记录
-            if len(existing_records) > 50:
-                existing_records = existing_records[-50:]
-            
-            # 写入文件
-            with open(failed_file, 'w', encoding='utf-8') as f:
-                json.dump(existing_records, f, indent=2, ensure_ascii=False)
+            # 读-改-写操作在串行通道中执行，多个实例同时失败时不会互相覆盖记录
+            await io_pool.run_serial("failed_instances", "failed_instances.append", self._append_failed_record, failed_file, failure_record)
             
             logger.info(f"📝 {instance['name']} - 失败记录已保存到 {failed_file}")
             
         except Exception as e:
             logger.error(f"❌ 保存失败记录异常: {e}")
     
+    @staticmethod
+    def _append_failed_record(failed_file: Path, failure_record: dict):
+        """追加失败记录到文件（阻塞操作，在I/O线程池中执行）"""
+        failed_file.parent.mkdir(parents=True, exist_ok=True)
+        
+        # 读取现有记录
+        existing_records = []
+        if failed_file.exists():
+            try:
+                with open(failed_file, 'r', encoding='utf-8') as f:
+                    existing_records = json.load(f)
+            except:
+                existing_records = []
+        
+        # 添加新记录
+        existing_records.append(failure_record)
+        
+        # 只保留最近50条记录
+        if len(existing_records) > 50:
+            existing_records = existing_records[-50:]
+        
+        # 写入文件
+        with open(failed_file, 'w', encoding='utf-8') as f:
+            json.dump(existing_records, f, indent=2, ensure_ascii=False)
+    
     async def _send_failure_alert(self, instance: dict):
         """发送失败告警（预留接口）"""
         # 这里可以扩展为发送邮件、微信通知等
@@ -1016,45 +1511,43 @@ class SpeedController:
             "limit_timer": self.limit_timer,
             "normal_timer": self.normal_timer,
             "last_action_time": self.last_action_time.isoformat() if self.last_action_time else None,
-            "status": "限速中" if self.is_limited else "正常运行"
+            "status": "限速中" if self.is_limited else "正常运行",
+            "targeted_torrents": self.torrent_throttler.get_state(),
+            "bandwidth": self.bandwidth.get_state(),
+            "budget_shares": self.allocator.get_state(),
+            "warm_up": self.warm_up_state,
+            "first_throttle_after": self.first_throttle_after,
+            "commands": self.commands.get_state()
         }
 
+# app/setPreferences 支持 dl_limit/up_limit（bytes/s）的最低 WebUI API 版本
+PREFERENCES_MIN_WEBAPI = (2, 0)
+# 备用速度限制模式缓存有效期（秒）：预热和状态轮询时刷新，推送时只在过期后才读取
+SPEED_MODE_TTL = 60
+
 class QBittorrentManager:
-    def __init__(self, config_manager):
+    def __init__(self, config_manager, pool=None):
         self.config_manager = config_manager
-        self.session = None
-        self._session_created = False
+        self.pool = pool or http_pool
         self.cookies = {}  # 存储每个实例的认证 Cookie (持久化缓存)
         self.sid_cache = {}  # SID缓存: {instance_key: {'sid': xxx, 'timestamp': xxx}}
         self.sid_lifetime = 3600  # SID 生命周期（秒），默认1小时
+        self.torrent_cache = {}  # 种子列表缓存: {instance_key: {'torrents': [...], 'timestamp': xxx}}
+        self.transfer_cache = {}  # 传输信息缓存: {instance_key: {'info': {...}, 'timestamp': xxx}}
+        self.rates = rate_engine  # dl_info_data/up_info_data 计数器 -> 速率
+        self.webapi_versions = {}  # WebUI API 版本: {instance_key: (2, 9, 3)}
+        self.limit_strategies = {}  # 全局限速写入方式: {instance_key: "preferences" | "transfer"}
+        self.speed_modes = {}  # 备用速度限制模式: {instance_key: {'mode': 0 | 1, 'timestamp': xxx}}
     
-    async def get_session(self):
-        """获取或创建 HTTP 会话（连接池复用）"""
-        if self.session is None or self.session.closed:
-            timeout = aiohttp.ClientTimeout(
-                total=15,           # 总超时增加到15秒
-                connect=8,          # 连接超时增加到8秒
-                sock_read=10,       # 读取超时增加到10秒
-                sock_connect=8      # 套接字连接超时
-            )
-            connector = aiohttp.TCPConnector(
-                verify_ssl=False,
-                limit=25,           # 连接池大小增加到25
-                limit_per_host=12,  # 每个主机的连接数增加到12
-                enable_cleanup_closed=True,
-                family=0  # 允许IPv4和IPv6
-            )
-            # 禁用代理，避免代理问题影响qBittorrent连接
-            self.session = aiohttp.ClientSession(
-                timeout=timeout,
-                connector=connector,
-                raise_for_status=False,
-                trust_env=False,  # 不信任环境变量中的代理设置
-                headers={'Connection': 'keep-alive', 'User-Agent': 'SpeedHiveHome/2.0'}
-            )
-            self._session_created = True
-            logger.debug("✅ qBittorrent Manager HTTP 会话已创建（已禁用代理，增强连接韧性）")
-        return self.session
+    async def get_session(self, instance_config: dict):
+        """获取实例所在主机的 HTTP 会话（共享连接池，按主机隔离）"""
+        return await self.pool.get_session("qbit", instance_config["host"])
+    
+    def invalidate_auth(self, instance_config: dict):
+        """清除单个实例的认证缓存（Cookie 和 SID），其他实例不受影响"""
+        instance_key = f"{instance_config['host']}_{instance_config['username']}"
+        self.cookies.pop(instance_key, None)
+        self.sid_cache.pop(instance_key, None)
     
     def _is_sid_valid(self, instance_key: str) -> bool:
         """检查缓存的SID是否仍然有效"""
@@ -1096,10 +1589,12 @@ class QBittorrentManager:
         else:
             return None
     
+    @tracer.traced("qbit.login")
     async def login_to_qbit(self, instance_config: dict) -> bool:
         """登录到 qBittorrent 并保存 Cookie"""
+        tracer.annotate(instance=instance_config["name"])
         try:
-            session = await self.get_session()
+            session = await self.get_session(instance_config)
             instance_key = f"{instance_config['host']}_{instance_config['username']}"
             
             # 登录 - 使用表单格式 (application/x-www-form-urlencoded)
@@ -1121,6 +1616,7 @@ class QBittorrentManager:
             # 使用 data 参数发送表单数据
             async with session.post(login_url, data=login_data, headers=headers) as response:
                 login_content = await response.text()
+                tracer.annotate(http_status=response.status)
                 print(f"🔑 登录响应状态: {response.status}")
                 print(f"🔑 登录响应内容: {login_content}")
                 print(f"🔑 响应头: {dict(response.headers)}")
@@ -1215,7 +1711,7 @@ class QBittorrentManager:
         try:
             print(f"🔍 测试QB连接: {instance_config['host']}")
             
-            session = await self.get_session()
+            session = await self.get_session(instance_config)
             
             # 使用缓存机制获取有效的 Cookie（只在需要时才登录）
             cookies = await self.get_valid_cookies(instance_config)
@@ -1242,7 +1738,7 @@ class QBittorrentManager:
                     }
                 elif transfer_response.status == 403:
                     # Cookie 可能过期，清除并重试
-                    del self.cookies[instance_key]
+                    self.invalidate_auth(instance_config)
                     return {
                         "success": False,
                         "status": "forbidden",
@@ -1263,8 +1759,11 @@ class QBittorrentManager:
                 "message": error_msg
             }
     
-    async def get_instance_status(self, instance_config: dict, max_retries: int = 3):
-        """获取qBittorrent实例状态 - 带重试机制"""
+    async def get_instance_status(self, instance_config: dict, max_retries: int = 3, torrents_max_age: float = 0):
+        """获取qBittorrent实例状态 - 带重试机制
+
+        torrents_max_age > 0 时种子计数使用未过期的种子列表缓存，只在缓存过期时重新下载 torrents/info
+        """
         for attempt in range(max_retries):
             try:
                 if attempt > 0:
@@ -1273,7 +1772,7 @@ class QBittorrentManager:
                 else:
                     logger.debug(f"🔍 采集QB状态: {instance_config['name']}")
                 
-                session = await self.get_session()
+                session = await self.get_session(instance_config)
                 
                 # 使用缓存机制获取有效的 Cookie
                 cookies = await self.get_valid_cookies(instance_config)
@@ -1298,16 +1797,27 @@ class QBittorrentManager:
                 try:
                     async with session.get(transfer_url, cookies=cookies, timeout=aiohttp.ClientTimeout(total=10)) as transfer_response:
                         if transfer_response.status == 200:
-                            transfer_info = await transfer_response.json()
+                            transfer_info = await transfer_response.json(loads=codec.loads)
+                            self._cache_transfer(instance_config, transfer_info)
+                            instance_rates = self.get_rates(instance_config, transfer_info, smoothed=True)
+                            if self.limit_strategies.get(f"{instance_config['host']}_{instance_config['username']}") == "preferences":
+                                # 状态轮询顺带刷新过期的备用限速模式，推送时通常直接使用缓存
+                                await self._speed_mode(session, cookies, instance_config)
                             
-                            # 获取种子列表
-                            torrents_url = f"{instance_config['host']}/api/v2/torrents/info"
-                            try:
-                                async with session.get(torrents_url, cookies=cookies, timeout=aiohttp.ClientTimeout(total=10)) as torrents_response:
-                                    torrents_info = await torrents_response.json() if torrents_response.status == 200 else []
-                            except Exception:
-                                # 种子列表获取失败，使用空列表
-                                torrents_info = []
+                            # 获取种子列表（缓存未过期时直接使用缓存）
+                            cached = self.torrent_cache.get(f"{instance_config['host']}_{instance_config['username']}")
+                            if torrents_max_age > 0 and cached and time.time() - cached['timestamp'] <= torrents_max_age:
+                                torrents_info = cached['torrents']
+                            else:
+                                torrents_url = f"{instance_config['host']}/api/v2/torrents/info"
+                                try:
+                                    async with session.get(torrents_url, cookies=cookies, timeout=aiohttp.ClientTimeout(total=10)) as torrents_response:
+                                        torrents_info = await torrents_response.json(loads=codec.loads) if torrents_response.status == 200 else []
+                                    if torrents_response.status == 200:
+                                        self._cache_torrents(instance_config, torrents_info)
+                                except Exception:
+                                    # 种子列表获取失败，使用空列表
+                                    torrents_info = []
                             
                             active_downloads = len([t for t in torrents_info if t.get("state") == "downloading"])
                             active_seeds = len([t for t in torrents_info if t.get("state") == "uploading"])
@@ -1316,8 +1826,8 @@ class QBittorrentManager:
                                 "success": True,
                                 "instance_name": instance_config["name"],
                                 "status": "online",
-                                "download_speed": transfer_info.get("dl_info_speed", 0),
-                                "upload_speed": transfer_info.get("up_info_speed", 0),
+                                "download_speed": instance_rates["download"],
+                                "upload_speed": instance_rates["upload"],
                                 "active_downloads": active_downloads,
                                 "active_seeds": active_seeds,
                                 "total_torrents": len(torrents_info),
@@ -1330,11 +1840,7 @@ class QBittorrentManager:
                             return status_data
                         elif transfer_response.status == 403:
                             # Cookie 过期，清除缓存和Cookie
-                            instance_key = f"{instance_config['host']}_{instance_config['username']}"
-                            if instance_key in self.cookies:
-                                del self.cookies[instance_key]
-                            if instance_key in self.sid_cache:
-                                del self.sid_cache[instance_key]
+                            self.invalidate_auth(instance_config)
                             logger.warning(f"⚠️ {instance_config['name']} - Cookie已过期，已清除缓存")
                             return {
                                 "success": False,
@@ -1393,11 +1899,7 @@ class QBittorrentManager:
                         # 如果是连接重置错误，清除认证缓存
                         if "Connection reset" in error_msg or "104" in error_msg:
                             logger.info(f"🔄 {instance_config['name']} - 检测到连接重置，清除认证缓存")
-                            instance_key = f"{instance_config['host']}_{instance_config['username']}"
-                            if instance_key in self.cookies:
-                                del self.cookies[instance_key]
-                            if instance_key in self.sid_cache:
-                                del self.sid_cache[instance_key]
+                            self.invalidate_auth(instance_config)
             except Exception as e:
                 error_msg = str(e)
                 logger.error(f"❌ {instance_config['name']} - 未知异常: {error_msg}")
@@ -1417,9 +1919,107 @@ class QBittorrentManager:
                     "attempt": attempt + 1
                 }
     
+    async def get_webapi_version(self, instance_config: dict):
+        """获取实例的 WebUI API 版本（如 (2, 9, 3)），失败返回 None"""
+        instance_key = f"{instance_config['host']}_{instance_config['username']}"
+        if instance_key in self.webapi_versions:
+            return self.webapi_versions[instance_key]
+        try:
+            session = await self.get_session(instance_config)
+            cookies = await self.get_valid_cookies(instance_config)
+            if not cookies:
+                return None
+            version_url = f"{instance_config['host']}/api/v2/app/webapiVersion"
+            async with session.get(version_url, cookies=cookies, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                if response.status != 200:
+                    return None
+                text = (await response.text()).strip()
+            version = tuple(int(part) for part in text.split("."))
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.warning(f"⚠️ {instance_config['name']} - 获取 WebUI API 版本失败: {e}")
+            return None
+        self.webapi_versions[instance_key] = version
+        return version
+    
+    async def _limit_strategy(self, instance_config: dict) -> str:
+        """全局限速写入方式：preferences（app/setPreferences 一次设置上下行）或 transfer（两次 transfer/set*Limit）"""
+        instance_key = f"{instance_config['host']}_{instance_config['username']}"
+        strategy = self.limit_strategies.get(instance_key)
+        if strategy is None:
+            version = await self.get_webapi_version(instance_config)
+            if version is None:
+                # 版本未知时使用兼容方式，下次再检测
+                return "transfer"
+            strategy = "preferences" if version >= PREFERENCES_MIN_WEBAPI else "transfer"
+            self.limit_strategies[instance_key] = strategy
+            logger.info(f"🔧 {instance_config['name']} - WebUI API {'.'.join(map(str, version))}，限速写入方式: {strategy}")
+        return strategy
+    
+    @tracer.traced("qbit.speed_limits_mode")
+    async def _speed_limits_mode(self, session, cookies: dict, instance_config: dict):
+        """当前是否启用了备用速度限制（1=备用限速，0=常规限速）；读取失败返回 None"""
+        tracer.annotate(instance=instance_config["name"])
+        try:
+            url = f"{instance_config['host']}/api/v2/transfer/speedLimitsMode"
+            async with session.get(url, cookies=cookies, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                tracer.annotate(http_status=response.status)
+                if response.status != 200:
+                    return None
+                mode = int((await response.text()).strip())
+                tracer.annotate(mode=mode)
+                return mode
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            tracer.annotate(error=f"{type(e).__name__}: {e}")
+            return None
+    
+    async def _speed_mode(self, session, cookies: dict, instance_config: dict, max_age: float = SPEED_MODE_TTL):
+        """缓存的备用速度限制模式，缓存过期时重新读取；读取失败返回 None"""
+        instance_key = f"{instance_config['host']}_{instance_config['username']}"
+        cached = self.speed_modes.get(instance_key)
+        if cached and time.time() - cached['timestamp'] <= max_age:
+            return cached['mode']
+        mode = await self._speed_limits_mode(session, cookies, instance_config)
+        if mode is None:
+            self.speed_modes.pop(instance_key, None)
+        else:
+            self.speed_modes[instance_key] = {'mode': mode, 'timestamp': time.time()}
+        return mode
+    
+    @tracer.traced("qbit.post")
+    async def _post_limit(self, session, url: str, data: dict, cookies: dict, instance_config: dict, label: str, final: bool):
+        """提交一次限速请求，返回 (是否成功, 错误描述)"""
+        tracer.annotate(instance=instance_config["name"], endpoint=url.rsplit("/api/v2/", 1)[-1])
+        try:
+            async with session.post(url, data=data, cookies=cookies, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                tracer.annotate(http_status=response.status)
+                if response.status == 200:
+                    return True, ""
+                error = f"HTTP {response.status}"
+                response_text = await response.text()
+                if final:
+                    logger.error(f"❌ {instance_config['name']} - {label}设置失败: {error}, 响应: {response_text}")
+                return False, error
+        except (aiohttp.ClientConnectorError, aiohttp.ClientError, asyncio.TimeoutError, ConnectionResetError) as e:
+            error = f"{type(e).__name__}: {str(e)}"
+        except Exception as e:
+            error = f"请求异常: {str(e)}"
+        if final:
+            logger.error(f"❌ {instance_config['name']} - {label}请求异常: {error}")
+        tracer.annotate(error=error)
+        return False, error
+    
+    @tracer.traced("qbit.set_limits")
     async def set_speed_limits(self, instance_config: dict, download_limit: int, upload_limit: int, max_retries: int = 3) -> bool:
-        """设置速度限制（KB/s） - 带重试机制"""
+        """设置速度限制（KB/s） - 带重试机制
+        
+        WebUI API 支持时通过 app/setPreferences 一次提交 dl_limit 和 up_limit，上下行同时生效
+        （启用了备用速度限制时提交 alt_dl_limit 和 alt_up_limit，与 transfer 接口一样写入当前生效的限速），
+        否则分别调用 transfer/setDownloadLimit 和 transfer/setUploadLimit
+        """
+        tracer.annotate(instance=instance_config["name"], download=download_limit, upload=upload_limit)
         for attempt in range(max_retries):
+            final = attempt == max_retries - 1
+            tracer.annotate(attempt=attempt + 1)
             try:
                 if attempt > 0:
                     logger.info(f"🔄 {instance_config['name']} - 重试设置速度限制 (尝试 {attempt + 1}/{max_retries})")
@@ -1427,8 +2027,7 @@ class QBittorrentManager:
                 else:
                     logger.info(f"🎚️ 设置速度限制: {instance_config['name']} - 下载: {download_limit} KB/s, 上传: {upload_limit} KB/s")
                 
-                session = await self.get_session()
-                instance_key = f"{instance_config['host']}_{instance_config['username']}"
+                session = await self.get_session(instance_config)
                 
                 # 使用缓存机制获取有效的 Cookie
                 cookies = await self.get_valid_cookies(instance_config)
@@ -1436,85 +2035,65 @@ class QBittorrentManager:
                     logger.error(f"❌ {instance_config['name']} - 无法获取有效Cookie")
                     return False
                 
-                # 设置全局下载限制
-                dl_limit_url = f"{instance_config['host']}/api/v2/transfer/setDownloadLimit"
-                dl_limit_data = {"limit": download_limit * 1024}  # 转换为 bytes/s
-                
-                dl_success = False
-                dl_error = ""
-                try:
-                    async with session.post(dl_limit_url, data=dl_limit_data, cookies=cookies, timeout=aiohttp.ClientTimeout(total=10)) as dl_response:
-                        dl_success = dl_response.status == 200
-                        if not dl_success:
-                            dl_error = f"HTTP {dl_response.status}"
-                            response_text = await dl_response.text()
-                            if attempt == max_retries - 1:
-                                logger.error(f"❌ {instance_config['name']} - 下载限制设置失败: {dl_error}, 响应: {response_text}")
-                except (aiohttp.ClientConnectorError, aiohttp.ClientError, asyncio.TimeoutError, ConnectionResetError) as e:
-                    dl_error = f"{type(e).__name__}: {str(e)}"
-                    if attempt == max_retries - 1:
-                        logger.error(f"❌ {instance_config['name']} - 下载限制请求异常: {e}")
-                except Exception as e:
-                    dl_error = f"请求异常: {str(e)}"
-                    if attempt == max_retries - 1:
-                        logger.error(f"❌ {instance_config['name']} - 下载限制请求异常: {e}")
-                
-                # 设置全局上传限制
-                up_limit_url = f"{instance_config['host']}/api/v2/transfer/setUploadLimit"
-                up_limit_data = {"limit": upload_limit * 1024}  # 转换为 bytes/s
+                errors = {}
+                strategy = await self._limit_strategy(instance_config)
+                mode = None
+                if strategy == "preferences":
+                    # dl_limit/up_limit 只是常规限速：备用限速启用时改写 alt_*（使用缓存的模式），读取不到模式时本次使用 transfer 接口
+                    mode = await self._speed_mode(session, cookies, instance_config)
+                    if mode is None:
+                        strategy = "transfer"
+                tracer.annotate(strategy=strategy)
+                if strategy == "preferences":
+                    # 一次请求同时设置上下行限速（bytes/s），不会出现只设置了一半的状态
+                    prefs_url = f"{instance_config['host']}/api/v2/app/setPreferences"
+                    prefix = "alt_" if mode == 1 else ""
+                    prefs = {f"{prefix}dl_limit": download_limit * 1024, f"{prefix}up_limit": upload_limit * 1024}
+                    ok, error = await self._post_limit(session, prefs_url, {"json": json.dumps(prefs)}, cookies,
+                                                       instance_config, "限速偏好", final)
+                    if not ok:
+                        errors["偏好"] = error
+                        # 推送失败时模式可能已被切换，下次推送重新读取
+                        self.speed_modes.pop(f"{instance_config['host']}_{instance_config['username']}", None)
+                        if error in ("HTTP 404", "HTTP 405"):
+                            # 接口不可用：改用兼容方式，立即重试
+                            instance_key = f"{instance_config['host']}_{instance_config['username']}"
+                            self.limit_strategies[instance_key] = strategy = "transfer"
+                            logger.warning(f"⚠️ {instance_config['name']} - app/setPreferences 不可用，改用 transfer 接口")
+                            errors = {}
                 
-                up_success = False
-                up_error = ""
-                try:
-                    async with session.post(up_limit_url, data=up_limit_data, cookies=cookies, timeout=aiohttp.ClientTimeout(total=10)) as up_response:
-                        up_success = up_response.status == 200
-                        if not up_success:
-                            up_error = f"HTTP {up_response.status}"
-                            response_text = await up_response.text()
-                            if attempt == max_retries - 1:
-                                logger.error(f"❌ {instance_config['name']} - 上传限制设置失败: {up_error}, 响应: {response_text}")
-                except (aiohttp.ClientConnectorError, aiohttp.ClientError, asyncio.TimeoutError, ConnectionResetError) as e:
-                    up_error = f"{type(e).__name__}: {str(e)}"
-                    if attempt == max_retries - 1:
-                        logger.error(f"❌ {instance_config['name']} - 上传限制请求异常: {e}")
-                except Exception as e:
-                    up_error = f"请求异常: {str(e)}"
-                    if attempt == max_retries - 1:
-                        logger.error(f"❌ {instance_config['name']} - 上传限制请求异常: {e}")
+                if not errors and strategy == "transfer":
+                    # 设置全局下载/上传限制（转换为 bytes/s）
+                    for label, endpoint, limit in (("下载", "setDownloadLimit", download_limit),
+                                                   ("上传", "setUploadLimit", upload_limit)):
+                        ok, error = await self._post_limit(session, f"{instance_config['host']}/api/v2/transfer/{endpoint}",
+                                                           {"limit": limit * 1024}, cookies, instance_config, f"{label}限制", final)
+                        if not ok:
+                            errors[label] = error
                 
-                success = dl_success and up_success
-                if success:
+                if not errors:
                     logger.info(f"✅ {instance_config['name']} - 速度限制设置成功 (尝试 {attempt + 1})")
                     return True
+                
+                # 检查是否是连接重置错误
+                if any("Connection reset" in err or "104" in err for err in errors.values()):
+                    logger.warning(f"⚠️ {instance_config['name']} - 检测到连接重置，清除认证缓存")
+                    self.invalidate_auth(instance_config)
+                
+                # 如果失败，可能是 Cookie 过期，清除缓存
+                if any("403" in err for err in errors.values()):
+                    self.invalidate_auth(instance_config)
+                    logger.warning(f"⚠️ {instance_config['name']} - Cookie已过期，已清除缓存")
+                
+                if final:
+                    error_details = [f"{label}: {err}" for label, err in errors.items()]
+                    logger.error(f"❌ {instance_config['name']} - 速度限制设置失败 (已重试{max_retries}次) - {', '.join(error_details)}")
+                    tracer.annotate(error=', '.join(error_details))
                 else:
-                    # 检查是否是连接重置错误
-                    if any("Connection reset" in err or "104" in err for err in [dl_error, up_error]):
-                        logger.warning(f"⚠️ {instance_config['name']} - 检测到连接重置，清除认证缓存")
-                        if instance_key in self.cookies:
-                            del self.cookies[instance_key]
-                        if instance_key in self.sid_cache:
-                            del self.sid_cache[instance_key]
-                    
-                    # 如果失败，可能是 Cookie 过期，清除缓存
-                    if any("403" in err for err in [dl_error, up_error]):
-                        if instance_key in self.cookies:
-                            del self.cookies[instance_key]
-                        if instance_key in self.sid_cache:
-                            del self.sid_cache[instance_key]
-                        logger.warning(f"⚠️ {instance_config['name']} - Cookie已过期，已清除缓存")
-                    
-                    if attempt == max_retries - 1:
-                        error_details = []
-                        if not dl_success:
-                            error_details.append(f"下载: {dl_error}")
-                        if not up_success:
-                            error_details.append(f"上传: {up_error}")
-                        logger.error(f"❌ {instance_config['name']} - 速度限制设置失败 (已重试{max_retries}次) - {', '.join(error_details)}")
-                    else:
-                        logger.warning(f"⚠️ {instance_config['name']} - 速度限制设置失败，将在 {2 * (attempt + 1)} 秒后重试")
+                    logger.warning(f"⚠️ {instance_config['name']} - 速度限制设置失败，将在 {2 * (attempt + 1)} 秒后重试")
                         
             except Exception as e:
-                if attempt == max_retries - 1:
+                if final:
                     logger.error(f"❌ {instance_config['name']} - 设置速度限制异常: {e}")
                     import traceback
                     logger.error(f"❌ 异常详情: {traceback.format_exc()}")
@@ -1523,26 +2102,275 @@ class QBittorrentManager:
         
         return False
     
+    def _cache_transfer(self, instance_config: dict, info: dict):
+        instance_key = f"{instance_config['host']}_{instance_config['username']}"
+        self.transfer_cache[instance_key] = {'info': info, 'timestamp': time.time()}
+        # 每次获取到新的传输信息时计算一次速率（qBittorrent 重启后计数器归零，由速率引擎重新取基线）
+        name = instance_config['name']
+        if "dl_info_data" in info:
+            self.rates.observe(f"qbit/{name}/download", info["dl_info_data"])
+        if "up_info_data" in info:
+            self.rates.observe(f"qbit/{name}/upload", info["up_info_data"])
+    
+    def get_rates(self, instance_config: dict, info: dict = None, smoothed: bool = False) -> dict:
+        """实例速率 {"download": B/s, "upload": B/s}：优先使用计数器差值，样本不足时回退到 qBittorrent 报告的瞬时速度"""
+        name = instance_config['name']
+        read = self.rates.ewma if smoothed else self.rates.rate
+        rates = {}
+        for direction, speed_key in (("download", "dl_info_speed"), ("upload", "up_info_speed")):
+            value = read(f"qbit/{name}/{direction}")
+            rates[direction] = value if value is not None else (info or {}).get(speed_key, 0)
+        return rates
+    
+    @tracer.traced("qbit.transfer_info")
+    async def get_transfer_info(self, instance_config: dict, max_age: float = 0):
+        """获取实例的全局传输信息（transfer/info），缓存未过期时直接返回；失败返回 None"""
+        tracer.annotate(instance=instance_config["name"])
+        instance_key = f"{instance_config['host']}_{instance_config['username']}"
+        cached = self.transfer_cache.get(instance_key)
+        if max_age > 0 and cached and time.time() - cached['timestamp'] <= max_age:
+            tracer.annotate(cached=True)
+            return cached['info']
+        try:
+            session = await self.get_session(instance_config)
+            cookies = await self.get_valid_cookies(instance_config)
+            if not cookies:
+                return None
+            transfer_url = f"{instance_config['host']}/api/v2/transfer/info"
+            async with session.get(transfer_url, cookies=cookies, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                if response.status == 403:
+                    self.invalidate_auth(instance_config)
+                    return None
+                if response.status != 200:
+                    return None
+                info = await response.json(loads=codec.loads)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"⚠️ {instance_config['name']} - 获取传输信息失败: {e}")
+            return None
+        self._cache_transfer(instance_config, info)
+        return info
+    
+    @tracer.traced("qbit.warm_up")
+    async def warm_up(self, instance_config: dict):
+        """预热实例：建立连接池、登录缓存 SID、检测限速写入方式和备用限速模式，返回当前全局限速 {"download": KB/s, "upload": KB/s}；失败返回 None"""
+        tracer.annotate(instance=instance_config["name"])
+        cookies = await self.get_valid_cookies(instance_config)
+        if not cookies:
+            return None
+        if await self._limit_strategy(instance_config) == "preferences":
+            await self._speed_mode(await self.get_session(instance_config), cookies, instance_config, max_age=0)
+        info = await self.get_transfer_info(instance_config)
+        if not info or "dl_rate_limit" not in info:
+            return None
+        # transfer/info 的限速单位为 bytes/s，0 表示不限速
+        return {
+            "download": max(0, int(info.get("dl_rate_limit", 0))) // 1024,
+            "upload": max(0, int(info.get("up_rate_limit", 0))) // 1024
+        }
+    
+    def _cache_torrents(self, instance_config: dict, torrents: list):
+        instance_key = f"{instance_config['host']}_{instance_config['username']}"
+        self.torrent_cache[instance_key] = {'torrents': torrents, 'timestamp': time.time()}
+    
+    @tracer.traced("qbit.torrents")
+    async def get_torrents(self, instance_config: dict, max_age: float = 30):
+        """获取种子列表，缓存未过期时直接返回缓存；失败返回 None"""
+        tracer.annotate(instance=instance_config["name"])
+        instance_key = f"{instance_config['host']}_{instance_config['username']}"
+        cached = self.torrent_cache.get(instance_key)
+        if cached and time.time() - cached['timestamp'] <= max_age:
+            tracer.annotate(cached=True, torrents=len(cached['torrents']))
+            return cached['torrents']
+        
+        try:
+            session = await self.get_session(instance_config)
+            cookies = await self.get_valid_cookies(instance_config)
+            if not cookies:
+                return None
+            torrents_url = f"{instance_config['host']}/api/v2/torrents/info"
+            async with session.get(torrents_url, cookies=cookies, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status == 403:
+                    self.invalidate_auth(instance_config)
+                    return None
+                if response.status != 200:
+                    logger.error(f"❌ {instance_config['name']} - 获取种子列表失败: HTTP {response.status}")
+                    return None
+                torrents = await response.json(loads=codec.loads)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"❌ {instance_config['name']} - 获取种子列表异常: {e}")
+            return None
+        
+        self._cache_torrents(instance_config, torrents)
+        tracer.annotate(cached=False, torrents=len(torrents))
+        return torrents
+    
+    async def set_torrent_limits(self, instance_config: dict, hashes: list, download_limit: int = None,
+                                 upload_limit: int = None, max_retries: int = 2) -> bool:
+        """批量设置单种限速（bytes/s，0 为不限速，None 为不修改）；hashes 按长度分批提交"""
+        requests = []
+        if download_limit is not None:
+            requests.append(("setDownloadLimit", download_limit))
+        if upload_limit is not None:
+            requests.append(("setUploadLimit", upload_limit))
+        if not hashes or not requests:
+            return True
+        
+        chunks = chunk_hashes(hashes)
+        for attempt in range(max_retries):
+            try:
+                session = await self.get_session(instance_config)
+                cookies = await self.get_valid_cookies(instance_config)
+                if not cookies:
+                    logger.error(f"❌ {instance_config['name']} - 无法获取有效Cookie")
+                    return False
+                
+                # 设置限速是幂等操作，重试时整体重发
+                for endpoint, limit in requests:
+                    url = f"{instance_config['host']}/api/v2/torrents/{endpoint}"
+                    for chunk in chunks:
+                        async with session.post(url, data={"hashes": chunk, "limit": limit}, cookies=cookies,
+                                                timeout=aiohttp.ClientTimeout(total=10)) as response:
+                            if response.status == 403:
+                                self.invalidate_auth(instance_config)
+                                raise PermissionError("认证过期")
+                            if response.status != 200:
+                                raise RuntimeError(f"HTTP {response.status}")
+                
+                logger.debug(f"🎯 {instance_config['name']} - 已设置 {len(hashes)} 个种子的限速")
+                return True
+            except Exception as e:
+                if attempt == max_retries - 1:
+                    logger.error(f"❌ {instance_config['name']} - 单种限速设置失败: {e}")
+                else:
+                    logger.warning(f"⚠️ {instance_config['name']} - 单种限速设置失败，重试: {e}")
+                    await asyncio.sleep(1)
+        return False
+    
     async def close(self):
-        """关闭会话并释放资源"""
-        if self.session and not self.session.closed:
-            await self.session.close()
-            logger.debug("🔒 qBittorrent Manager HTTP 会话已关闭")
-        self.session = None
-        self._session_created = False
+        """关闭所有 qBittorrent 连接池并释放资源"""
+        await self.pool.close("qbit")
+        logger.debug("🔒 qBittorrent Manager HTTP 连接池已关闭")
+
+def _load_json_file(path: Path):
+    """读取JSON文件，文件不存在时返回None"""
+    if not path.exists():
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _read_log_tail(log_file: Path, lines: int, block_size: int = 64 * 1024):
+    """从文件末尾反向读取最后N行，避免读取整个日志文件"""
+    if not log_file.exists():
+        return None
+    if lines <= 0:
+        return []
+    with open(log_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= lines:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    all_lines = data.decode('utf-8', errors='replace').splitlines(keepends=True)
+    return all_lines[-lines:]
 
 # 初始化管理器
 config_manager = ConfigManager()
 lucky_monitor = LuckyMonitor(config_manager)
 qbit_manager = QBittorrentManager(config_manager)
-speed_controller = SpeedController(config_manager, lucky_monitor, qbit_manager)
+history_store = TimeSeriesStore(Path("data/timeseries"))
+speed_controller = SpeedController(config_manager, lucky_monitor, qbit_manager, history=history_store, rates=rate_engine,
+                                   targeting_state=Path("data/config/targeted_torrents.json"))
+
+def _record_qbit_speeds(instance: dict, status: dict):
+    """遥测采集成功时记录实例速度到历史存储"""
+    if status.get("success"):
+        name = instance["name"]
+        history_store.append(time.time(), {
+            f"qbit/{name}/download_speed": status.get("download_speed", 0),
+            f"qbit/{name}/upload_speed": status.get("upload_speed", 0)
+        })
+
+# 控制器独立事件循环线程（controller_settings.isolated_loop 开启时由领导者启动）
+controller_loop = LoopThread("controller-loop")
+
+async def on_controller(coro):
+    """在控制器所在的事件循环中执行协程：独立线程模式下提交到控制器线程，否则直接执行"""
+    if controller_loop.running:
+        return await controller_loop.call(coro)
+    return await coro
+
+async def _build_controller_clients():
+    """在控制器循环中创建连接池和客户端，其中的异步原语绑定到控制器循环"""
+    pool = HttpClientPool()
+    speed_controller.use_clients(LuckyMonitor(config_manager, pool=pool), QBittorrentManager(config_manager, pool=pool))
+
+async def _isolate_controller():
+    """把控制器及其 Lucky/qBittorrent 客户端迁移到独立事件循环线程
+    
+    控制器线程使用自己的连接池和客户端（aiohttp 会话不能跨事件循环使用），
+    历史样本转交回 Web 事件循环写入，Web 层通过状态快照读取控制器状态
+    """
+    controller_loop.start()
+    await controller_loop.call(_build_controller_clients())
+    _track_clients("controller.", lambda: speed_controller.lucky_monitor, lambda: speed_controller.qbit_manager)
+    speed_controller.history = LoopBound(history_store, asyncio.get_running_loop())
+    speed_controller.publish_snapshots = True
+    speed_controller.publish_state()
+
+# qBittorrent 状态后台轮询（领导者进程运行）：采集间隔本身就是重试，单次采集不再重试；
+# 每次只请求 transfer/info，种子列表按 telemetry.torrents_interval 刷新（或复用按需获取的缓存）
+qbit_telemetry = TelemetryPoller(
+    config_manager,
+    lambda instance: qbit_manager.get_instance_status(
+        instance, max_retries=1, torrents_max_age=qbit_telemetry.options["torrents_interval"]),
+    listener=_record_qbit_speeds
+)
+leader_election = LeaderElection(Path("data/run"))
+
+def _track_clients(prefix: str, get_lucky, get_qbit):
+    """登记一组 Lucky/qBittorrent 客户端的缓存（getter 每次采样时取当前客户端）"""
+    memory_monitor.track(f"{prefix}lucky_payload_cache", lambda: get_lucky()._payload_cache)
+    memory_monitor.track(f"{prefix}qbit_torrent_cache", lambda: get_qbit().torrent_cache)
+    memory_monitor.track(f"{prefix}qbit_transfer_cache", lambda: get_qbit().transfer_cache)
+    memory_monitor.track(f"{prefix}qbit_cookies", lambda: get_qbit().cookies)
+    memory_monitor.track(f"{prefix}qbit_sid_cache", lambda: get_qbit().sid_cache)
+
+# 内存统计（领导者进程运行）：登记可能无界增长或体积较大的结构；
+# Web 层的客户端在这里登记，控制器迁移到独立线程后另有一组客户端，由 _isolate_controller 以 controller. 前缀登记
+memory_monitor = MemoryMonitor(config_manager)
+memory_monitor.track("service_control_state", lambda: config_manager._service_control_state)
+_track_clients("", lambda: lucky_monitor, lambda: qbit_manager)
+memory_monitor.track("torrent_throttler", lambda: speed_controller.torrent_throttler.applied)
+memory_monitor.track("qbit_status_store", lambda: qbit_telemetry.store.entries)
+memory_monitor.track("rate_engine", lambda: {key: series.samples for key, series in list(rate_engine._series.items())})
+memory_monitor.track("history_buffer", lambda: history_store._buffer)
+memory_monitor.track("response_cache", lambda: response_cache._entries)
+memory_monitor.track("traces", lambda: tracer.traces)
+memory_monitor.track("lucky_status_snapshot", lambda: getattr(_lucky_status_snapshot, "_cache", None))
+memory_monitor.track("lucky_connections_snapshot", lambda: getattr(_lucky_connections_snapshot, "_cache", None))
+memory_monitor.track("qbit_status_snapshot", lambda: getattr(_qbit_status_snapshot, "_cache", None))
+
+async def run_on_leader(op: str, timeout: float = 5, **params):
+    """控制平面操作只在领导者进程执行：本进程是领导者时直接执行，否则通过本地socket转发（timeout 为转发超时）"""
+    if leader_election.is_leader:
+        return await leader_election.dispatch(op, **params)
+    try:
+        result = await leader_election.call(op, timeout=timeout, **params)
+    except LeaderUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"控制器领导者不可用: {e}")
+    if isinstance(result, dict) and "__error__" in result:
+        raise HTTPException(status_code=result["__error__"], detail=result.get("detail"))
+    return result
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """主页面"""
     try:
-        config = config_manager.load_config()
-        return templates.TemplateResponse("index.html", {
+        config = await config_manager.load_config_async()
+        return get_templates().TemplateResponse("index.html", {
             "request": request,
             "config": config
         })
@@ -1561,7 +2389,7 @@ async def read_root(request: Request):
 @app.get("/api/status")
 async def get_status():
     """服务状态"""
-    config = config_manager.load_config()
+    config = await config_manager.load_config_async()
     return {
         "status": "running", 
         "message": "SpeedHiveHome 服务已启动",
@@ -1576,14 +2404,14 @@ async def get_status():
 @app.get("/api/config")
 async def get_config():
     """获取配置信息"""
-    return config_manager.load_config()
+    return await config_manager.load_config_async()
 
 @app.post("/api/config")
 async def update_config(request: Request):
     """更新整个配置"""
     try:
         config_data = await request.json()
-        if config_manager.save_config(config_data):
+        if await config_manager.save_config_async(config_data):
             logger.info("📝 配置已更新")
             return {"message": "配置保存成功", "status": "success"}
         else:
@@ -1597,10 +2425,10 @@ async def update_controller_settings(request: Request):
     """更新控制器设置"""
     try:
         settings = await request.json()
-        config = config_manager.load_config()
+        config = await config_manager.load_config_async()
         config["controller_settings"].update(settings)
         
-        if config_manager.save_config(config):
+        if await config_manager.save_config_async(config):
             logger.info(f"⚙️ 控制器设置已更新: {settings}")
             return {"message": "控制器设置保存成功", "status": "success", "settings": config["controller_settings"]}
         else:
@@ -1609,19 +2437,18 @@ async def update_controller_settings(request: Request):
         logger.error(f"控制器设置更新失败: {e}")
         raise HTTPException(status_code=400, detail=f"设置更新失败: {str(e)}")
 
-@app.get("/api/lucky/status")
-async def get_lucky_status():
-    """Lucky设备状态 - 使用缓存避免频繁API调用"""
+async def _lucky_status_snapshot():
+    """Lucky设备状态快照 - 使用缓存避免频繁API调用"""
     # 使用缓存，避免频繁调用Lucky API
     current_time = datetime.now()
     
     # 检查缓存是否存在且未过期（5秒缓存）
-    if hasattr(get_lucky_status, '_cache') and hasattr(get_lucky_status, '_cache_time'):
-        if (current_time - get_lucky_status._cache_time).total_seconds() < 5:
-            return get_lucky_status._cache
+    if hasattr(_lucky_status_snapshot, '_cache') and hasattr(_lucky_status_snapshot, '_cache_time'):
+        if (current_time - _lucky_status_snapshot._cache_time).total_seconds() < 5:
+            return _lucky_status_snapshot._cache
     
     print("🔄 开始采集Lucky设备状态...")
-    config = config_manager.load_config()
+    config = await config_manager.load_config_async()
     devices = config.get("lucky_devices", [])
     
     try:
@@ -1633,37 +2460,54 @@ async def get_lucky_status():
         result = {"devices": status_data}
         
         # 缓存结果
-        get_lucky_status._cache = result
-        get_lucky_status._cache_time = current_time
+        _lucky_status_snapshot._cache = result
+        _lucky_status_snapshot._cache_time = current_time
         
         print(f"✅ Lucky状态采集完成: {len(status_data)} 个设备")
         return result
     except Exception as e:
         print(f"❌ Lucky状态采集失败: {e}")
         # 如果采集失败，返回旧的缓存数据（如果有的话）
-        if hasattr(get_lucky_status, '_cache'):
+        if hasattr(_lucky_status_snapshot, '_cache'):
             print("🔄 使用缓存的Lucky状态数据")
-            return get_lucky_status._cache
+            return _lucky_status_snapshot._cache
         else:
             # 如果没有缓存，返回错误状态
             return {"devices": [{"success": False, "error": f"采集失败: {str(e)}"}]}
 
-@app.get("/api/lucky/connections")
-async def get_lucky_connections():
-    """获取Lucky设备的详细连接信息"""
+@app.get("/api/lucky/status")
+async def get_lucky_status(request: Request):
+    """Lucky设备状态 - 快照未变化时返回 304"""
+    return response_cache.respond(request, "lucky-status", await _lucky_status_snapshot())
+
+async def _lucky_connections_snapshot():
+    """Lucky设备的详细连接信息快照（2秒缓存）"""
+    current_time = datetime.now()
+    if hasattr(_lucky_connections_snapshot, '_cache') and hasattr(_lucky_connections_snapshot, '_cache_time'):
+        if (current_time - _lucky_connections_snapshot._cache_time).total_seconds() < 2:
+            return _lucky_connections_snapshot._cache
+    
+    result = await _fetch_lucky_connections()
+    _lucky_connections_snapshot._cache = result
+    _lucky_connections_snapshot._cache_time = current_time
+    return result
+
+@admission.limit("upstream")
+async def _fetch_lucky_connections():
+    """请求所有 Lucky 设备的详细连接信息（缓存未命中时执行，同时进行的请求合并为一次）"""
     print("🔍 获取Lucky详细连接信息...")
-    config = config_manager.load_config()
+    config = await config_manager.load_config_async()
     devices = config.get("lucky_devices", [])
     
     detailed_data = []
     for device in devices:
         try:
-            session = await lucky_monitor.get_session()
             api_url = device["api_url"]
+            session = await lucky_monitor.get_session(api_url)
             
             async with session.get(api_url) as response:
                 if response.status == 200:
-                    data = await response.json()
+                    data = await response.json(loads=codec.loads)
                     
                     # 解析详细的连接信息
                     connections_info = lucky_monitor._parse_detailed_connections(data)
@@ -1698,59 +2542,47 @@ async def get_lucky_connections():
     
     return {"devices": detailed_data}
 
+async def _lucky_parse_stats_local():
+    return speed_controller.lucky_monitor.get_parse_stats()
+
+@app.get("/api/lucky/parse-stats")
+async def get_lucky_parse_stats():
+    """Lucky 响应解析统计（控制器所在进程）：内容哈希未变化时跳过解码、解析和服务发现"""
+    return {
+        "parse": await run_on_leader("lucky_parse_stats"),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/api/lucky/connections")
+async def get_lucky_connections(request: Request):
+    """获取Lucky设备的详细连接信息 - 快照未变化时返回 304"""
+    return response_cache.respond(request, "lucky-connections", await _lucky_connections_snapshot())
+
+async def _qbit_status_local():
+    config = await config_manager.load_config_async()
+    settings = get_telemetry_settings(config.get("controller_settings", {}))
+    return qbit_telemetry.store.snapshot(config.get("qbittorrent_instances", []), settings)
+
+async def _qbit_status_snapshot():
+    """qBittorrent状态快照 - 读取后台遥测存储（领导者采集），版本未变化时返回同一对象"""
+    snapshot = await run_on_leader("qbit_status")
+    cached = getattr(_qbit_status_snapshot, '_cache', None)
+    if cached is not None and cached.get("version") == snapshot.get("version"):
+        return cached
+    _qbit_status_snapshot._cache = snapshot
+    return snapshot
+
 @app.get("/api/qbit/status")
-async def get_qbit_status():
-    """qBittorrent状态 - 使用缓存避免频繁API调用"""
-    # 使用缓存，避免频繁调用qBittorrent API
-    current_time = datetime.now()
-    
-    # 检查缓存是否存在且未过期（5秒缓存）
-    if hasattr(get_qbit_status, '_cache') and hasattr(get_qbit_status, '_cache_time'):
-        if (current_time - get_qbit_status._cache_time).total_seconds() < 5:
-            return get_qbit_status._cache
-    
-    try:
-        print("🔄 开始采集QB状态...")
-        config = config_manager.load_config()
-        instances = config.get("qbittorrent_instances", [])
-        
-        status_data = []
-        for instance in instances:
-            if instance.get("enabled", True):
-                instance_status = await qbit_manager.get_instance_status(instance)
-                status_data.append(instance_status)
-            else:
-                status_data.append({
-                    "success": False,
-                    "instance_name": instance["name"],
-                    "status": "disabled",
-                    "error": "实例已禁用",
-                    "last_update": datetime.now().isoformat()
-                })
-        
-        result = {"instances": status_data}
-        
-        # 缓存结果
-        get_qbit_status._cache = result
-        get_qbit_status._cache_time = current_time
-        
-        print(f"✅ QB状态采集完成: {len(status_data)} 个实例")
-        return result
-    except Exception as e:
-        print(f"❌ QB状态采集失败: {e}")
-        # 如果采集失败，返回旧的缓存数据（如果有的话）
-        if hasattr(get_qbit_status, '_cache'):
-            print("🔄 使用缓存的QB状态数据")
-            return get_qbit_status._cache
-        else:
-            # 如果没有缓存，返回错误状态
-            return {"instances": [{"success": False, "error": f"采集失败: {str(e)}"}]}
+async def get_qbit_status(request: Request):
+    """qBittorrent状态 - 快照未变化时返回 304"""
+    return response_cache.respond(request, "qbit-status", await _qbit_status_snapshot())
 
 @app.get("/api/test/lucky/{device_index}")
+@admission.limit("probe")
 async def test_lucky_connection(device_index: int):
     """测试Lucky设备连接"""
     print(f"🧪 测试Lucky设备连接: {device_index}")
-    config = config_manager.load_config()
+    config = await config_manager.load_config_async()
     devices = config.get("lucky_devices", [])
     
     if device_index < 0 or device_index >= len(devices):
@@ -1761,10 +2593,11 @@ async def test_lucky_connection(device_index: int):
     return result
 
 @app.get("/api/test/qbit/{instance_index}")
+@admission.limit("probe")
 async def test_qbit_connection(instance_index: int):
     """测试qBittorrent连接"""
     print(f"🧪 测试QB连接: {instance_index}")
-    config = config_manager.load_config()
+    config = await config_manager.load_config_async()
     instances = config.get("qbittorrent_instances", [])
     
     if instance_index < 0 or instance_index >= len(instances):
@@ -1775,10 +2608,11 @@ async def test_qbit_connection(instance_index: int):
     return result
 
 @app.get("/api/debug/qbit/{instance_index}")
+@admission.limit("probe")
 async def debug_qbit_connection(instance_index: int):
     """调试qBittorrent连接 - 详细诊断"""
     print(f"🔧 调试QB连接: {instance_index}")
-    config = config_manager.load_config()
+    config = await config_manager.load_config_async()
     instances = config.get("qbittorrent_instances", [])
     
     if instance_index < 0 or instance_index >= len(instances):
@@ -1797,70 +2631,68 @@ async def debug_qbit_connection(instance_index: int):
     }
     
     try:
-        # 测试1: 基本连接
-        import aiohttp
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(instance["host"], timeout=5) as response:
-                    debug_info["tests"].append({
-                        "test": "基本连接",
-                        "url": instance["host"],
-                        "status": response.status,
-                        "success": response.status == 200,
-                        "message": f"HTTP {response.status}"
-                    })
-            except Exception as e:
+        # 测试1: 基本连接（使用共享连接池，顺便验证池内连接可用）
+        session = await qbit_manager.get_session(instance)
+        try:
+            async with session.get(instance["host"], timeout=5) as response:
                 debug_info["tests"].append({
                     "test": "基本连接",
                     "url": instance["host"],
-                    "status": "error",
-                    "success": False,
-                    "message": str(e)
+                    "status": response.status,
+                    "success": response.status == 200,
+                    "message": f"HTTP {response.status}"
                 })
-            
-            # 测试2: 登录
-            try:
-                login_data = {
-                    "username": instance["username"],
-                    "password": instance["password"]
-                }
-                login_url = f"{instance['host']}/api/v2/auth/login"
-                async with session.post(login_url, data=login_data, timeout=10) as response:
-                    content = await response.text()
-                    cookies = response.cookies
-                    debug_info["tests"].append({
-                        "test": "登录认证",
-                        "url": login_url,
-                        "status": response.status,
-                        "success": response.status == 200,
-                        "message": f"HTTP {response.status} - {content[:100]}",
-                        "cookies_received": len(cookies),
-                        "cookie_names": list(cookies.keys()),
-                        "response_headers": dict(response.headers)
-                    })
-                    
-                    # 如果登录成功，测试带 Cookie 的请求
-                    if response.status == 200 and cookies:
-                        transfer_url = f"{instance['host']}/api/v2/transfer/info"
-                        async with session.get(transfer_url, cookies=cookies, timeout=10) as transfer_response:
-                            transfer_content = await transfer_response.text()
-                            debug_info["tests"].append({
-                                "test": "带Cookie的传输信息",
-                                "url": transfer_url,
-                                "status": transfer_response.status,
-                                "success": transfer_response.status == 200,
-                                "message": f"HTTP {transfer_response.status} - {transfer_content[:100]}",
-                                "response_headers": dict(transfer_response.headers)
-                            })
-            except Exception as e:
+        except Exception as e:
+            debug_info["tests"].append({
+                "test": "基本连接",
+                "url": instance["host"],
+                "status": "error",
+                "success": False,
+                "message": str(e)
+            })
+        
+        # 测试2: 登录
+        try:
+            login_data = {
+                "username": instance["username"],
+                "password": instance["password"]
+            }
+            login_url = f"{instance['host']}/api/v2/auth/login"
+            async with session.post(login_url, data=login_data, timeout=10) as response:
+                content = await response.text()
+                cookies = response.cookies
                 debug_info["tests"].append({
                     "test": "登录认证",
                     "url": login_url,
-                    "status": "error",
-                    "success": False,
-                    "message": str(e)
+                    "status": response.status,
+                    "success": response.status == 200,
+                    "message": f"HTTP {response.status} - {content[:100]}",
+                    "cookies_received": len(cookies),
+                    "cookie_names": list(cookies.keys()),
+                    "response_headers": dict(response.headers)
                 })
-            
+                
+                # 如果登录成功，测试带 Cookie 的请求
+                if response.status == 200 and cookies:
+                    transfer_url = f"{instance['host']}/api/v2/transfer/info"
+                    async with session.get(transfer_url, cookies=cookies, timeout=10) as transfer_response:
+                        transfer_content = await transfer_response.text()
+                        debug_info["tests"].append({
+                            "test": "带Cookie的传输信息",
+                            "url": transfer_url,
+                            "status": transfer_response.status,
+                            "success": transfer_response.status == 200,
+                            "message": f"HTTP {transfer_response.status} - {transfer_content[:100]}",
+                            "response_headers": dict(transfer_response.headers)
+                        })
+        except Exception as e:
+            debug_info["tests"].append({
+                "test": "登录认证",
+                "url": login_url,
+                "status": "error",
+                "success": False,
+                "message": str(e)
+            })
     
     except Exception as e:
         debug_info["error"] = str(e)
@@ -1870,13 +2702,35 @@ async def debug_qbit_connection(instance_index: int):
 @app.get("/api/debug/config")
 async def debug_config():
     """调试配置信息"""
-    config = config_manager.load_config()
+    config = await config_manager.load_config_async()
     return {
         "config": config,
         "config_file": str(config_manager.config_file),
         "file_exists": config_manager.config_file.exists()
     }
 
+async def _profile_local(seconds: float, interval: float):
+    """在领导者进程中采样（采样线程独立于事件循环，不阻塞控制循环和请求处理）"""
+    try:
+        return await asyncio.to_thread(profiler.sample, seconds, interval)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(seconds) + 1)})
+
+@app.get("/api/debug/profile")
+@admission.limit("profile", coalesce=False)
+async def debug_profile(
+    seconds: float = Query(5, ge=1, le=60, description="采样时长（秒）"),
+    interval_ms: float = Query(5, ge=1, le=100, description="采样间隔（毫秒）"),
+    format: str = Query("json", pattern="^(json|collapsed)$", description="json 或 collapsed（火焰图输入）")
+):
+    """对领导者进程做统计采样分析：热点函数（自身/累计）、按控制循环/请求处理等归类的样本数和 collapsed stack"""
+    logger.info(f"🔬 开始采样分析: {seconds}秒, 间隔 {interval_ms}ms")
+    result = await run_on_leader("profile", timeout=seconds + 10, seconds=seconds, interval=interval_ms / 1000)
+    if format == "collapsed":
+        return Response(result["collapsed"] + "\n", media_type="text/plain")
+    result["timestamp"] = datetime.now().isoformat()
+    return result
+
 @app.get("/api/test/connection")
 async def test_connection():
     """测试连接 - 简单测试"""
@@ -1886,31 +2740,54 @@ async def test_connection():
         "timestamp": datetime.now().isoformat()
     }
 
+async def _controller_state_snapshot() -> dict:
+    """控制器状态快照 - 跟随者从领导者读取，领导者不可达时返回本地状态"""
+    try:
+        state = await run_on_leader("state")
+    except HTTPException:
+        state = speed_controller.get_controller_state()
+        state["leader_available"] = False
+    state["worker"] = leader_election.get_status()
+    return state
+
 @app.get("/api/controller/state")
 async def get_controller_state():
     """获取控制器状态"""
-    return speed_controller.get_controller_state()
+    return await _controller_state_snapshot()
 
-@app.post("/api/controller/start")
-async def start_controller():
-    """手动启动控制器"""
+async def _start_controller_local():
     if speed_controller.running:
         return {"message": "控制器已在运行", "status": "running"}
     
-    asyncio.create_task(speed_controller.start())
+    if controller_loop.running:
+        controller_loop.submit(speed_controller.start())
+    else:
+        asyncio.create_task(speed_controller.start())
     return {"message": "控制器启动成功", "status": "started"}
 
+@app.post("/api/controller/start")
+async def start_controller():
+    """手动启动控制器"""
+    return await run_on_leader("start")
+
+async def _stop_controller_local():
+    await on_controller(speed_controller.stop())
+    return {"message": "控制器已停止", "status": "stopped"}
+
 @app.post("/api/controller/stop")
 async def stop_controller():
     """手动停止控制器"""
-    await speed_controller.stop()
-    return {"message": "控制器已停止", "status": "stopped"}
+    return await run_on_leader("stop")
 
 @app.post("/api/controller/restore/{instance_index}")
+@admission.limit("control")
 async def manual_restore_instance(instance_index: int):
     """手动恢复指定实例的全速"""
+    return await run_on_leader("restore", instance_index=instance_index)
+
+async def _restore_instance_local(instance_index: int):
     try:
-        config = config_manager.load_config()
+        config = await config_manager.load_config_async()
         instances = config.get("qbittorrent_instances", [])
         
         if instance_index < 0 or instance_index >= len(instances):
@@ -1923,10 +2800,11 @@ async def manual_restore_instance(instance_index: int):
         
         logger.info(f"🔧 手动恢复实例: {instance['name']}")
         
-        # 使用重试机制恢复
-        success = await speed_controller._restore_instance_with_retry(
-            instance, download_limit, upload_limit, max_retries=5
-        )
+        # 使用重试机制恢复（定向模式只还原被修改过的种子）
+        success = await on_controller(speed_controller._restore_instance_with_retry(
+            instance, download_limit, upload_limit, max_retries=5,
+            restore_global=settings.get("throttle_mode", "global") != "targeted"
+        ))
         
         if success:
             return {
@@ -1951,10 +2829,14 @@ async def manual_restore_instance(instance_index: int):
         raise HTTPException(status_code=500, detail=f"恢复失败: {str(e)}")
 
 @app.post("/api/controller/restore-all")
+@admission.limit("control")
 async def manual_restore_all_instances():
     """手动恢复所有实例的全速"""
+    return await run_on_leader("restore_all")
+
+async def _restore_all_local():
     try:
-        config = config_manager.load_config()
+        config = await config_manager.load_config_async()
         settings = config.get("controller_settings", {})
         download_limit = settings.get("normal_download", 0)
         upload_limit = settings.get("normal_upload", 0)
@@ -1962,7 +2844,7 @@ async def manual_restore_all_instances():
         logger.info("🔧 手动恢复所有实例")
         
         # 直接调用恢复方法
-        await speed_controller._apply_normal_mode(settings)
+        await on_controller(speed_controller._apply_normal_mode(settings))
         
         return {
             "message": "所有实例恢复操作已完成",
@@ -1982,16 +2864,14 @@ async def get_failed_instances():
     """获取失败的实例记录"""
     try:
         failed_file = Path("data/logs/failed_instances.json")
+        failed_records = await io_pool.run_serial("failed_instances", "failed_instances.load", _load_json_file, failed_file)
         
-        if not failed_file.exists():
+        if failed_records is None:
             return {
                 "message": "没有失败记录",
                 "failed_instances": []
             }
         
-        with open(failed_file, 'r', encoding='utf-8') as f:
-            failed_records = json.load(f)
-        
         # 只返回最近10条记录
         recent_records = failed_records[-10:] if len(failed_records) > 10 else failed_records
         
@@ -2006,9 +2886,64 @@ async def get_failed_instances():
         raise HTTPException(status_code=500, detail=f"获取失败记录失败: {str(e)}")
 
 @app.post("/api/controller/reset-connections")
-async def reset_all_connections():
-    """重置所有连接会话 - 解决连接重置问题"""
+@admission.limit("control")
+async def reset_all_connections(
+    scope: str = Query("all", pattern="^(all|device|instance)$"),
+    target: Optional[str] = Query(None, description="设备/实例名称或序号")
+):
+    """重置连接会话 - scope=device/instance 时只重置单个 Lucky 设备或 qBittorrent 实例（在领导者进程执行）"""
+    if scope != "all" and target is None:
+        raise HTTPException(status_code=400, detail="按设备或实例重置时必须指定 target")
+    return await run_on_leader("reset_connections", scope=scope, target=target)
+
+def _find_by_name_or_index(items: list, target: str) -> Optional[dict]:
+    for item in items:
+        if item.get("name") == target:
+            return item
+    if target.isdigit() and int(target) < len(items):
+        return items[int(target)]
+    return None
+
+async def _reset_connections_local(scope: str = "all", target: str = None):
     try:
+        if scope == "device":
+            config = await config_manager.load_config_async()
+            device = _find_by_name_or_index(config.get("lucky_devices", []), target)
+            if device is None:
+                raise HTTPException(status_code=404, detail="设备不存在")
+            closed = await http_pool.reset_host(device["api_url"], "lucky")
+            if controller_loop.running:
+                closed += await controller_loop.call(speed_controller.lucky_monitor.pool.reset_host(device["api_url"], "lucky"))
+            logger.info(f"🔄 已重置 Lucky 设备连接: {device['name']}")
+            return {
+                "message": f"设备 {device['name']} 的连接已重置",
+                "status": "success",
+                "scope": scope,
+                "timestamp": datetime.now().isoformat(),
+                "actions": [f"关闭 {closed} 个连接池"],
+                "health": http_pool.get_health(device["api_url"])
+            }
+        
+        if scope == "instance":
+            config = await config_manager.load_config_async()
+            instance = _find_by_name_or_index(config.get("qbittorrent_instances", []), target)
+            if instance is None:
+                raise HTTPException(status_code=404, detail="实例不存在")
+            closed = await http_pool.reset_host(instance["host"], "qbit")
+            qbit_manager.invalidate_auth(instance)
+            if controller_loop.running:
+                closed += await controller_loop.call(speed_controller.qbit_manager.pool.reset_host(instance["host"], "qbit"))
+                speed_controller.qbit_manager.invalidate_auth(instance)
+            logger.info(f"🔄 已重置 qBittorrent 实例连接和认证缓存: {instance['name']}")
+            return {
+                "message": f"实例 {instance['name']} 的连接已重置",
+                "status": "success",
+                "scope": scope,
+                "timestamp": datetime.now().isoformat(),
+                "actions": [f"关闭 {closed} 个连接池", "实例认证缓存已清除"],
+                "health": http_pool.get_health(instance["host"])
+            }
+        
         logger.info("🔄 开始重置所有连接会话...")
         
         # 重置 Lucky Monitor 会话
@@ -2024,9 +2959,18 @@ async def reset_all_connections():
         qbit_manager.sid_cache.clear()
         logger.info("✅ 认证缓存已清除")
         
+        if controller_loop.running:
+            # 控制器线程的客户端在其自己的事件循环中关闭
+            await controller_loop.call(speed_controller.lucky_monitor.close())
+            await controller_loop.call(speed_controller.qbit_manager.close())
+            speed_controller.qbit_manager.cookies.clear()
+            speed_controller.qbit_manager.sid_cache.clear()
+            logger.info("✅ 控制器线程的连接会话和认证缓存已重置")
+        
         return {
             "message": "所有连接会话已重置",
             "status": "success",
+            "scope": scope,
             "timestamp": datetime.now().isoformat(),
             "actions": [
                 "Lucky Monitor 会话已重置",
@@ -2035,52 +2979,58 @@ async def reset_all_connections():
             ]
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"重置连接会话异常: {e}")
         raise HTTPException(status_code=500, detail=f"重置连接失败: {str(e)}")
 
 @app.get("/api/controller/connection-health")
+@admission.limit("probe")
 async def get_connection_health():
     """获取连接健康状态"""
     try:
-        config = config_manager.load_config()
+        config = await config_manager.load_config_async()
         
-        # 检查 Lucky 设备连接
+        # 并发检查 Lucky 设备连接
         lucky_devices = config.get("lucky_devices", [])
+        results = await asyncio.gather(
+            *(lucky_monitor.test_connection(device["api_url"]) for device in lucky_devices),
+            return_exceptions=True
+        )
         lucky_health = []
-        for device in lucky_devices:
-            try:
-                result = await lucky_monitor.test_connection(device["api_url"])
+        for device, result in zip(lucky_devices, results):
+            if isinstance(result, Exception):
                 lucky_health.append({
                     "device_name": device["name"],
-                    "status": "healthy" if result.get("success") else "unhealthy",
-                    "details": result
+                    "status": "error",
+                    "details": {"error": str(result)}
                 })
-            except Exception as e:
+            else:
                 lucky_health.append({
                     "device_name": device["name"],
-                    "status": "error",
-                    "details": {"error": str(e)}
+                    "status": "healthy" if result.get("success") else "unhealthy",
+                    "details": result,
+                    "host_health": http_pool.get_health(device["api_url"])
                 })
         
-        # 检查 qBittorrent 实例连接
-        qbit_instances = config.get("qbittorrent_instances", [])
+        # qBittorrent 实例连接：读取后台遥测结果，不在请求中采集
+        qbit_instances = {i["name"]: i for i in config.get("qbittorrent_instances", [])}
         qbit_health = []
-        for instance in qbit_instances:
-            if instance.get("enabled", True):
-                try:
-                    result = await qbit_manager.test_connection(instance)
-                    qbit_health.append({
-                        "instance_name": instance["name"],
-                        "status": "healthy" if result.get("success") else "unhealthy",
-                        "details": result
-                    })
-                except Exception as e:
-                    qbit_health.append({
-                        "instance_name": instance["name"],
-                        "status": "error",
-                        "details": {"error": str(e)}
-                    })
+        for status in (await run_on_leader("qbit_status"))["instances"]:
+            instance = qbit_instances.get(status["instance_name"])
+            if instance is None or not instance.get("enabled", True):
+                continue
+            if status.get("stale"):
+                health = "stale"
+            else:
+                health = "healthy" if status.get("success") else "unhealthy"
+            qbit_health.append({
+                "instance_name": instance["name"],
+                "status": health,
+                "details": status,
+                "host_health": http_pool.get_health(instance["host"])
+            })
         
         # 统计连接状态
         total_lucky = len(lucky_health)
@@ -2106,10 +3056,11 @@ async def get_connection_health():
                 "details": qbit_health
             },
             "connection_pools": {
-                "lucky_session_active": lucky_monitor.session is not None and not lucky_monitor.session.closed,
-                "qbit_session_active": qbit_manager.session is not None and not qbit_manager.session.closed,
+                "lucky_session_active": http_pool.has_active("lucky"),
+                "qbit_session_active": http_pool.has_active("qbit"),
                 "qbit_cookies_cached": len(qbit_manager.cookies),
-                "qbit_sid_cached": len(qbit_manager.sid_cache)
+                "qbit_sid_cached": len(qbit_manager.sid_cache),
+                "hosts": http_pool.get_health()
             }
         }
         
@@ -2117,6 +3068,247 @@ async def get_connection_health():
         logger.error(f"获取连接健康状态异常: {e}")
         raise HTTPException(status_code=500, detail=f"获取连接健康状态失败: {str(e)}")
 
+@app.get("/api/system/io-stats")
+async def get_io_stats():
+    """获取I/O线程池统计"""
+    return {
+        "io_pool": io_pool.get_stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/api/system/response-cache")
+async def get_response_cache_stats():
+    """获取仪表盘接口的 ETag/压缩缓存统计"""
+    return {
+        "response_cache": response_cache.get_stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/api/system/admission")
+async def get_admission_stats():
+    """获取高开销接口的准入控制统计（本进程）：各类别的并发、令牌、合并和拒绝次数"""
+    return {
+        "admission": admission.get_stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/api/system/http-pools")
+async def get_http_pool_stats():
+    """获取 HTTP 连接池统计（按上游主机）"""
+    result = {
+        "http": http_pool.get_stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+    if controller_loop.running:
+        # 独立线程中的控制器使用自己的连接池
+        result["controller_http"] = speed_controller.qbit_manager.pool.get_stats()
+    return result
+
+async def _rates_snapshot_local(prefix: str = ""):
+    return {"rates": rate_engine.snapshot(prefix), "half_life": rate_engine.half_life, "window": rate_engine.window}
+
+@app.get("/api/system/rates")
+async def get_rates(prefix: str = ""):
+    """获取速率引擎中各来源的速率（bytes/s）：最近区间、EWMA、窗口平均；来源由领导者采集"""
+    result = await run_on_leader("rates", prefix=prefix)
+    result["timestamp"] = datetime.now().isoformat()
+    return result
+
+async def _traces_local(limit: int = 50, min_duration_ms: float = 0, name: str = None,
+                        trace_id: str = None, full: bool = False):
+    return {
+        "traces": tracer.query(limit, min_duration_ms, name, trace_id, full),
+        "stats": tracer.get_stats()
+    }
+
+@app.get("/api/system/traces")
+async def get_traces(
+    limit: int = Query(50, ge=1, le=1000),
+    min_duration_ms: float = Query(0, ge=0, description="只返回耗时不低于该值的 trace"),
+    name: Optional[str] = Query(None, description="controller.cycle 或 controller.warm_up"),
+    trace_id: Optional[str] = Query(None, description="返回该 trace 的全部 span")
+):
+    """获取最近的控制周期 trace（新的在前）：默认返回摘要（耗时、span 数、最慢子操作），指定 trace_id 时返回全部 span"""
+    result = await run_on_leader("traces", limit=limit, min_duration_ms=min_duration_ms, name=name,
+                                 trace_id=trace_id, full=trace_id is not None)
+    if trace_id is not None and not result["traces"]:
+        raise HTTPException(status_code=404, detail=f"trace 不存在或已被淘汰: {trace_id}")
+    result["timestamp"] = datetime.now().isoformat()
+    return result
+
+@app.get("/api/system/traces/export")
+async def export_traces(
+    format: str = Query("json", pattern="^(json|otlp)$", description="json 或 otlp（OTLP/JSON 文件，每行一个请求）"),
+    limit: int = Query(200, ge=1, le=10000),
+    min_duration_ms: float = Query(0, ge=0),
+    name: Optional[str] = Query(None)
+):
+    """导出环形缓冲中的 trace（含全部 span），作为附件下载"""
+    result = await run_on_leader("traces", limit=limit, min_duration_ms=min_duration_ms, name=name, full=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    if format == "otlp":
+        # OpenTelemetry Collector file exporter 格式：每行一个 ExportTraceServiceRequest，这里每条 trace 一行
+        body = b"".join(codec.dumps(to_otlp([trace])) + b"\n" for trace in result["traces"])
+        return Response(body, media_type="application/x-ndjson",
+                        headers={"Content-Disposition": f'attachment; filename="traces-{stamp}.otlp.jsonl"'})
+    return Response(codec.dumps(result["traces"]), media_type="application/json",
+                    headers={"Content-Disposition": f'attachment; filename="traces-{stamp}.json"'})
+
+async def _memory_local(refresh: bool = False):
+    if refresh or memory_monitor.latest is None:
+        await memory_monitor.sample()
+    return memory_monitor.get_report()
+
+@app.get("/api/system/memory")
+async def get_memory_report(refresh: bool = Query(False, description="立即重新采集")):
+    """获取领导者进程的内存统计：RSS、内存上限、各数据结构的条目数和大小、窗口内 RSS 曲线、增长告警、tracemalloc 状态"""
+    result = await run_on_leader("memory", timeout=30, refresh=refresh)
+    result["timestamp"] = datetime.now().isoformat()
+    return result
+
+async def _tracemalloc_local(action: str, frames: int = 10, base: int = None, target: int = None,
+                             group_by: str = "lineno", limit: int = 25):
+    if action == "start":
+        return memory_monitor.start_tracing(frames)
+    if action == "stop":
+        return memory_monitor.stop_tracing()
+    try:
+        if action == "snapshot":
+            return await asyncio.to_thread(memory_monitor.take_snapshot)
+        return await asyncio.to_thread(memory_monitor.diff, base, target, group_by, limit)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+
+@app.post("/api/system/memory/tracemalloc/start")
+async def start_tracemalloc(frames: int = Query(10, ge=1, le=50, description="每个分配记录的调用栈帧数")):
+    """在领导者进程启动 tracemalloc（会增加内存和 CPU 开销，定位完成后应停止）"""
+    return await run_on_leader("tracemalloc", action="start", frames=frames)
+
+@app.post("/api/system/memory/tracemalloc/stop")
+async def stop_tracemalloc():
+    """停止 tracemalloc 并清除快照"""
+    return await run_on_leader("tracemalloc", action="stop")
+
+@app.post("/api/system/memory/tracemalloc/snapshot")
+@admission.limit("profile", coalesce=False)
+async def take_tracemalloc_snapshot():
+    """保存一个 tracemalloc 快照，返回快照编号（最多保留 5 个）"""
+    return await run_on_leader("tracemalloc", timeout=60, action="snapshot")
+
+@app.get("/api/system/memory/tracemalloc/diff")
+@admission.limit("profile", coalesce=False)
+async def diff_tracemalloc(
+    base: int = Query(..., description="基准快照编号"),
+    target: Optional[int] = Query(None, description="目标快照编号，为空时与当前内存比较"),
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+    limit: int = Query(25, ge=1, le=200)
+):
+    """比较两个快照，返回增长最多的分配位置"""
+    return await run_on_leader("tracemalloc", timeout=60, action="diff", base=base, target=target,
+                               group_by=group_by, limit=limit)
+
+@app.get("/api/system/leader")
+async def get_leader_status():
+    """获取本 worker 的领导者选举状态"""
+    return {
+        "worker": leader_election.get_status(),
+        "controller_running": speed_controller.running,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/api/system/timeseries")
+async def get_timeseries_stats():
+    """获取历史存储统计"""
+    stats = await io_pool.run("timeseries.stats", history_store.get_stats)
+    series = await io_pool.run("timeseries.series", history_store.series_names)
+    return {
+        "timeseries": stats,
+        "series": series,
+        "timestamp": datetime.now().isoformat()
+    }
+
+async def _history_rows_local(name: str, start: float, end: float, resolution: str):
+    return {"rows": await history_store.query_async(name, start, end, resolution)}
+
+async def _query_history_rows(name: str, start: float, end: float, resolution: str) -> list:
+    """查询历史数据：未写盘的样本只在领导者内存中，跟随者通过领导者查询"""
+    try:
+        result = await run_on_leader("history_rows", name=name, start=start, end=end, resolution=resolution)
+        return [tuple(row) for row in result["rows"]]
+    except HTTPException:
+        return await history_store.query_async(name, start, end, resolution)
+
+HISTORY_RAW_MAX_SECONDS = 6 * 3600  # 超过该时间范围使用分钟级汇总数据
+HISTORY_DEFAULT_SERIES = "controller/raw_connections,controller/weighted_connections"
+
+@app.get("/api/history")
+async def get_history(request: Request, series: str = HISTORY_DEFAULT_SERIES, start: float = None,
+                      end: float = None, range_seconds: float = Query(3600, alias="range"), points: int = 500,
+                      method: str = "minmax", after: float = None):
+    """历史数据查询 - 服务端降采样
+    
+    - series: 逗号分隔的序列名，如 lucky/<设备>/total、qbit/<实例>/upload_speed
+    - start/end: 时间范围（Unix秒），未指定 start 时取最近 range 秒
+    - points: 每个序列返回的最大点数
+    - method: minmax（桶内 avg/min/max）或 lttb（仅原始数据）
+    - after: 增量获取，只返回该时间之后的点
+    """
+    now = time.time()
+    live = end is None
+    end = now if end is None else end
+    start = end - range_seconds if start is None else start
+    if end <= start:
+        raise HTTPException(status_code=400, detail="结束时间必须晚于开始时间")
+    points = max(10, min(points, 5000))
+    names = [name.strip() for name in series.split(",") if name.strip()][:20]
+    use_rollup = (end - start) > HISTORY_RAW_MAX_SECONDS
+    
+    # ETag 基于存储版本而非响应内容：历史窗口已结束时数据不再变化；汇总查询按汇总间隔更新
+    if not live and end < now - 5:
+        data_version = "fixed"
+    elif use_rollup:
+        data_version = f"r{int(now // history_store.rollup_interval)}"
+    elif leader_election.is_leader:
+        data_version = f"v{history_store.version}"
+    else:
+        # 跟随者不持有样本缓冲区，按秒更新
+        data_version = f"s{int(now)}"
+    window_key = f"live{range_seconds}" if live else f"{start}-{end}"
+    etag_source = f"{data_version}|{','.join(names)}|{window_key}|{points}|{method}|{after}"
+    etag = '"hist-' + hashlib.sha1(etag_source.encode()).hexdigest()[:16] + '"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    resolution = "rollup" if use_rollup else "raw"
+    query_start = max(start, after) if after is not None else start
+    result_series = {}
+    for name in names:
+        rows = await _query_history_rows(name, query_start, end, resolution)
+        if after is not None:
+            rows = [row for row in rows if row[0] > after]
+        if method == "lttb" and not use_rollup:
+            sampled = [list(point) for point in lttb(rows, points)]
+        else:
+            sampled = [list(point) for point in downsample_buckets(rows, start, end, points)]
+        result_series[name] = {
+            "raw_count": len(rows),
+            "points": sampled
+        }
+    
+    limited_rows = await _query_history_rows("controller/is_limited", query_start, end, resolution)
+    return JSONResponse({
+        "start": start,
+        "end": end,
+        "resolution": f"rollup{history_store.rollup_interval}" if use_rollup else "raw",
+        "method": "lttb" if method == "lttb" and not use_rollup else "minmax",
+        "point_format": ["t", "value"] if method == "lttb" and not use_rollup else ["t", "avg", "min", "max"],
+        "series": result_series,
+        "limited_periods": [list(period) for period in active_periods(limited_rows)],
+        "timestamp": datetime.now().isoformat()
+    }, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
 @app.get("/api/lucky/service-control")
 async def get_service_control_status():
     """获取所有服务的控制状态"""
@@ -2130,22 +3322,38 @@ async def get_service_control_status():
         logger.error(f"获取服务控制状态失败: {e}")
         raise HTTPException(status_code=500, detail=f"获取服务控制状态失败: {str(e)}")
 
+def _log_file_version(log_file: Path):
+    """日志文件版本（大小, 修改时间），文件不存在时返回 None"""
+    try:
+        stat = log_file.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
 @app.get("/api/system/logs")
-async def get_system_logs(lines: int = 50):
-    """获取系统日志"""
+async def get_system_logs(request: Request, lines: int = Query(50, ge=1, le=1000, description="返回最后 N 行")):
+    """获取系统日志 - 日志文件未变化时复用快照并返回 304
+    
+    只保留一份快照（行数计入版本），响应缓存使用固定键，不随请求的行数增长
+    """
+    log_file = Path("data/logs/controller.log")
+    version = (await io_pool.run("logs.stat", _log_file_version, log_file), lines)
+    cached = getattr(get_system_logs, '_cache', None)
+    if cached is None or cached[0] != version:
+        cached = get_system_logs._cache = (version, await _system_logs_snapshot(log_file, lines))
+    return response_cache.respond(request, "system-logs", cached[1])
+
+async def _system_logs_snapshot(log_file: Path, lines: int):
+    """读取并格式化最后N行日志"""
     try:
-        log_file = Path("data/logs/controller.log")
-        if not log_file.exists():
+        # 在I/O线程池中读取最后N行日志
+        recent_lines = await io_pool.run("logs.tail", _read_log_tail, log_file, lines)
+        if recent_lines is None:
             return {
                 "success": True,
                 "logs": ["日志文件不存在"]
             }
         
-        # 读取最后N行日志
-        with open(log_file, 'r', encoding='utf-8') as f:
-            all_lines = f.readlines()
-            recent_lines = all_lines[-lines:] if len(all_lines) > lines else all_lines
-        
         # 清理和格式化日志
         formatted_logs = []
         for line in recent_lines:
@@ -2206,7 +3414,7 @@ async def set_service_control_status(request: Request):
         if not service_key:
             raise HTTPException(status_code=400, detail="缺少service_key参数")
         
-        success = config_manager.set_service_control_status(service_key, enabled)
+        success = await config_manager.set_service_control_status_async(service_key, enabled)
         
         if success:
             logger.info(f"✅ 服务控制状态已更新: {service_key} = {enabled}")
@@ -2261,36 +3469,108 @@ async def batch_set_service_control_status(request: Request):
 @app.get("/health")
 async def health_check():
     """健康检查"""
+    state = await _controller_state_snapshot()
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "service": "qbit-smart-controller",
-        "controller_running": speed_controller.running
+        "controller_running": state.get("running", False),
+        "worker_role": state["worker"]["role"]
     }
 
+async def _leader_state():
+    if speed_controller.publish_snapshots:
+        state = dict(speed_controller.state_snapshot)
+    else:
+        state = speed_controller.get_controller_state()
+    state["event_loop"] = controller_loop.get_stats()
+    return state
+
+async def _ready_local():
+    ready_at = speed_controller.first_collection_at
+    return {
+        "ready": ready_at is not None,
+        "controller_running": speed_controller.running,
+        "ready_at": ready_at.isoformat() if ready_at else None,
+        "startup_seconds": round((ready_at - STARTED_AT).total_seconds(), 3) if ready_at else None
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查 - 控制器完成首次成功采集后返回 200，否则 503（Docker 健康检查使用）"""
+    try:
+        state = await run_on_leader("ready")
+    except HTTPException as e:
+        return JSONResponse({"ready": False, "detail": e.detail}, status_code=503)
+    state["worker_role"] = leader_election.get_status()["role"]
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+# 领导者处理的控制平面操作
+leader_election.register("state", _leader_state)
+leader_election.register("ready", _ready_local)
+leader_election.register("lucky_parse_stats", _lucky_parse_stats_local)
+leader_election.register("start", _start_controller_local)
+leader_election.register("stop", _stop_controller_local)
+leader_election.register("restore", _restore_instance_local)
+leader_election.register("restore_all", _restore_all_local)
+leader_election.register("reset_connections", _reset_connections_local)
+leader_election.register("history_rows", _history_rows_local)
+leader_election.register("rates", _rates_snapshot_local)
+leader_election.register("qbit_status", _qbit_status_local)
+leader_election.register("profile", _profile_local)
+leader_election.register("traces", _traces_local)
+leader_election.register("memory", _memory_local)
+leader_election.register("tracemalloc", _tracemalloc_local)
+
+async def _on_elected():
+    """成为领导者：启动 qBittorrent 遥测轮询、内存统计和控制循环"""
+    qbit_telemetry.start()
+    memory_monitor.start()
+    config = await config_manager.load_config_async()
+    if config.get("controller_settings", {}).get("isolated_loop", False):
+        await _isolate_controller()
+        logger.info("🧵 控制器运行在独立事件循环线程中")
+        await controller_loop.call(speed_controller.start())
+    else:
+        await speed_controller.start()
+
 @app.on_event("startup")
 async def startup_event():
-    """应用启动时启动控制器"""
-    logger.info("🚀 应用启动，初始化控制器...")
-    # 启动控制循环
-    asyncio.create_task(speed_controller.start())
-    logger.info("✅ 控制器已启动")
+    """应用启动时竞选领导者，只有领导者启动控制器"""
+    logger.info(f"🚀 应用启动，初始化控制器...（启动耗时 {(datetime.now() - STARTED_AT).total_seconds():.2f}s）")
+    config = await config_manager.load_config_async()
+    admission.configure(config.get("web_settings", {}).get("admission"))
+    # 启动控制循环（多 worker 时只有一个进程运行）
+    leader_election.start_campaign(_on_elected)
+    logger.info("✅ 控制器领导者选举已启动")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """应用关闭时清理资源"""
     logger.info("⏹️ 应用关闭，清理资源...")
-    await speed_controller.stop()
+    await on_controller(speed_controller.stop())
+    if controller_loop.running:
+        await controller_loop.call(speed_controller.lucky_monitor.close())
+        await controller_loop.call(speed_controller.qbit_manager.close())
+        await controller_loop.stop()
+    await qbit_telemetry.stop()
+    await memory_monitor.stop()
+    await leader_election.release()
     await lucky_monitor.close()
     await qbit_manager.close()
+    await history_store.flush()
+    io_pool.shutdown()
     logger.info("✅ 资源清理完成")
 
 if __name__ == "__main__":
+    import uvicorn
+    
     config = config_manager.load_config()
     web_settings = config.get("web_settings", {})
     
     host = web_settings.get("host", "0.0.0.0")
     port = web_settings.get("port", 5000)
+    workers = web_settings.get("workers", 1)
     
     print("=" * 60)
     print(f"🚀 智能 qBittorrent 限速控制器 {VERSION_STRING}")
@@ -2306,14 +3586,30 @@ if __name__ == "__main__":
     print("   /api/qbit/status  - qBittorrent状态")
     print("   /api/test/lucky/{index} - 测试Lucky连接")
     print("   /api/test/qbit/{index} - 测试QB连接")
+    print("   /api/history   - 历史数据（服务端降采样）")
+    print("   /api/system/leader - 多 worker 领导者状态")
     print("   /api/debug/config - 调试配置")
+    print("   /api/debug/profile - 采样分析")
     print("   /health        - 健康检查")
     print("=" * 60)
     
-    uvicorn.run(
-        app, 
-        host=host, 
-        port=port,
-        log_level="info",
-        access_log=True
-    )
+    if workers > 1:
+        # 多 worker 需要以导入字符串启动；控制器通过领导者选举只在一个 worker 中运行
+        print(f"👥 Worker 数量: {workers}")
+        uvicorn.run(
+            "main:app",
+            app_dir=str(Path(__file__).resolve().parent),
+            host=host,
+            port=port,
+            workers=workers,
+            log_level="info",
+            access_log=True
+        )
+    else:
+        uvicorn.run(
+            app, 
+            host=host, 
+            port=port,
+            log_level="info",
+            access_log=True
+        )
@@ -0,0 +1,305 @@
+"""
+内存统计
+定期采集进程 RSS 和已登记数据结构（服务控制状态、Lucky 响应缓存、种子列表缓存、Cookie/SID 等）的条目数与深度大小，
+RSS 或单个结构在观察窗口内的增长超过阈值、或 RSS 接近容器内存上限时记录告警；
+按需启动 tracemalloc，保存快照并比较两个时间点之间增长最多的分配位置，无需重启或挂调试器即可定位泄漏
+"""
+
+import asyncio
+import gc
+import linecache
+import logging
+import sys
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger("qbit-controller")
+
+DEFAULT_MEMORY = {
+    "interval": 60,              # 采样间隔（秒）
+    "window": 3600,              # 增长观察窗口（秒）
+    "growth_alert_mb": 64,       # 窗口内 RSS 增长超过该值告警
+    "structure_alert_mb": 16,    # 窗口内单个数据结构增长超过该值告警
+    "limit_mb": 0,               # 内存上限，0=读取 cgroup 限制
+    "limit_alert_ratio": 0.85,   # RSS 超过上限的该比例告警
+    "alert_cooldown": 1800       # 同一告警的最小间隔（秒）
+}
+
+# 深度统计单个结构时最多遍历的对象数，超出时结果标记为 truncated
+MAX_OBJECTS = 500_000
+# 保留的 tracemalloc 快照数
+MAX_SNAPSHOTS = 5
+
+_CGROUP_LIMIT_FILES = (Path("/sys/fs/cgroup/memory.max"), Path("/sys/fs/cgroup/memory/memory.limit_in_bytes"))
+
+
+def get_memory_settings(settings: dict) -> dict:
+    """合并默认值后的内存统计配置"""
+    merged = dict(DEFAULT_MEMORY)
+    merged.update(settings.get("memory") or {})
+    return merged
+
+
+def read_rss() -> int:
+    """当前进程 RSS（bytes）；无 /proc 时返回峰值 RSS"""
+    try:
+        with open("/proc/self/status", "rb") as f:
+            for line in f:
+                if line.startswith(b"VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def read_memory_limit() -> int:
+    """容器内存上限（bytes），读取不到或不限制时返回 0"""
+    for path in _CGROUP_LIMIT_FILES:
+        try:
+            value = path.read_text().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return 0
+
+
+def deep_size(obj, limit: int = MAX_OBJECTS) -> tuple:
+    """递归统计容器及其内容的大小，返回 (bytes, 对象数, 是否截断)；共享对象只计一次
+
+    只展开内置容器和定义了 __slots__ 的数据对象，其他对象只计自身大小（避免经由会话、事件循环等引用统计到整个进程）
+    """
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        if len(seen) >= limit:
+            return size, len(seen), True
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+        else:
+            for slot in getattr(type(item), "__slots__", ()):
+                value = getattr(item, slot, None)
+                if value is not None:
+                    stack.append(value)
+    return size, len(seen), False
+
+
+def _mb(value: float) -> float:
+    return round(value / 1048576, 2)
+
+
+class MemoryMonitor:
+    """RSS / 数据结构大小采样和增长告警
+
+    track(name, getter) 登记结构：getter 每次采样时调用，返回当前对象（客户端可能被替换，不直接保存引用）
+    """
+
+    def __init__(self, config_manager=None, clock=time.monotonic):
+        self.config_manager = config_manager
+        self._time = clock
+        self.options = dict(DEFAULT_MEMORY)
+        self._getters = {}
+        self.samples = deque()   # (单调时间, 时间戳, RSS, {结构名: bytes})
+        self.latest = None
+        self.alerts = deque(maxlen=50)
+        self._alerted = {}
+        self._task = None
+        self.snapshots = deque(maxlen=MAX_SNAPSHOTS)
+        self._snapshot_seq = 0
+
+    def track(self, name: str, getter):
+        self._getters[name] = getter
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run())
+        logger.info("🧠 内存统计已启动")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                if self.config_manager is not None:
+                    config = await self.config_manager.load_config_async()
+                    self.options = get_memory_settings(config.get("controller_settings", {}))
+                await self.sample()
+            except Exception as e:
+                logger.error(f"❌ 内存统计采样失败: {e}")
+            await asyncio.sleep(self.options["interval"])
+
+    def _measure(self) -> tuple:
+        structures = {}
+        for name, getter in self._getters.items():
+            try:
+                obj = getter()
+                entries = len(obj) if hasattr(obj, "__len__") else None
+                # 被测结构可能在其他线程中同时修改，遍历失败时重试一次
+                for attempt in range(2):
+                    try:
+                        size, objects, truncated = deep_size(obj)
+                        break
+                    except RuntimeError:
+                        if attempt:
+                            raise
+                structures[name] = {"entries": entries, "bytes": size, "objects": objects, "truncated": truncated}
+            except Exception as e:
+                structures[name] = {"error": str(e)}
+        return structures, len(gc.get_objects())
+
+    async def sample(self) -> dict:
+        """采集一次（结构遍历在线程中执行，不阻塞事件循环）"""
+        structures, objects = await asyncio.to_thread(self._measure)
+        now = self._time()
+        rss = read_rss()
+        limit = self.options["limit_mb"] * 1048576 or read_memory_limit()
+        sizes = {name: info["bytes"] for name, info in structures.items() if "bytes" in info}
+        self.samples.append((now, datetime.now().isoformat(), rss, sizes))
+        while self.samples and now - self.samples[0][0] > self.options["window"]:
+            self.samples.popleft()
+        self.latest = {
+            "sampled_at": datetime.now().isoformat(),
+            "rss_mb": _mb(rss),
+            "limit_mb": _mb(limit) if limit else None,
+            "structures": {
+                name: {**info, "mb": _mb(info["bytes"])} if "bytes" in info else info
+                for name, info in structures.items()
+            },
+            "gc": {"objects": objects, "counts": gc.get_count()}
+        }
+        self._check(now, rss, limit, sizes)
+        return self.latest
+
+    def _check(self, now: float, rss: int, limit: int, sizes: dict):
+        """窗口内最低点到当前值的增长超过阈值时告警"""
+        baseline = min(sample[2] for sample in self.samples)
+        growth = rss - baseline
+        if growth > self.options["growth_alert_mb"] * 1048576:
+            self._alert(now, "rss_growth", f"进程 RSS 在 {self.options['window']}秒内增长 {_mb(growth)}MB（当前 {_mb(rss)}MB）")
+        if limit and rss > limit * self.options["limit_alert_ratio"]:
+            self._alert(now, "rss_limit", f"进程 RSS {_mb(rss)}MB 已达内存上限 {_mb(limit)}MB 的 {rss * 100 / limit:.0f}%")
+        for name, size in sizes.items():
+            low = min((sample[3][name] for sample in self.samples if name in sample[3]), default=size)
+            if size - low > self.options["structure_alert_mb"] * 1048576:
+                self._alert(now, f"structure:{name}", f"数据结构 {name} 在 {self.options['window']}秒内增长 {_mb(size - low)}MB（当前 {_mb(size)}MB）")
+
+    def _alert(self, now: float, key: str, message: str):
+        last = self._alerted.get(key)
+        if last is not None and now - last < self.options["alert_cooldown"]:
+            return
+        self._alerted[key] = now
+        self.alerts.append({"time": datetime.now().isoformat(), "kind": key, "message": message})
+        logger.warning(f"📈 内存增长告警: {message}")
+
+    def get_report(self) -> dict:
+        return {
+            "running": self.running,
+            "options": self.options,
+            "current": self.latest,
+            "history": [{"time": stamp, "rss_mb": _mb(rss)} for _, stamp, rss, _ in self.samples],
+            "alerts": list(self.alerts),
+            "tracemalloc": self.tracemalloc_status()
+        }
+
+    # ---- tracemalloc ----
+
+    def tracemalloc_status(self) -> dict:
+        status = {"tracing": tracemalloc.is_tracing(), "snapshots": [
+            {"id": snap_id, "taken_at": taken_at, "traced_mb": _mb(traced)}
+            for snap_id, taken_at, traced, _ in self.snapshots
+        ]}
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            status.update({
+                "frames": tracemalloc.get_traceback_limit(),
+                "traced_mb": _mb(current),
+                "peak_mb": _mb(peak),
+                "overhead_mb": _mb(tracemalloc.get_tracemalloc_memory())
+            })
+        return status
+
+    def start_tracing(self, frames: int = 10) -> dict:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            logger.info(f"🧠 tracemalloc 已启动（{frames} 帧）")
+        return self.tracemalloc_status()
+
+    def stop_tracing(self) -> dict:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self.snapshots.clear()
+            logger.info("🧠 tracemalloc 已停止，快照已清除")
+        return self.tracemalloc_status()
+
+    def take_snapshot(self) -> dict:
+        """保存一个快照（最多保留 MAX_SNAPSHOTS 个），返回快照编号"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc 未启动")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        self._snapshot_seq += 1
+        traced = sum(stat.size for stat in snapshot.statistics("filename"))
+        self.snapshots.append((self._snapshot_seq, datetime.now().isoformat(), traced, snapshot))
+        return {"id": self._snapshot_seq, "traced_mb": _mb(traced)}
+
+    def _snapshot(self, snap_id: int):
+        for item in self.snapshots:
+            if item[0] == snap_id:
+                return item[3]
+        raise KeyError(f"快照不存在或已被淘汰: {snap_id}")
+
+    def diff(self, base: int, target: int = None, group_by: str = "lineno", limit: int = 25) -> dict:
+        """比较两个快照（target 为空时与当前内存比较），返回增长最多的分配位置"""
+        old = self._snapshot(base)
+        if target is None:
+            target = self.take_snapshot()["id"]
+        new = self._snapshot(target)
+        stats = new.compare_to(old, group_by)
+        stats.sort(key=lambda stat: stat.size_diff, reverse=True)
+        top = []
+        for stat in stats[:limit]:
+            frame = stat.traceback[0]
+            top.append({
+                "location": f"{frame.filename}:{frame.lineno}",
+                "line": linecache.getline(frame.filename, frame.lineno).strip(),
+                "size_diff_kb": round(stat.size_diff / 1024, 1),
+                "size_kb": round(stat.size / 1024, 1),
+                "count_diff": stat.count_diff,
+                "count": stat.count,
+                "traceback": [f"{f.filename}:{f.lineno}" for f in stat.traceback] if group_by == "traceback" else None
+            })
+        return {
+            "base": base,
+            "target": target,
+            "group_by": group_by,
+            "total_diff_kb": round(sum(stat.size_diff for stat in stats) / 1024, 1),
+            "top": top
+        }
+
@@ -0,0 +1,148 @@
+"""
+按需采样分析器
+后台线程按固定间隔读取所有线程的调用栈（sys._current_frames），只统计不插桩，开销与采样频率成正比；
+输出 collapsed stack（flamegraph.pl / speedscope 可直接读取）和按自身/累计样本排序的热点函数，
+并按调用栈把样本归类到控制循环、请求处理、遥测轮询、I/O 线程池或空闲等待
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# 单个调用栈最多记录的帧数
+MAX_DEPTH = 128
+
+# 空闲等待：事件循环 select、锁/条件变量等待、线程池工作线程等待任务（阻塞在 C 层的队列 get 上）
+_IDLE_FILES = ("selectors.py", "threading.py", "queue.py")
+_IDLE_FUNCS = {("thread.py", "_worker")}
+
+_REQUEST_MARKERS = (f"{os.sep}starlette{os.sep}", f"{os.sep}fastapi{os.sep}", f"{os.sep}uvicorn{os.sep}protocols{os.sep}")
+
+# 按 (文件名, 函数名) 归类：co_qualname 只在 Python 3.11+ 可用，不能依赖类名前缀
+_CONTROLLER_FUNCS = {("main.py", name) for name in (
+    "start", "warm_up", "stop", "_control_cycle", "_decide", "_collect_total_connections", "_record_cycle_samples",
+    "_proportional_control", "_instance_rates", "_apply_budget", "_apply_targeted_limits", "_apply_limited_mode",
+    "_apply_normal_mode", "_push_limits", "_push_targeted", "_restore_instance_with_retry", "_restore_attempts",
+    "_handle_failed_instances", "_record_failed_instance", "_send_failure_alert"
+)}
+_TELEMETRY_FUNCS = {("telemetry.py", name) for name in ("_supervise", "_poll_instance")}
+
+
+class ProfilerBusy(Exception):
+    """已有采样在进行"""
+
+
+def _qualname(code) -> str:
+    return getattr(code, "co_qualname", code.co_name)
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._labels = {}
+        self.runs = 0
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{_qualname(code)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    @staticmethod
+    def _categorize(thread_name: str, codes: list) -> str:
+        """codes 从叶到根"""
+        leaf_file = os.path.basename(codes[0].co_filename)
+        if leaf_file in _IDLE_FILES or (leaf_file, codes[0].co_name) in _IDLE_FUNCS:
+            return "idle"
+        if thread_name.startswith("io-pool"):
+            return "io_pool"
+        if any(marker in code.co_filename for code in codes for marker in _REQUEST_MARKERS):
+            return "request"
+        funcs = {(os.path.basename(code.co_filename), code.co_name) for code in codes}
+        if thread_name == "controller-loop" or funcs & _CONTROLLER_FUNCS:
+            return "controller"
+        if funcs & _TELEMETRY_FUNCS:
+            return "telemetry"
+        return "other"
+
+    def sample(self, seconds: float, interval: float = 0.005, top: int = 25) -> dict:
+        """阻塞采样 seconds 秒（在独立线程中调用），返回分析结果"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("已有采样正在进行")
+        try:
+            return self._sample(seconds, interval, top)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, interval: float, top: int) -> dict:
+        own = threading.get_ident()
+        stacks = Counter()
+        self_counts = Counter()
+        cumulative = Counter()
+        categories = Counter()
+        threads = Counter()
+        rounds = 0
+        cpu_start = time.thread_time()
+        started = time.perf_counter()
+        deadline = started + seconds
+
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                codes = []
+                while frame is not None and len(codes) < MAX_DEPTH:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                del frame
+                if not codes:
+                    continue
+                thread_name = names.get(ident, str(ident))
+                category = self._categorize(thread_name, codes)
+                categories[category] += 1
+                threads[thread_name] += 1
+                stacks[(category, thread_name, tuple(reversed(codes)))] += 1
+                if category == "idle":
+                    continue
+                self_counts[codes[0]] += 1
+                for code in set(codes):
+                    cumulative[code] += 1
+            rounds += 1
+            time.sleep(interval)
+
+        elapsed = time.perf_counter() - started
+        busy = sum(count for category, count in categories.items() if category != "idle") or 1
+        collapsed = "\n".join(
+            f"{category};{thread_name};{';'.join(self._label(code) for code in codes)} {count}"
+            for (category, thread_name, codes), count in stacks.most_common()
+        )
+        self.runs += 1
+        return {
+            "seconds": round(elapsed, 3),
+            "interval_ms": round(interval * 1000, 2),
+            "rounds": rounds,
+            "samples": sum(categories.values()),
+            "overhead_cpu_seconds": round(time.thread_time() - cpu_start, 4),
+            "by_category": dict(categories.most_common()),
+            "by_thread": dict(threads.most_common()),
+            "top_self": [
+                {"function": self._label(code), "samples": count, "percent": round(count * 100 / busy, 1)}
+                for code, count in self_counts.most_common(top)
+            ],
+            "top_cumulative": [
+                {"function": self._label(code), "samples": count, "percent": round(count * 100 / busy, 1)}
+                for code, count in cumulative.most_common(top)
+            ],
+            "collapsed": collapsed
+        }
+
+
+profiler = SamplingProfiler()
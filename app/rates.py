@@ -0,0 +1,145 @@
+"""
+计数器速率引擎
+Lucky 的 TrafficIn/TrafficOut 和 qBittorrent 的 dl_info_data/up_info_data 都是累计字节计数器，
+每个来源用环形缓冲保存 (单调时间, 计数值) 样本，计数器回绕或重启时重新取基线；
+每次采样只计算一次瞬时速率和 EWMA，控制器、历史记录和仪表盘直接读取结果；
+控制器可能运行在独立线程中，与 Web 事件循环的遥测轮询同时写入，引擎内部加锁
+"""
+
+import math
+import threading
+import time
+from collections import deque
+
+# 来源超过该时间（秒）没有新样本才丢弃：设备短暂离线或单次采集失败时保留序列，恢复后直接接续计算速率
+SERIES_TTL = 300
+
+
+class RateSeries:
+    """单个累计计数器的速率序列"""
+
+    def __init__(self, capacity: int, half_life: float):
+        self.samples = deque(maxlen=capacity)  # (单调时间, 计数值)
+        self.tau = half_life / math.log(2)
+        self.rate = None    # 最近一个采样区间的速率 bytes/s
+        self.ewma = None    # 按时间衰减的指数加权平均速率
+        self.resets = 0
+        self.updated_at = None
+
+    def observe(self, t: float, value: float):
+        """追加样本，返回最近区间的速率；首次采样或计数器重置时返回 None"""
+        self.updated_at = t
+        if not self.samples:
+            self.samples.append((t, value))
+            return None
+        last_t, last_value = self.samples[-1]
+        if value < last_value:
+            # 计数器回绕或来源重启：丢弃旧样本，从当前值重新开始
+            self.samples.clear()
+            self.samples.append((t, value))
+            self.resets += 1
+            self.rate = None
+            return None
+        dt = t - last_t
+        if dt <= 0:
+            return self.rate
+        self.samples.append((t, value))
+        self.rate = (value - last_value) / dt
+        if self.ewma is None:
+            self.ewma = self.rate
+        else:
+            alpha = 1 - math.exp(-dt / self.tau)
+            self.ewma += alpha * (self.rate - self.ewma)
+        return self.rate
+
+    def window_rate(self, window: float):
+        """最近 window 秒内的平均速率（样本不足时返回 None）"""
+        if len(self.samples) < 2:
+            return None
+        end_t, end_value = self.samples[-1]
+        # 至少使用最近一个区间，再向前扩展到窗口内最早的样本
+        start_t, start_value = self.samples[-2]
+        for index in range(len(self.samples) - 3, -1, -1):
+            t, value = self.samples[index]
+            if end_t - t > window:
+                break
+            start_t, start_value = t, value
+        if end_t <= start_t:
+            return None
+        return (end_value - start_value) / (end_t - start_t)
+
+    def to_dict(self, window: float) -> dict:
+        return {
+            "rate": round(self.rate, 1) if self.rate is not None else None,
+            "ewma": round(self.ewma, 1) if self.ewma is not None else None,
+            "window_rate": _round(self.window_rate(window)),
+            "samples": len(self.samples),
+            "resets": self.resets
+        }
+
+
+def _round(value):
+    return round(value, 1) if value is not None else None
+
+
+class RateEngine:
+    """按来源键（如 lucky/<设备>/<服务>/in、qbit/<实例>/upload）管理速率序列"""
+
+    def __init__(self, capacity: int = 120, half_life: float = 10, window: float = 30, clock=None, ttl: float = SERIES_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.half_life = half_life
+        self.window = window
+        self._time = clock.time if clock is not None else time.monotonic
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key: str, value: float, t: float = None):
+        """记录计数器样本，返回最近区间的速率"""
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = RateSeries(self.capacity, self.half_life)
+            return series.observe(self._time() if t is None else t, float(value))
+
+    def rate(self, key: str, window: float = None):
+        """最近区间速率；指定 window 时返回窗口平均速率；无数据时返回 None"""
+        series = self._series.get(key)
+        if series is None:
+            return None
+        return series.rate if window is None else series.window_rate(window)
+
+    def ewma(self, key: str):
+        series = self._series.get(key)
+        return series.ewma if series is not None else None
+
+    def total(self, prefix: str, suffix: str = "", smoothed: bool = False) -> float:
+        """前缀/后缀匹配的所有来源速率之和（无数据的来源按 0 计）"""
+        total = 0.0
+        with self._lock:
+            for key, series in self._series.items():
+                if key.startswith(prefix) and key.endswith(suffix):
+                    value = series.ewma if smoothed else series.rate
+                    total += value or 0.0
+        return total
+
+    def forget(self, prefix: str, keep: set):
+        """丢弃前缀下已不存在的来源"""
+        with self._lock:
+            for key in [k for k in self._series if k.startswith(prefix) and k not in keep]:
+                del self._series[key]
+
+    def expire(self, prefix: str, now: float = None):
+        """丢弃前缀下超过 ttl 没有新样本的来源（now 与 observe 的 t 使用同一时间基准）"""
+        now = self._time() if now is None else now
+        with self._lock:
+            for key in [k for k, series in self._series.items()
+                        if k.startswith(prefix) and now - series.updated_at > self.ttl]:
+                del self._series[key]
+
+    def snapshot(self, prefix: str = "") -> dict:
+        with self._lock:
+            return {key: series.to_dict(self.window) for key, series in self._series.items() if key.startswith(prefix)}
+
+
+rate_engine = RateEngine()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+确定性仿真模式
+向 SpeedController 注入虚拟时钟和连接数轨迹（录制或合成），
+在几秒内回放数小时流量，统计限速切换次数、限速时长和平均响应延迟，
+用于离线调优 limit_on_delay / limit_off_delay 等参数
+
+用法:
+    python app/simulation.py --synthetic --duration 21600 --on-delay 0,5,10 --off-delay 10,30,60
+    python app/simulation.py --trace connections.csv --poll-interval 1
+    python app/simulation.py --history controller/raw_connections --hours 24
+"""
+
+import argparse
+import asyncio
+import bisect
+import csv
+import json
+import logging
+import random
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from clock import VirtualClock
+
+SIM_SERVICE = "simulated-service"
+
+
+class ConnectionTrace:
+    """连接数轨迹 - 阶梯函数 (时间秒, 连接数)"""
+
+    def __init__(self, points: list):
+        points = sorted((float(t), float(c)) for t, c in points)
+        if not points:
+            points = [(0.0, 0.0)]
+        # 时间从0开始
+        offset = points[0][0]
+        self.times = [t - offset for t, _ in points]
+        self.values = [c for _, c in points]
+
+    @property
+    def duration(self) -> float:
+        return self.times[-1]
+
+    def value_at(self, t: float) -> float:
+        index = bisect.bisect_right(self.times, t) - 1
+        return self.values[index] if index >= 0 else 0.0
+
+    def activity_periods(self) -> list:
+        """连接数 > 0 的时间段 [(开始, 结束)]"""
+        periods = []
+        start = None
+        for t, value in zip(self.times, self.values):
+            if value > 0 and start is None:
+                start = t
+            elif value <= 0 and start is not None:
+                periods.append((start, t))
+                start = None
+        if start is not None:
+            periods.append((start, self.duration))
+        return periods
+
+    @classmethod
+    def load(cls, path: str) -> "ConnectionTrace":
+        """从 CSV (时间,连接数) 或 JSON 列表加载轨迹，时间可以是秒数或 ISO 时间"""
+        def parse_time(value):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return datetime.fromisoformat(str(value)).timestamp()
+
+        file_path = Path(path)
+        points = []
+        if file_path.suffix == ".json":
+            with open(file_path, encoding="utf-8") as f:
+                for item in json.load(f):
+                    if isinstance(item, dict):
+                        points.append((parse_time(item.get("t", item.get("timestamp"))), item.get("connections", 0)))
+                    else:
+                        points.append((parse_time(item[0]), item[1]))
+        else:
+            with open(file_path, encoding="utf-8", newline="") as f:
+                for row in csv.reader(f):
+                    if not row or row[0].startswith("#"):
+                        continue
+                    try:
+                        points.append((parse_time(row[0]), float(row[1])))
+                    except (ValueError, IndexError):
+                        continue  # 跳过表头等无效行
+        return cls(points)
+
+    @classmethod
+    def from_store(cls, store, series: str, start: float, end: float) -> "ConnectionTrace":
+        """从历史存储回放录制的样本"""
+        return cls(store.replay(series, start, end))
+
+    @classmethod
+    def synthetic(cls, duration: float, seed: int = 1, mean_gap: float = 900, mean_session: float = 1800,
+                  flap_probability: float = 0.3, max_connections: int = 4) -> "ConnectionTrace":
+        """生成合成轨迹：随机播放会话，会话中偶尔出现短暂断开（模拟连接抖动）"""
+        rng = random.Random(seed)
+        points = [(0.0, 0.0)]
+        t = rng.expovariate(1 / mean_gap)
+        while t < duration:
+            session_end = min(duration, t + rng.expovariate(1 / mean_session))
+            while t < session_end:
+                points.append((t, rng.randint(1, max_connections)))
+                t += rng.uniform(5, 120)
+                if rng.random() < flap_probability and t < session_end:
+                    points.append((t, 0))
+                    t += rng.uniform(1, 20)
+            points.append((session_end, 0))
+            t = session_end + rng.expovariate(1 / mean_gap)
+        points.append((duration, 0))
+        return cls(points)
+
+
+class SimConfigManager:
+    """仿真用配置管理器 - 配置保存在内存中，服务控制全部启用"""
+
+    def __init__(self, settings: dict, instances: int = 1):
+        self.config = {
+            "lucky_devices": [{"name": "sim-lucky", "api_url": "sim://lucky", "weight": 1.0, "enabled": True}],
+            "qbittorrent_instances": [
+                {"name": f"sim-qb-{i}", "host": f"sim://qb{i}", "username": "sim", "password": "", "enabled": True}
+                for i in range(instances)
+            ],
+            "controller_settings": settings
+        }
+
+    def load_config(self):
+        return self.config
+
+    async def load_config_async(self):
+        return self.config
+
+    def discover_and_initialize_services(self, detected_services):
+        return []
+
+    def get_all_service_control_status(self):
+        return {SIM_SERVICE: True}
+
+
+class SimLuckyMonitor:
+    """仿真用 Lucky 监控 - 按虚拟时钟从轨迹读取连接数"""
+
+    def __init__(self, trace: ConnectionTrace, clock: VirtualClock):
+        self.trace = trace
+        self.clock = clock
+
+    async def get_device_connections(self, device_config: dict, max_retries: int = 2):
+        connections = self.trace.value_at(self.clock.time())
+        return {
+            "success": True,
+            "device_name": device_config["name"],
+            "connections": connections,
+            "weighted_connections": connections * device_config.get("weight", 1.0),
+            "detailed_connections": [
+                {"rule_name": SIM_SERVICE, "key": SIM_SERVICE, "remark": "", "connections": connections}
+            ]
+        }
+
+
+class SimQbitManager:
+    """仿真用 qBittorrent 管理器 - 记录限速推送"""
+
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.pushes = []
+        self.cookies = {}
+        self.sid_cache = {}
+
+    async def set_speed_limits(self, instance_config: dict, download_limit: int, upload_limit: int,
+                               max_retries: int = 3) -> bool:
+        self.pushes.append((self.clock.time(), instance_config["name"], download_limit, upload_limit))
+        return True
+
+    async def test_connection(self, instance_config: dict):
+        return {"success": True}
+
+
+async def simulate(trace: ConnectionTrace, settings: dict, instances: int = 1, duration: float = None) -> dict:
+    """在虚拟时钟上运行控制器并统计结果"""
+    from main import SpeedController
+
+    clock = VirtualClock()
+    qbit = SimQbitManager(clock)
+    controller = SpeedController(SimConfigManager(settings, instances), SimLuckyMonitor(trace, clock), qbit,
+                                 clock=clock)
+    controller.running = True
+    duration = duration if duration is not None else trace.duration
+
+    transitions = []  # (时间, is_limited)
+    previous = controller.is_limited
+    cycles = 0
+    while clock.time() < duration:
+        # 状态切换归属于本周期的采样时刻
+        sampled_at = clock.time()
+        await controller._control_cycle()
+        cycles += 1
+        if controller.is_limited != previous:
+            previous = controller.is_limited
+            transitions.append((sampled_at, previous))
+
+    # 限速区间
+    limited_intervals = []
+    limited_since = None
+    for t, limited in transitions:
+        if limited:
+            limited_since = t
+        elif limited_since is not None:
+            limited_intervals.append((limited_since, t))
+            limited_since = None
+    if limited_since is not None:
+        limited_intervals.append((limited_since, duration))
+    limited_time = sum(end - start for start, end in limited_intervals)
+
+    # 响应延迟：从活动开始到进入限速；活动期间始终未限速则计为漏判
+    periods = [(start, min(end, duration)) for start, end in trace.activity_periods() if start < duration]
+    reaction = []
+    missed = 0
+    unprotected = 0.0
+    for start, end in periods:
+        covered = sum(max(0.0, min(end, l_end) - max(start, l_start)) for l_start, l_end in limited_intervals)
+        unprotected += (end - start) - covered
+        if any(l_start <= start < l_end for l_start, l_end in limited_intervals):
+            continue  # 活动开始时已处于限速状态
+        entered = [l_start for l_start, _ in limited_intervals if start <= l_start <= end]
+        if entered:
+            reaction.append(entered[0] - start)
+        else:
+            missed += 1
+    active_time = sum(end - start for start, end in periods)
+
+    return {
+        "settings": {k: settings.get(k) for k in ("poll_interval", "limit_on_delay", "limit_off_delay")},
+        "simulated_seconds": round(duration, 1),
+        "cycles": cycles,
+        "throttle_flips": len(transitions),
+        "limit_pushes": len(qbit.pushes),
+        "time_limited_seconds": round(limited_time, 1),
+        "time_limited_ratio": round(limited_time / duration, 4) if duration else 0.0,
+        "activity_periods": len(periods),
+        "active_seconds": round(active_time, 1),
+        "unprotected_active_seconds": round(unprotected, 1),
+        "avg_reaction_seconds": round(sum(reaction) / len(reaction), 2) if reaction else None,
+        "max_reaction_seconds": round(max(reaction), 2) if reaction else None,
+        "missed_activity_periods": missed
+    }
+
+
+def _parse_list(value: str) -> list:
+    return [float(v) if "." in v else int(v) for v in value.split(",") if v.strip()]
+
+
+async def run_sweep(trace: ConnectionTrace, args) -> list:
+    results = []
+    for on_delay in _parse_list(args.on_delay):
+        for off_delay in _parse_list(args.off_delay):
+            settings = {
+                "poll_interval": args.poll_interval,
+                "limit_on_delay": on_delay,
+                "limit_off_delay": off_delay,
+                "limited_download": 1024,
+                "limited_upload": 512,
+                "normal_download": 0,
+                "normal_upload": 0,
+                # 仿真不需要控制周期 trace，关闭后每个虚拟周期少创建一组 span
+                "tracing": {"enabled": False}
+            }
+            results.append(await simulate(trace, settings, args.instances, args.duration))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SpeedHiveHome 控制状态机仿真")
+    parser.add_argument("--trace", help="连接数轨迹文件 (CSV: 时间,连接数 或 JSON)")
+    parser.add_argument("--history", metavar="SERIES", help="从历史存储回放序列，如 controller/raw_connections")
+    parser.add_argument("--history-dir", default="data/timeseries", help="历史存储目录")
+    parser.add_argument("--hours", type=float, default=24, help="回放最近多少小时的历史")
+    parser.add_argument("--synthetic", action="store_true", help="使用合成轨迹")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--duration", type=float, help="仿真时长（秒），默认为轨迹长度")
+    parser.add_argument("--poll-interval", type=float, default=1)
+    parser.add_argument("--on-delay", default="5", help="限速延迟，逗号分隔多个值进行扫描")
+    parser.add_argument("--off-delay", default="30", help="恢复延迟，逗号分隔多个值进行扫描")
+    parser.add_argument("--instances", type=int, default=1)
+    parser.add_argument("--json", help="结果保存为 JSON 文件")
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = ConnectionTrace.load(args.trace)
+    elif args.history:
+        from timeseries import TimeSeriesStore
+        now = datetime.now().timestamp()
+        trace = ConnectionTrace.from_store(TimeSeriesStore(args.history_dir), args.history,
+                                           now - args.hours * 3600, now)
+    else:
+        trace = ConnectionTrace.synthetic(args.duration or 6 * 3600, seed=args.seed)
+
+    # 导入主程序会重置日志级别，先导入再设置：仿真期间只保留错误日志
+    import main as _main  # noqa: F401
+    logging.getLogger("qbit-controller").setLevel(logging.ERROR)
+
+    started = datetime.now()
+    results = asyncio.run(run_sweep(trace, args))
+    elapsed = (datetime.now() - started).total_seconds()
+
+    print(f"\n{'on_delay':>8} {'off_delay':>9} {'flips':>6} {'limited%':>9} {'avg_react':>9} {'max_react':>9} "
+          f"{'unprotected':>11} {'missed':>6}")
+    for r in results:
+        s = r["settings"]
+        print(f"{s['limit_on_delay']:>8} {s['limit_off_delay']:>9} {r['throttle_flips']:>6} "
+              f"{r['time_limited_ratio'] * 100:>8.1f}% {str(r['avg_reaction_seconds']):>9} "
+              f"{str(r['max_reaction_seconds']):>9} {r['unprotected_active_seconds']:>11} "
+              f"{r['missed_activity_periods']:>6}")
+    print(f"\n⏱️ 仿真 {len(results)} 组参数，共 {sum(r['simulated_seconds'] for r in results):.0f} 秒流量，耗时 {elapsed:.2f} 秒")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+定向限速
+按分类、标签、Tracker、分享率从实例的种子列表中选出目标种子，
+通过 torrents/setDownloadLimit、torrents/setUploadLimit 批量（hashes=a|b|c）设置单种限速；
+记录每个种子被修改前的限速，恢复时只处理被修改过的种子并还原原值。
+修改记录持久化到文件，重启后仍能还原限速期间被修改的种子
+"""
+
+import asyncio
+import json
+import logging
+from pathlib import Path
+
+from io_pool import io_pool
+
+logger = logging.getLogger("qbit-controller")
+
+# hashes 参数最大长度：SHA-1 哈希 40 字符 + 分隔符，约 97 个种子一批
+MAX_HASHES_CHARS = 4000
+
+DEFAULT_TARGETING = {
+    "categories": [],       # 分类（精确匹配），空表示不限
+    "tags": [],             # 标签（任一匹配），空表示不限
+    "trackers": [],         # Tracker 地址包含的关键字（任一匹配），空表示不限
+    "min_ratio": 0,         # 分享率下限
+    "download_limit": 0,    # 单种下载限速 KB/s，0 表示不修改下载限速
+    "upload_limit": 128,    # 单种上传限速 KB/s，0 表示不修改上传限速
+    "refresh_interval": 30  # 限速期间重新匹配新种子的间隔（秒）
+}
+
+
+def get_targeting_settings(settings: dict) -> dict:
+    """合并默认值后的定向限速配置"""
+    merged = dict(DEFAULT_TARGETING)
+    merged.update(settings.get("targeting") or {})
+    return merged
+
+
+def _split_tags(tags) -> set:
+    if isinstance(tags, list):
+        return {t.strip() for t in tags if t.strip()}
+    return {t.strip() for t in (tags or "").split(",") if t.strip()}
+
+
+def match_torrent(torrent: dict, targeting: dict) -> bool:
+    """种子是否符合定向条件（各条件之间为“与”关系）"""
+    categories = targeting.get("categories") or []
+    if categories and torrent.get("category", "") not in categories:
+        return False
+
+    tags = targeting.get("tags") or []
+    if tags and not _split_tags(torrent.get("tags")) & set(tags):
+        return False
+
+    trackers = targeting.get("trackers") or []
+    if trackers:
+        tracker = torrent.get("tracker", "") or ""
+        if not any(keyword in tracker for keyword in trackers):
+            return False
+
+    if torrent.get("ratio", 0) < targeting.get("min_ratio", 0):
+        return False
+
+    return True
+
+
+def select_torrents(torrents: list, targeting: dict) -> list:
+    """从种子列表中选出目标种子"""
+    return [t for t in torrents if t.get("hash") and match_torrent(t, targeting)]
+
+
+def chunk_hashes(hashes: list, max_chars: int = MAX_HASHES_CHARS) -> list:
+    """把哈希列表切分为 hashes=a|b|c 参数，每批不超过 max_chars 字符"""
+    chunks = []
+    current = []
+    length = 0
+    for torrent_hash in hashes:
+        extra = len(torrent_hash) + (1 if current else 0)
+        if current and length + extra > max_chars:
+            chunks.append("|".join(current))
+            current = []
+            length = 0
+            extra = len(torrent_hash)
+        current.append(torrent_hash)
+        length += extra
+    if current:
+        chunks.append("|".join(current))
+    return chunks
+
+
+class TorrentThrottler:
+    """定向限速执行器 - 跟踪每个实例被修改的种子及其原始限速"""
+
+    def __init__(self, qbit_manager, state_file: Path = None):
+        self.qbit_manager = qbit_manager
+        self.state_file = state_file
+        # {instance_name: {hash: {"original": (dl, up), "applied": (dl, up)}}}，单位 bytes/s
+        self.applied = {}
+        self._last_refresh = {}
+
+    def load(self) -> int:
+        """加载持久化的修改记录，返回跟踪的种子数"""
+        if self.state_file is None or not self.state_file.exists():
+            return 0
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                persisted = json.load(f)
+        except Exception as e:
+            logger.error(f"❌ 加载定向限速记录失败: {e}")
+            return 0
+        # JSON 中的元组读出为列表，转换回元组以便与推送值比较
+        self.applied = {
+            name: {
+                torrent_hash: {"original": tuple(record["original"]), "applied": tuple(record["applied"])}
+                for torrent_hash, record in records.items()
+            }
+            for name, records in persisted.items() if records
+        }
+        return sum(len(records) for records in self.applied.values())
+
+    def _save(self, state: dict) -> bool:
+        try:
+            self.state_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.state_file, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            return True
+        except Exception as e:
+            logger.error(f"❌ 保存定向限速记录失败: {e}")
+            return False
+
+    async def _persist(self):
+        """在事件循环中复制快照，在串行 I/O 通道中按顺序写入"""
+        if self.state_file is None:
+            return
+        state = {name: dict(records) for name, records in self.applied.items() if records}
+        await io_pool.run_serial("targeting", "targeting.save", self._save, state)
+
+    async def apply(self, instance: dict, targeting: dict, now: float, force: bool = True) -> bool:
+        """对匹配的种子应用单种限速；已限速的种子不重复设置"""
+        name = instance["name"]
+        interval = targeting.get("refresh_interval", 30)
+        if not force and now - self._last_refresh.get(name, float("-inf")) < interval:
+            return True
+        self._last_refresh[name] = now
+
+        torrents = await self.qbit_manager.get_torrents(instance, max_age=0 if force else interval)
+        if torrents is None:
+            return False
+
+        dl_limit = int(targeting.get("download_limit", 0)) * 1024
+        up_limit = int(targeting.get("upload_limit", 0)) * 1024
+        applied = self.applied.setdefault(name, {})
+        pending = []
+        for torrent in select_torrents(torrents, targeting):
+            record = applied.get(torrent["hash"])
+            if record is not None and record["applied"] == (dl_limit, up_limit):
+                continue
+            original = record["original"] if record else (torrent.get("dl_limit", -1), torrent.get("up_limit", -1))
+            pending.append((torrent["hash"], original))
+
+        if not pending:
+            return True
+
+        hashes = [h for h, _ in pending]
+        try:
+            success = await self.qbit_manager.set_torrent_limits(
+                instance, hashes,
+                download_limit=dl_limit if dl_limit > 0 else None,
+                upload_limit=up_limit if up_limit > 0 else None
+            )
+        except asyncio.CancelledError:
+            # 被恢复命令取消时请求可能已经生效，按已修改记录，保证恢复时还原这些种子
+            for torrent_hash, original in pending:
+                applied[torrent_hash] = {"original": original, "applied": (dl_limit, up_limit)}
+            raise
+        if success:
+            for torrent_hash, original in pending:
+                applied[torrent_hash] = {"original": original, "applied": (dl_limit, up_limit)}
+            logger.info(f"🎯 {name} - 定向限速 {len(pending)} 个种子 (共跟踪 {len(applied)} 个)")
+            await self._persist()
+        return success
+
+    async def restore(self, instance: dict) -> bool:
+        """还原被修改过的种子到原始限速，只处理本控制器修改过的种子"""
+        name = instance["name"]
+        applied = self.applied.get(name)
+        if not applied:
+            return True
+
+        # 只还原实际修改过的方向，按原始限速分组批量提交
+        groups = {}
+        for torrent_hash, record in applied.items():
+            for direction in (0, 1):
+                if record["applied"][direction] > 0:
+                    groups.setdefault((direction, max(record["original"][direction], 0)), []).append(torrent_hash)
+
+        success = True
+        for (direction, original), hashes in groups.items():
+            limits = {"download_limit": original} if direction == 0 else {"upload_limit": original}
+            ok = await self.qbit_manager.set_torrent_limits(instance, hashes, **limits)
+            success = success and ok
+
+        if success:
+            self.applied.pop(name, None)
+            self._last_refresh.pop(name, None)
+            logger.info(f"🎯 {name} - 已还原 {len(applied)} 个定向限速的种子")
+            await self._persist()
+        return success
+
+    def get_state(self) -> dict:
+        return {name: len(records) for name, records in self.applied.items()}
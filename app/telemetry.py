@@ -0,0 +1,199 @@
+"""
+qBittorrent 后台遥测
+每个启用的实例一个轮询任务，按各自的间隔并发采集状态（带超时），结果写入共享的实例状态存储；
+/api/qbit/status 和连接健康接口直接读取存储并标注数据新鲜度，不再在请求中同步采集
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+logger = logging.getLogger("qbit-controller")
+
+DEFAULT_TELEMETRY = {
+    "interval": 5,        # 每个实例的采集间隔（秒），可用 qbittorrent_instances[].poll_interval 单独覆盖
+    "torrents_interval": 300,  # 种子列表（用于种子计数）的刷新间隔（秒），其余轮询只请求 transfer/info
+    "timeout": 10,        # 单次采集超时（秒）
+    "max_backoff": 60,    # 连续失败时的最长采集间隔（秒）
+    "stale_after": 3      # 超过 interval × stale_after 未更新视为过期
+}
+
+# 重新加载实例列表的间隔（秒）
+RECONCILE_INTERVAL = 10
+
+
+def get_telemetry_settings(settings: dict) -> dict:
+    """合并默认值后的遥测配置"""
+    merged = dict(DEFAULT_TELEMETRY)
+    merged.update(settings.get("telemetry") or {})
+    return merged
+
+
+class StatusStore:
+    """按实例名保存最近一次采集结果和时间戳"""
+
+    def __init__(self, clock=time.monotonic):
+        self._time = clock
+        self.entries = {}
+        self.version = 0
+
+    def update(self, name: str, status: dict, duration: float):
+        entry = self.entries.setdefault(name, {"polls": 0, "failures": 0, "consecutive_failures": 0})
+        ok = bool(status.get("success"))
+        entry["polls"] += 1
+        if ok:
+            entry["consecutive_failures"] = 0
+        else:
+            entry["failures"] += 1
+            entry["consecutive_failures"] += 1
+        entry.update({
+            "status": status,
+            "updated_at": self._time(),
+            "polled_at": datetime.now().isoformat(),
+            "duration": round(duration, 3)
+        })
+        self.version += 1
+
+    def forget(self, names: set):
+        for name in [n for n in self.entries if n not in names]:
+            del self.entries[name]
+            self.version += 1
+
+    def snapshot(self, instances: list, options: dict) -> dict:
+        """按配置顺序返回各实例状态；version 在数据或过期状态变化时改变"""
+        now = self._time()
+        items = []
+        stale_flags = []
+        for instance in instances:
+            name = instance["name"]
+            if not instance.get("enabled", True):
+                items.append({
+                    "success": False,
+                    "instance_name": name,
+                    "status": "disabled",
+                    "error": "实例已禁用",
+                    "last_update": datetime.now().isoformat()
+                })
+                continue
+            entry = self.entries.get(name)
+            if entry is None:
+                items.append({"success": False, "instance_name": name, "status": "pending",
+                              "error": "等待首次采集", "stale": True, "age_seconds": None})
+                stale_flags.append("p")
+                continue
+            interval = instance.get("poll_interval", options["interval"])
+            age = now - entry["updated_at"]
+            stale = age > interval * options["stale_after"]
+            stale_flags.append("s" if stale else "f")
+            items.append({
+                **entry["status"],
+                "polled_at": entry["polled_at"],
+                "age_seconds": round(age, 1),
+                "stale": stale,
+                "poll_duration": entry["duration"],
+                "consecutive_failures": entry["consecutive_failures"]
+            })
+        return {"instances": items, "version": f"{self.version}-{''.join(stale_flags)}"}
+
+
+class TelemetryPoller:
+    """按实例并发轮询 qBittorrent 状态
+
+    fetch: 协程函数 fetch(instance) -> 状态字典（含 success）；
+    listener: 可选回调 listener(instance, status)，每次采集完成后调用
+    """
+
+    def __init__(self, config_manager, fetch, store: StatusStore = None, listener=None):
+        self.config_manager = config_manager
+        self.fetch = fetch
+        self.store = store or StatusStore()
+        self.listener = listener
+        self.options = dict(DEFAULT_TELEMETRY)
+        self._instances = {}
+        self._tasks = {}
+        self._supervisor = None
+
+    @property
+    def running(self) -> bool:
+        return self._supervisor is not None and not self._supervisor.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._supervisor = asyncio.create_task(self._supervise())
+        logger.info("📡 qBittorrent 遥测轮询已启动")
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        if self._supervisor is not None:
+            tasks.append(self._supervisor)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = {}
+        self._supervisor = None
+
+    async def _supervise(self):
+        """定期重新加载配置，为新增实例启动轮询任务，停止已删除或禁用的实例"""
+        while True:
+            try:
+                config = await self.config_manager.load_config_async()
+                self.options = get_telemetry_settings(config.get("controller_settings", {}))
+                enabled = {i["name"]: i for i in config.get("qbittorrent_instances", []) if i.get("enabled", True)}
+                self._instances = enabled
+                for name in [n for n in self._tasks if n not in enabled]:
+                    self._tasks.pop(name).cancel()
+                for name in enabled:
+                    task = self._tasks.get(name)
+                    if task is None or task.done():
+                        self._tasks[name] = asyncio.create_task(self._poll_instance(name))
+                self.store.forget(set(enabled))
+            except Exception as e:
+                logger.error(f"❌ 遥测配置加载失败: {e}")
+            await asyncio.sleep(RECONCILE_INTERVAL)
+
+    async def _poll_instance(self, name: str):
+        while name in self._instances:
+            instance = self._instances[name]
+            interval = instance.get("poll_interval", self.options["interval"])
+            started = time.monotonic()
+            try:
+                status = await asyncio.wait_for(self.fetch(instance), timeout=self.options["timeout"])
+            except asyncio.TimeoutError:
+                status = self._failure(instance, "timeout", f"采集超时 ({self.options['timeout']}秒)")
+            except Exception as e:
+                status = self._failure(instance, "offline", str(e))
+            self.store.update(name, status, time.monotonic() - started)
+            if self.listener is not None:
+                try:
+                    self.listener(instance, status)
+                except Exception as e:
+                    logger.error(f"❌ 遥测回调失败: {e}")
+            failures = self.store.entries[name]["consecutive_failures"]
+            delay = interval if not failures else min(interval * 2 ** failures, self.options["max_backoff"])
+            await asyncio.sleep(max(0.0, delay - (time.monotonic() - started)))
+
+    @staticmethod
+    def _failure(instance: dict, status: str, error: str) -> dict:
+        return {
+            "success": False,
+            "instance_name": instance["name"],
+            "status": status,
+            "error": error,
+            "download_speed": 0,
+            "upload_speed": 0,
+            "connection_status": "disconnected",
+            "last_update": datetime.now().isoformat()
+        }
+
+    def get_state(self) -> dict:
+        return {
+            "running": self.running,
+            "options": self.options,
+            "instances": {
+                name: {k: v for k, v in entry.items() if k not in ("status", "updated_at")}
+                for name, entry in self.store.entries.items()
+            }
+        }
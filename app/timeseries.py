@@ -0,0 +1,458 @@
+"""
+连接数时间序列存储
+每个控制周期的设备/服务样本追加到内存缓冲区，按时间窗口写入列式段文件：
+- 每个序列的时间戳（二阶差分）和值（一阶差分）分别存储为 zigzag + varint 编码的列
+- 每个序列的数据块单独用 zlib 压缩（稳定不变的连接数压缩后几乎不占空间）
+- 读取时通过 mmap 只解压和解码请求的序列
+- 写段时同时生成分钟级汇总（min/max/avg/count），长时间范围查询使用汇总数据
+- 原始数据和汇总数据分别按保留时长清理
+"""
+
+import asyncio
+import json
+import logging
+import mmap
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from io_pool import io_pool
+
+logger = logging.getLogger("qbit-controller")
+
+MAGIC = b"SHTS1\n"
+VALUE_SCALE = 1000  # 值以千分之一为单位存储为整数
+RAW_PREFIX = "raw"
+ROLLUP_PREFIX = "r"
+
+
+def _encode_deltas(values: list) -> bytes:
+    """整数序列 -> 差分 + zigzag + varint"""
+    out = bytearray()
+    previous = 0
+    for value in values:
+        delta = value - previous
+        previous = value
+        zigzag = (delta << 1) ^ (delta >> 63)
+        while zigzag > 0x7F:
+            out.append((zigzag & 0x7F) | 0x80)
+            zigzag >>= 7
+        out.append(zigzag)
+    return bytes(out)
+
+
+def _encode_timestamps(timestamps: list) -> bytes:
+    """时间戳二阶差分编码：固定间隔采样时每个样本只占1字节"""
+    deltas = []
+    previous = 0
+    for ts in timestamps:
+        deltas.append(ts - previous)
+        previous = ts
+    return _encode_deltas(deltas)
+
+
+def _decode_timestamps(buffer, start: int, count: int) -> tuple:
+    deltas, position = _decode_deltas(buffer, start, count)
+    timestamps = []
+    current = 0
+    for delta in deltas:
+        current += delta
+        timestamps.append(current)
+    return timestamps, position
+
+
+def _decode_deltas(buffer, start: int, count: int) -> tuple:
+    """解码 count 个差分整数，返回 (值列表, 结束偏移)"""
+    values = []
+    previous = 0
+    position = start
+    for _ in range(count):
+        shift = 0
+        zigzag = 0
+        while True:
+            byte = buffer[position]
+            position += 1
+            zigzag |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        previous += (zigzag >> 1) ^ -(zigzag & 1)
+        values.append(previous)
+    return values, position
+
+
+class TimeSeriesStore:
+    """列式差分编码的时间序列存储"""
+
+    def __init__(self, directory, segment_seconds: int = 600, rollup_interval: int = 60,
+                 raw_retention_hours: float = 48, rollup_retention_days: float = 30):
+        self.directory = Path(directory)
+        self.segment_seconds = segment_seconds
+        self.rollup_interval = rollup_interval
+        self.raw_retention = raw_retention_hours * 3600
+        self.rollup_retention = rollup_retention_days * 86400
+        self._buffer = {}          # {序列名: ([时间戳ms], [值])}
+        self._segment_start = None
+        self._flushing = {}        # 正在写盘的缓冲区，写完前仍可查询
+        self._lock = threading.Lock()
+        self._header_cache = {}    # {路径: (mtime, 头部)}
+        self._flush_task = None
+        self.version = 0           # 每次追加样本递增，用于缓存校验
+        self.stats = {"samples": 0, "segments_written": 0, "bytes_written": 0, "last_flush_ms": 0.0}
+
+    # ---------- 写入 ----------
+
+    def append(self, timestamp: float, samples: dict):
+        """追加一个时刻的多个序列样本（在事件循环中调用，只做内存操作）"""
+        ts_ms = int(timestamp * 1000)
+        if self._segment_start is None:
+            self._segment_start = ts_ms
+        for name, value in samples.items():
+            if value is None:
+                continue
+            column = self._buffer.get(name)
+            if column is None:
+                column = ([], [])
+                self._buffer[name] = column
+            column[0].append(ts_ms)
+            column[1].append(int(round(float(value) * VALUE_SCALE)))
+        self.version += 1
+        self.stats["samples"] += len(samples)
+
+        # 时间窗口到期，后台写段
+        if ts_ms - self._segment_start >= self.segment_seconds * 1000:
+            self._schedule_flush()
+
+    def _swap_buffer(self):
+        buffer, start = self._buffer, self._segment_start
+        self._buffer, self._segment_start = {}, None
+        return buffer, start
+
+    def _schedule_flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        buffer, start = self._swap_buffer()
+        self._flushing = buffer
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_async(buffer, start))
+        except RuntimeError:
+            # 没有运行中的事件循环（例如脚本中直接调用），同步写入
+            try:
+                self._write_segments(buffer, start)
+            finally:
+                self._flushing = {}
+
+    async def _flush_async(self, buffer: dict, start: int):
+        try:
+            await io_pool.run("timeseries.flush", self._write_segments, buffer, start)
+        except Exception as e:
+            logger.error(f"❌ 时间序列写入失败: {e}")
+        finally:
+            self._flushing = {}
+
+    async def flush(self):
+        """立即写入当前缓冲区（关闭时调用）"""
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        if self._buffer:
+            buffer, start = self._swap_buffer()
+            await io_pool.run("timeseries.flush", self._write_segments, buffer, start)
+
+    def _write_segments(self, buffer: dict, start: int):
+        """写入原始段和汇总段，并清理过期文件（阻塞操作）"""
+        if not buffer:
+            return
+        started = time.perf_counter()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        end = max(column[0][-1] for column in buffer.values())
+
+        raw_columns = {name: [ts, values] for name, (ts, values) in buffer.items()}
+        written = self._write_file(self.directory / f"{RAW_PREFIX}-{start}.seg", start, end, "raw", raw_columns)
+
+        rollup_columns = {name: self._rollup(ts, values) for name, (ts, values) in buffer.items()}
+        written += self._write_file(self.directory / f"{ROLLUP_PREFIX}{self.rollup_interval}-{start}.seg",
+                                    start, end, f"rollup{self.rollup_interval}", rollup_columns)
+        self._cleanup()
+
+        with self._lock:
+            self.stats["segments_written"] += 1
+            self.stats["bytes_written"] += written
+            self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 3)
+
+    def _rollup(self, timestamps: list, values: list) -> list:
+        """按汇总间隔计算 min/max/avg/count，返回列列表"""
+        interval_ms = self.rollup_interval * 1000
+        columns = [[], [], [], [], []]  # 时间戳, min, max, avg, count
+        bucket = None
+        bucket_values = []
+        for ts, value in zip(timestamps, values):
+            current = ts - ts % interval_ms
+            if bucket is not None and current != bucket:
+                self._emit_bucket(columns, bucket, bucket_values)
+                bucket_values = []
+            bucket = current
+            bucket_values.append(value)
+        if bucket is not None:
+            self._emit_bucket(columns, bucket, bucket_values)
+        return columns
+
+    @staticmethod
+    def _emit_bucket(columns: list, bucket: int, values: list):
+        columns[0].append(bucket)
+        columns[1].append(min(values))
+        columns[2].append(max(values))
+        columns[3].append(sum(values) // len(values))
+        columns[4].append(len(values))
+
+    def _write_file(self, path: Path, start: int, end: int, kind: str, series_columns: dict) -> int:
+        body = bytearray()
+        index = {}
+        for name, columns in series_columns.items():
+            block = bytearray(_encode_timestamps(columns[0]))
+            for column in columns[1:]:
+                block += _encode_deltas(column)
+            compressed = zlib.compress(bytes(block), 1)
+            index[name] = [len(body), len(compressed), len(columns[0])]
+            body += compressed
+        header = json.dumps({
+            "start": start,
+            "end": end,
+            "kind": kind,
+            "columns": len(next(iter(series_columns.values()))),
+            "series": index
+        }, ensure_ascii=False).encode("utf-8")
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            f.write(body)
+        tmp_path.replace(path)
+        return len(MAGIC) + 4 + len(header) + len(body)
+
+    def _cleanup(self):
+        """删除超过保留时长的段文件"""
+        now_ms = time.time() * 1000
+        for path in self.directory.glob("*.seg"):
+            try:
+                prefix, start = path.stem.rsplit("-", 1)
+                retention = self.raw_retention if prefix == RAW_PREFIX else self.rollup_retention
+                if now_ms - int(start) > retention * 1000 + self.segment_seconds * 1000:
+                    path.unlink()
+                    self._header_cache.pop(str(path), None)
+            except (ValueError, OSError):
+                continue
+
+    # ---------- 查询 ----------
+
+    def _segment_files(self, prefix: str, start_ms: int, end_ms: int) -> list:
+        files = []
+        if not self.directory.exists():
+            return files
+        for path in self.directory.glob(f"{prefix}-*.seg"):
+            try:
+                seg_start = int(path.stem.rsplit("-", 1)[1])
+            except ValueError:
+                continue
+            # 段长度最多为 segment_seconds 的两倍（异步写入可能延迟）
+            if seg_start <= end_ms and seg_start + 2 * self.segment_seconds * 1000 >= start_ms:
+                files.append((seg_start, path))
+        return [path for _, path in sorted(files)]
+
+    def _read_series(self, path: Path, name: str, start_ms: int, end_ms: int) -> list:
+        """通过 mmap 读取单个段中的单个序列，返回列（时间戳在首列）"""
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                header_len = struct.unpack_from("<I", mm, len(MAGIC))[0]
+                body_start = len(MAGIC) + 4 + header_len
+                cache_key = str(path)
+                mtime = path.stat().st_mtime
+                cached = self._header_cache.get(cache_key)
+                if cached is not None and cached[0] == mtime:
+                    header = cached[1]
+                else:
+                    header = json.loads(mm[len(MAGIC) + 4:body_start].decode("utf-8"))
+                    self._header_cache[cache_key] = (mtime, header)
+                if header["end"] < start_ms or header["start"] > end_ms:
+                    return []
+                entry = header["series"].get(name)
+                if entry is None:
+                    return []
+                offset, length, count = entry
+                block = zlib.decompress(mm[body_start + offset:body_start + offset + length])
+        timestamps, position = _decode_timestamps(block, 0, count)
+        columns = [timestamps]
+        for _ in range(header["columns"] - 1):
+            column, position = _decode_deltas(block, position, count)
+            columns.append(column)
+        return columns
+
+    def _pending_columns(self, name: str) -> list:
+        """尚未写盘的样本（正在写盘 + 内存缓冲区）"""
+        ts_list, values = [], []
+        for buffer in (self._flushing, self._buffer):
+            column = buffer.get(name)
+            if column:
+                count = min(len(column[0]), len(column[1]))
+                ts_list.extend(column[0][:count])
+                values.extend(column[1][:count])
+        return [ts_list, values]
+
+    def query(self, name: str, start: float, end: float, resolution: str = "raw") -> list:
+        """查询序列，resolution='raw' 返回 [(时间戳, 值)]，
+        resolution='rollup' 返回 [(时间戳, min, max, avg, count)]（阻塞操作）"""
+        start_ms, end_ms = int(start * 1000), int(end * 1000)
+        rows = []
+        if resolution == "rollup":
+            prefix = f"{ROLLUP_PREFIX}{self.rollup_interval}"
+            for path in self._segment_files(prefix, start_ms, end_ms):
+                columns = self._read_series(path, name, start_ms, end_ms)
+                if columns:
+                    rows.extend(
+                        (ts / 1000, mn / VALUE_SCALE, mx / VALUE_SCALE, avg / VALUE_SCALE, count)
+                        for ts, mn, mx, avg, count in zip(*columns) if start_ms <= ts <= end_ms
+                    )
+            ts_list, values = self._pending_columns(name)
+            if ts_list:
+                rows.extend(
+                    (ts / 1000, mn / VALUE_SCALE, mx / VALUE_SCALE, avg / VALUE_SCALE, count)
+                    for ts, mn, mx, avg, count in zip(*self._rollup(ts_list, values)) if start_ms <= ts <= end_ms
+                )
+            return rows
+
+        for path in self._segment_files(RAW_PREFIX, start_ms, end_ms):
+            columns = self._read_series(path, name, start_ms, end_ms)
+            if columns:
+                rows.extend((ts / 1000, value / VALUE_SCALE)
+                            for ts, value in zip(columns[0], columns[1]) if start_ms <= ts <= end_ms)
+        ts_list, values = self._pending_columns(name)
+        rows.extend((ts / 1000, value / VALUE_SCALE)
+                    for ts, value in zip(ts_list, values) if start_ms <= ts <= end_ms)
+        return rows
+
+    async def query_async(self, name: str, start: float, end: float, resolution: str = "raw") -> list:
+        """在I/O线程池中查询"""
+        return await io_pool.run("timeseries.query", self.query, name, start, end, resolution)
+
+    def series_names(self, prefix: str = "") -> list:
+        """列出已知的序列名称（最近段 + 内存缓冲区）"""
+        names = set(name for name in self._buffer if name.startswith(prefix))
+        files = sorted(self.directory.glob(f"{RAW_PREFIX}-*.seg")) if self.directory.exists() else []
+        for path in files[-6:]:
+            try:
+                with open(path, "rb") as f:
+                    f.seek(len(MAGIC))
+                    header_len = struct.unpack("<I", f.read(4))[0]
+                    header = json.loads(f.read(header_len).decode("utf-8"))
+                names.update(name for name in header["series"] if name.startswith(prefix))
+            except (OSError, ValueError, KeyError):
+                continue
+        return sorted(names)
+
+    def replay(self, name: str, start: float, end: float) -> list:
+        """回放源：返回 [(时间戳, 值)]，可直接用于仿真和测试"""
+        return self.query(name, start, end, "raw")
+
+    def get_stats(self) -> dict:
+        disk_bytes = 0
+        segment_count = 0
+        if self.directory.exists():
+            for path in self.directory.glob("*.seg"):
+                try:
+                    disk_bytes += path.stat().st_size
+                    segment_count += 1
+                except OSError:
+                    continue
+        with self._lock:
+            stats = dict(self.stats)
+        stats.update({
+            "buffered_series": len(self._buffer),
+            "buffered_samples": sum(len(column[0]) for column in self._buffer.values()),
+            "segment_files": segment_count,
+            "disk_bytes": disk_bytes,
+            "version": self.version
+        })
+        return stats
+
+
+def downsample_buckets(rows: list, start: float, end: float, points: int) -> list:
+    """按时间桶降采样，返回 [(桶时间, avg, min, max)]
+    rows 可以是原始行 (时间, 值) 或汇总行 (时间, min, max, avg, count)"""
+    if not rows:
+        return []
+    points = max(1, points)
+    width = max((end - start) / points, 1e-9)
+    buckets = {}
+    for row in rows:
+        index = int((row[0] - start) / width)
+        if len(row) == 2:
+            low = high = row[1]
+            total, count = row[1], 1
+        else:
+            low, high = row[1], row[2]
+            total, count = row[3] * row[4], row[4]
+        bucket = buckets.get(index)
+        if bucket is None:
+            buckets[index] = [low, high, total, count]
+        else:
+            if low < bucket[0]:
+                bucket[0] = low
+            if high > bucket[1]:
+                bucket[1] = high
+            bucket[2] += total
+            bucket[3] += count
+    return [
+        (round(start + index * width, 3), round(b[2] / b[3], 3), b[0], b[1])
+        for index, b in sorted(buckets.items())
+    ]
+
+
+def lttb(rows: list, threshold: int) -> list:
+    """Largest-Triangle-Three-Buckets 降采样，保留视觉形状，返回 [(时间, 值)]"""
+    if threshold >= len(rows) or threshold < 3:
+        return [(row[0], row[1]) for row in rows]
+    sampled = [(rows[0][0], rows[0][1])]
+    bucket_size = (len(rows) - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # 下一个桶的平均点
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, len(rows))
+        next_rows = rows[next_start:next_end] or rows[-1:]
+        avg_x = sum(r[0] for r in next_rows) / len(next_rows)
+        avg_y = sum(r[1] for r in next_rows) / len(next_rows)
+        # 当前桶中与前一选中点、下一桶平均点构成最大三角形的点
+        range_start = int(i * bucket_size) + 1
+        range_end = int((i + 1) * bucket_size) + 1
+        ax, ay = rows[a][0], rows[a][1]
+        max_area = -1.0
+        chosen = range_start
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (rows[j][1] - ay) - (ax - rows[j][0]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                chosen = j
+        sampled.append((rows[chosen][0], rows[chosen][1]))
+        a = chosen
+    sampled.append((rows[-1][0], rows[-1][1]))
+    return sampled
+
+
+def active_periods(rows: list) -> list:
+    """从 0/1 序列（原始行或汇总行取 max）提取取值为真的时间段 [(开始, 结束)]"""
+    periods = []
+    start = None
+    last_ts = None
+    for row in rows:
+        value = row[1] if len(row) == 2 else row[2]
+        if value > 0 and start is None:
+            start = row[0]
+        elif value <= 0 and start is not None:
+            periods.append((start, row[0]))
+            start = None
+        last_ts = row[0]
+    if start is not None:
+        periods.append((start, last_ts))
+    return periods
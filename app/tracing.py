@@ -0,0 +1,268 @@
+"""
+控制周期追踪
+每个控制周期（以及启动预热）是一条 trace，配置加载、Lucky 采集与解析、服务发现、状态机、qBittorrent 登录和推送等
+子操作是其中的 span（带设备、实例、尝试次数、字节数等属性）；
+父 span 通过 contextvars 传递，asyncio.gather / create_task 创建的子任务自动挂到当前 span 下。
+完成的 trace 保存在有界内存环形缓冲中，可导出为 JSON 或 OTLP 文件（每行一个 ExportTraceServiceRequest，
+与 OpenTelemetry Collector file exporter 格式相同），无需外部服务
+"""
+
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_TRACING = {
+    "enabled": True,
+    "capacity": 200,      # 保留最近的 trace 条数
+    "max_spans": 512      # 单条 trace 最多记录的 span 数，超出的只计数
+}
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+def get_tracing_settings(settings: dict) -> dict:
+    """合并默认值后的追踪配置"""
+    merged = dict(DEFAULT_TRACING)
+    merged.update(settings.get("tracing") or {})
+    return merged
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "_t0", "duration", "attributes", "error")
+
+    def __init__(self, trace, name: str, parent_id: str = None, attributes: dict = None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self._t0 = time.perf_counter()
+        self.duration = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error):
+        self.error = str(error)
+
+    def to_dict(self) -> dict:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "offset_ms": round((self.start_ns - self.trace.root.start_ns) / 1e6, 3),
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "attributes": self.attributes,
+            "status": "error" if self.error else "ok",
+            "error": self.error
+        }
+
+
+class _Trace:
+    __slots__ = ("trace_id", "root", "spans", "dropped")
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.root = None
+        self.spans = []
+        self.dropped = 0
+
+
+class _NoopSpan:
+    """不在 trace 中（或追踪关闭）时使用，所有操作为空"""
+
+    def set(self, **attributes):
+        pass
+
+    def fail(self, error):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Tracer:
+    def __init__(self, options: dict = None):
+        self.options = dict(DEFAULT_TRACING)
+        self._lock = threading.Lock()
+        self.traces = deque(maxlen=self.options["capacity"])
+        self.stats = {"traces": 0, "spans": 0, "dropped_spans": 0}
+        self.configure(options)
+
+    def configure(self, options: dict = None):
+        """应用 controller_settings.tracing（容量变化时保留最近的 trace）"""
+        if not options:
+            return
+        self.options.update(options)
+        capacity = max(1, int(self.options["capacity"]))
+        if capacity != self.traces.maxlen:
+            with self._lock:
+                self.traces = deque(self.traces, maxlen=capacity)
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """开始一条新的 trace（根 span）；结束后放入环形缓冲"""
+        if not self.options["enabled"]:
+            yield _NOOP
+            return
+        trace = _Trace()
+        span = trace.root = Span(trace, name, attributes=attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            _current.reset(token)
+            self._finish(span)
+            with self._lock:
+                self.traces.append(trace)
+                self.stats["traces"] += 1
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """当前 trace 中的子 span；不在 trace 中时不记录"""
+        parent = _current.get()
+        if parent is None:
+            yield _NOOP
+            return
+        span = Span(parent.trace, name, parent.span_id, attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            _current.reset(token)
+            self._finish(span)
+
+    def _finish(self, span: Span):
+        span.duration = time.perf_counter() - span._t0
+        trace = span.trace
+        with self._lock:
+            if span is trace.root or len(trace.spans) < self.options["max_spans"]:
+                trace.spans.append(span)
+                self.stats["spans"] += 1
+            else:
+                trace.dropped += 1
+                self.stats["dropped_spans"] += 1
+
+    def traced(self, name: str):
+        """协程函数装饰器：调用包在一个子 span 中，函数内用 annotate() 补充属性"""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def annotate(**attributes):
+        """给当前 span 添加属性；error 属性同时把 span 标记为失败"""
+        span = _current.get()
+        if span is None:
+            return
+        error = attributes.pop("error", None)
+        if error:
+            span.fail(error)
+        span.attributes.update(attributes)
+
+    def _recent(self) -> list:
+        with self._lock:
+            return list(self.traces)
+
+    @staticmethod
+    def _summary(trace: _Trace) -> dict:
+        root = trace.root
+        children = [s for s in trace.spans if s.parent_id == root.span_id]
+        slowest = max(children, key=lambda s: s.duration, default=None)
+        return {
+            "trace_id": trace.trace_id,
+            "name": root.name,
+            "start_ns": root.start_ns,
+            "duration_ms": round(root.duration * 1000, 3),
+            "spans": len(trace.spans),
+            "dropped_spans": trace.dropped,
+            "errors": sum(1 for s in trace.spans if s.error),
+            "status": "error" if root.error else "ok",
+            "attributes": root.attributes,
+            "slowest_child": {"name": slowest.name, "duration_ms": round(slowest.duration * 1000, 3)} if slowest else None
+        }
+
+    @staticmethod
+    def _full(trace: _Trace) -> dict:
+        return {
+            "trace_id": trace.trace_id,
+            "dropped_spans": trace.dropped,
+            "spans": [s.to_dict() for s in sorted(trace.spans, key=lambda s: s.start_ns)]
+        }
+
+    def query(self, limit: int = 50, min_duration_ms: float = 0, name: str = None,
+              trace_id: str = None, full: bool = False) -> list:
+        """最近的 trace（新的在前）：默认返回摘要，full=True 返回全部 span"""
+        result = []
+        for trace in reversed(self._recent()):
+            if trace_id and trace.trace_id != trace_id:
+                continue
+            if name and trace.root.name != name:
+                continue
+            if trace.root.duration * 1000 < min_duration_ms:
+                continue
+            result.append(self._full(trace) if full else self._summary(trace))
+            if len(result) >= limit:
+                break
+        return result
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "buffered": len(self.traces), **self.options}
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(traces: list, service_name: str = "speedhivehome") -> dict:
+    """把 query(full=True) 的结果转换为 OTLP/JSON ExportTraceServiceRequest"""
+    spans = []
+    for trace in traces:
+        for span in trace["spans"]:
+            item = {
+                "traceId": trace["trace_id"],
+                "spanId": span["span_id"],
+                "name": span["name"],
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(span["start_ns"]),
+                "endTimeUnixNano": str(span["start_ns"] + int((span["duration_ms"] or 0) * 1e6)),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span["attributes"].items()],
+                # STATUS_CODE_OK=1, STATUS_CODE_ERROR=2
+                "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1}
+            }
+            if span["parent_id"]:
+                item["parentSpanId"] = span["parent_id"]
+            spans.append(item)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "qbit-controller"}, "spans": spans}]
+        }]
+    }
+
+
+tracer = Tracer()
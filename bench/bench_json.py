@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+JSON 编解码基准
+用模拟服务器相同的负载（Lucky 规则列表、qBittorrent 种子列表）对比：
+- 上游解析：标准库 json.loads 与 app/codec.loads
+- API 响应：FastAPI 默认路径（jsonable_encoder + json.dumps）与 app/codec.dumps
+
+用法:
+    python bench/bench_json.py --rules 200 --torrents 5000
+"""
+
+import json
+import sys
+import timeit
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+import codec  # noqa: E402
+from fake_servers import FakeState, build_arg_parser  # noqa: E402
+
+
+def stdlib_response(content) -> bytes:
+    """FastAPI JSONResponse 的默认序列化路径"""
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def lucky_status_response(data: dict, devices: int) -> dict:
+    """/api/lucky/status 形状的响应：包含 raw_data 和每个服务的连接明细"""
+    now = datetime.now().isoformat()
+    detail = [
+        {
+            "rule_name": rule["RuleName"],
+            "key": proxy["Key"],
+            "remark": proxy["Remark"],
+            "connections": proxy["Connections"],
+            "enabled": proxy["Enable"],
+            "locations": proxy["Locations"],
+            "domains": proxy["Domains"],
+        }
+        for rule in data["ruleList"] for proxy in rule["ProxyList"]
+    ]
+    return {"devices": [
+        {"success": True, "device_name": f"bench-lucky-{i}", "connections": 0, "weighted_connections": 0.0,
+         "status": "online", "last_update": now, "raw_data": data, "detailed_connections": detail}
+        for i in range(devices)
+    ]}
+
+
+def measure(func, arg, repeat: int) -> float:
+    """最快一次的耗时（毫秒）"""
+    number = max(1, repeat)
+    return min(timeit.repeat(lambda: func(arg), number=1, repeat=number)) * 1000
+
+
+def main():
+    parser = build_arg_parser()
+    parser.description = "JSON 编解码基准"
+    parser.set_defaults(rules=200, torrents=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    state = FakeState(args)
+    lucky_bytes = state.lucky_payload(0)
+    torrent_bytes = state.torrent_payload(0)
+    lucky_data = json.loads(lucky_bytes)
+    torrents = json.loads(torrent_bytes)
+    lucky_response = lucky_status_response(lucky_data, args.devices)
+    torrents_response = {"instance": "bench-qb-0", "torrents": torrents}
+
+    cases = [
+        ("decode lucky rules", len(lucky_bytes), json.loads, codec.loads, lucky_bytes.decode()),
+        ("decode torrents/info", len(torrent_bytes), json.loads, codec.loads, torrent_bytes.decode()),
+        ("encode /api/lucky/status", len(stdlib_response(lucky_response)), stdlib_response, codec.dumps, lucky_response),
+        ("encode torrent list", len(stdlib_response(torrents_response)), stdlib_response, codec.dumps, torrents_response),
+    ]
+
+    print(f"codec 后端: {codec.BACKEND}, 规则: {args.rules} x {args.services_per_rule}, 种子: {args.torrents}")
+    print(f"{'场景':<26}{'大小':>10}{'stdlib ms':>12}{'codec ms':>12}{'加速':>8}")
+    for name, size, baseline, fast, arg in cases:
+        before = measure(baseline, arg, args.repeat)
+        after = measure(fast, arg, args.repeat)
+        print(f"{name:<26}{size / 1024:>8.0f}KB{before:>12.2f}{after:>12.2f}{before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+基准测试用的本地模拟服务器
+同时模拟 Lucky webservice/rules API 和 qBittorrent WebUI API，
+支持设备/实例数量、规则/种子数量、延迟和故障注入配置
+
+单独运行:
+    python bench/fake_servers.py --lucky-port 18601 --qbit-port 18080 --devices 2 --instances 2
+
+Lucky 设备 i:   http://127.0.0.1:<lucky-port>/lucky{i}/api/webservice/rules?openToken=bench
+qB 实例 i:      http://127.0.0.1:<qbit-port>/qb{i}
+控制接口:       /_bench/state (GET/POST), /_bench/reset (POST)
+                两个服务器共享同一份状态，请求计数包含两侧的请求，通过任一端口读写即可
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+
+from aiohttp import web
+
+STREAM_SERVICE_KEY = "bench-stream"
+
+
+class FakeState:
+    """模拟服务器共享状态（连接数、延迟、故障率和请求统计）"""
+
+    def __init__(self, args):
+        self.devices = args.devices
+        self.instances = args.instances
+        self.rules = args.rules
+        self.services_per_rule = args.services_per_rule
+        self.torrents = args.torrents
+        self.latency_ms = args.latency_ms
+        self.failure_rate = args.failure_rate
+        self.connections = 0
+        self.stream_services = 1
+        self.request_counts = {}
+        self.limit_events = []
+        self.instance_limits = {}
+        self.alt_limits = {}
+        self.speed_limits_mode = 0
+        self.torrent_limits = {}
+        self.webapi_version = args.webapi_version
+        self._lucky_payload_cache = {}
+        self._torrent_payload_cache = {}
+
+    def count(self, key: str):
+        self.request_counts[key] = self.request_counts.get(key, 0) + 1
+
+    def snapshot(self) -> dict:
+        return {
+            "devices": self.devices,
+            "instances": self.instances,
+            "rules": self.rules,
+            "services_per_rule": self.services_per_rule,
+            "torrents": self.torrents,
+            "latency_ms": self.latency_ms,
+            "failure_rate": self.failure_rate,
+            "connections": self.connections,
+            "stream_services": self.stream_services,
+            "webapi_version": self.webapi_version,
+            "request_counts": dict(self.request_counts),
+            "limit_events": list(self.limit_events),
+            "instance_limits": dict(self.instance_limits),
+            "alt_limits": dict(self.alt_limits),
+            "speed_limits_mode": self.speed_limits_mode
+        }
+
+    def reset_counters(self):
+        self.request_counts = {}
+        self.limit_events = []
+
+    def lucky_payload(self, device_index: int) -> bytes:
+        """生成 Lucky 规则列表（按连接数缓存，模拟未变化时字节一致的响应）"""
+        cache_key = (device_index, self.connections, self.stream_services, self.rules, self.services_per_rule)
+        cached = self._lucky_payload_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        rule_list = []
+        statistics = {}
+        for r in range(self.rules):
+            rule_key = f"rule{device_index}-{r}"
+            proxy_list = []
+            proxy_stats = {}
+            for s in range(self.services_per_rule):
+                if r == 0 and s < self.stream_services:
+                    key = STREAM_SERVICE_KEY if s == 0 else f"{STREAM_SERVICE_KEY}-{s}"
+                    connections = self.connections
+                else:
+                    key = f"svc{device_index}-{r}-{s}"
+                    connections = 0
+                proxy_list.append({
+                    "Key": key,
+                    "Remark": key,
+                    "Connections": connections,
+                    "WebServiceType": "reverseproxy",
+                    "Enable": True,
+                    "Locations": [f"http://10.0.{r % 250}.{s % 250}:8096"],
+                    "Domains": [f"{key}.bench.local"],
+                    "LastErrMsg": "",
+                    "CacheEnabled": False,
+                    "DisplayInFrontendList": True
+                })
+                proxy_stats[key] = {"Connections": connections}
+            rule_list.append({
+                "RuleKey": rule_key,
+                "RuleName": rule_key,
+                "ProxyList": proxy_list
+            })
+            statistics[rule_key] = {
+                "Connections": sum(p["Connections"] for p in proxy_list),
+                "ProxyList": proxy_stats
+            }
+
+        payload = json.dumps({"ret": 0, "ruleList": rule_list, "statistics": statistics}).encode()
+        self._lucky_payload_cache = {cache_key: payload}
+        return payload
+
+    def torrent_payload(self, instance_index: int) -> bytes:
+        """生成种子列表"""
+        cached = self._torrent_payload_cache.get(instance_index)
+        if cached is not None and cached[0] == self.torrents:
+            return cached[1]
+
+        categories = ["movies", "tv", "music", "linux-iso", "private"]
+        states = ["uploading", "downloading", "stalledUP", "pausedUP", "queuedDL"]
+        rng = random.Random(instance_index)
+        torrents = []
+        for t in range(self.torrents):
+            torrent_hash = hashlib.sha1(f"{instance_index}-{t}".encode()).hexdigest()
+            torrents.append({
+                "hash": torrent_hash,
+                "name": f"bench.torrent.{instance_index}.{t}",
+                "state": states[t % len(states)],
+                "category": categories[t % len(categories)],
+                "tags": "heavy" if t % 7 == 0 else "",
+                "tracker": f"https://tracker{t % 4}.bench.local/announce",
+                "ratio": round(rng.random() * 5, 3),
+                "size": rng.randint(10 ** 8, 10 ** 10),
+                "dlspeed": rng.randint(0, 10 ** 6),
+                "upspeed": rng.randint(0, 10 ** 6),
+                "dl_limit": -1,
+                "up_limit": -1
+            })
+        payload = json.dumps(torrents).encode()
+        self._torrent_payload_cache[instance_index] = (self.torrents, payload)
+        return payload
+
+
+async def _inject(state: FakeState, request: web.Request):
+    """延迟和故障注入，返回非 None 时直接作为响应"""
+    if state.latency_ms > 0:
+        await asyncio.sleep(state.latency_ms / 1000.0)
+    if state.failure_rate > 0 and random.random() < state.failure_rate:
+        if random.random() < 0.5:
+            # 模拟连接重置
+            if request.transport is not None:
+                request.transport.close()
+            raise web.HTTPInternalServerError()
+        return web.Response(status=500, text="injected failure")
+    return None
+
+
+def build_lucky_app(state: FakeState) -> web.Application:
+    async def rules(request: web.Request):
+        device_index = int(request.match_info["device"])
+        state.count(f"lucky{device_index}.rules")
+        failure = await _inject(state, request)
+        if failure is not None:
+            return failure
+        if device_index >= state.devices:
+            return web.Response(status=404)
+        return web.Response(body=state.lucky_payload(device_index), content_type="application/json")
+
+    app = web.Application()
+    app.router.add_get(r"/lucky{device:\d+}/api/webservice/rules", rules)
+    _add_control_routes(app, state)
+    return app
+
+
+def build_qbit_app(state: FakeState) -> web.Application:
+    def _instance(request: web.Request) -> int:
+        return int(request.match_info["instance"])
+
+    def _authorized(request: web.Request) -> bool:
+        return request.cookies.get("SID", "").startswith("bench-sid-")
+
+    async def login(request: web.Request):
+        index = _instance(request)
+        state.count(f"qb{index}.login")
+        failure = await _inject(state, request)
+        if failure is not None:
+            return failure
+        await request.post()
+        response = web.Response(text="Ok.")
+        response.set_cookie("SID", f"bench-sid-{index}-{time.time_ns()}")
+        return response
+
+    async def webapi_version(request: web.Request):
+        state.count(f"qb{_instance(request)}.webapiVersion")
+        if not _authorized(request):
+            return web.Response(status=403, text="Forbidden")
+        return web.Response(text=state.webapi_version)
+
+    async def transfer_info(request: web.Request):
+        index = _instance(request)
+        state.count(f"qb{index}.transfer_info")
+        failure = await _inject(state, request)
+        if failure is not None:
+            return failure
+        if not _authorized(request):
+            return web.Response(status=403, text="Forbidden")
+        limits = state.instance_limits.get(index, {"dl": 0, "up": 0})
+        return web.json_response({
+            "dl_info_speed": random.randint(0, 5 * 10 ** 6),
+            "up_info_speed": random.randint(0, 5 * 10 ** 6),
+            "dl_info_data": int(time.time() * 10 ** 6),
+            "up_info_data": int(time.time() * 5 * 10 ** 5),
+            "dl_rate_limit": limits["dl"],
+            "up_rate_limit": limits["up"],
+            "connection_status": "connected"
+        })
+
+    async def torrents_info(request: web.Request):
+        index = _instance(request)
+        state.count(f"qb{index}.torrents_info")
+        failure = await _inject(state, request)
+        if failure is not None:
+            return failure
+        if not _authorized(request):
+            return web.Response(status=403, text="Forbidden")
+        return web.Response(body=state.torrent_payload(index), content_type="application/json")
+
+    async def read_limit(request: web.Request):
+        index = _instance(request)
+        kind = request.match_info["kind"]
+        state.count(f"qb{index}.{kind}Limit")
+        if not _authorized(request):
+            return web.Response(status=403, text="Forbidden")
+        limits = state.instance_limits.get(index, {"dl": 0, "up": 0})
+        return web.Response(text=str(limits["dl" if kind == "download" else "up"]))
+
+    async def set_limit(request: web.Request):
+        index = _instance(request)
+        kind = request.match_info["kind"]
+        state.count(f"qb{index}.set{kind.capitalize()}Limit")
+        failure = await _inject(state, request)
+        if failure is not None:
+            return failure
+        if not _authorized(request):
+            return web.Response(status=403, text="Forbidden")
+        form = await request.post()
+        limits = state.instance_limits.setdefault(index, {"dl": 0, "up": 0})
+        limits["dl" if kind == "download" else "up"] = int(form.get("limit", 0))
+        state.limit_events.append({"instance": index, "time": time.time(), "limits": dict(limits)})
+        return web.Response(text="")
+
+    async def set_preferences(request: web.Request):
+        index = _instance(request)
+        state.count(f"qb{index}.setPreferences")
+        failure = await _inject(state, request)
+        if failure is not None:
+            return failure
+        if not _authorized(request):
+            return web.Response(status=403, text="Forbidden")
+        form = await request.post()
+        prefs = json.loads(form.get("json", "{}"))
+        limits = state.instance_limits.setdefault(index, {"dl": 0, "up": 0})
+        if "dl_limit" in prefs:
+            limits["dl"] = int(prefs["dl_limit"])
+        if "up_limit" in prefs:
+            limits["up"] = int(prefs["up_limit"])
+        alt = state.alt_limits.setdefault(index, {"dl": 0, "up": 0})
+        if "alt_dl_limit" in prefs:
+            alt["dl"] = int(prefs["alt_dl_limit"])
+        if "alt_up_limit" in prefs:
+            alt["up"] = int(prefs["alt_up_limit"])
+        state.limit_events.append({"instance": index, "time": time.time(), "limits": dict(limits)})
+        return web.Response(text="")
+
+    async def speed_limits_mode(request: web.Request):
+        state.count(f"qb{_instance(request)}.speedLimitsMode")
+        if not _authorized(request):
+            return web.Response(status=403, text="Forbidden")
+        return web.Response(text=str(state.speed_limits_mode))
+
+    async def set_torrent_limit(request: web.Request):
+        index = _instance(request)
+        kind = request.match_info["kind"]
+        state.count(f"qb{index}.torrents_set{kind.capitalize()}Limit")
+        failure = await _inject(state, request)
+        if failure is not None:
+            return failure
+        if not _authorized(request):
+            return web.Response(status=403, text="Forbidden")
+        form = await request.post()
+        hashes = [h for h in form.get("hashes", "").split("|") if h]
+        torrent_limits = state.torrent_limits.setdefault(index, {})
+        for torrent_hash in hashes:
+            torrent_limits.setdefault(torrent_hash, {})[kind] = int(form.get("limit", 0))
+        state.limit_events.append({"instance": index, "time": time.time(), "torrents": len(hashes), "kind": kind})
+        return web.Response(text="")
+
+    app = web.Application()
+    prefix = r"/qb{instance:\d+}/api/v2"
+    app.router.add_post(prefix + "/auth/login", login)
+    app.router.add_get(prefix + "/app/webapiVersion", webapi_version)
+    app.router.add_post(prefix + "/app/setPreferences", set_preferences)
+    app.router.add_get(prefix + "/transfer/info", transfer_info)
+    app.router.add_get(prefix + "/transfer/speedLimitsMode", speed_limits_mode)
+    app.router.add_get(prefix + "/transfer/{kind:download|upload}Limit", read_limit)
+    app.router.add_post(prefix + "/transfer/{kind:download|upload}Limit", read_limit)
+    app.router.add_post(prefix + "/transfer/set{kind:Download|Upload}Limit", _lower_kind(set_limit))
+    app.router.add_post(prefix + "/torrents/set{kind:Download|Upload}Limit", _lower_kind(set_torrent_limit))
+    app.router.add_get(prefix + "/torrents/info", torrents_info)
+    app.router.add_post(prefix + "/torrents/info", torrents_info)
+    _add_control_routes(app, state)
+    return app
+
+
+def _lower_kind(handler):
+    """路由中的 Download/Upload 统一转为小写"""
+    async def wrapper(request: web.Request):
+        request.match_info["kind"] = request.match_info["kind"].lower()
+        return await handler(request)
+    return wrapper
+
+
+def _add_control_routes(app: web.Application, state: FakeState):
+    """基准测试控制接口"""
+    async def get_state(request: web.Request):
+        return web.json_response(state.snapshot())
+
+    async def post_state(request: web.Request):
+        updates = await request.json()
+        for key in ("connections", "stream_services", "latency_ms", "failure_rate",
+                    "rules", "services_per_rule", "torrents", "webapi_version", "speed_limits_mode"):
+            if key in updates:
+                setattr(state, key, updates[key])
+        return web.json_response(state.snapshot())
+
+    async def reset(request: web.Request):
+        state.reset_counters()
+        return web.json_response(state.snapshot())
+
+    app.router.add_get("/_bench/state", get_state)
+    app.router.add_post("/_bench/state", post_state)
+    app.router.add_post("/_bench/reset", reset)
+
+
+async def serve(args):
+    state = FakeState(args)
+    runners = []
+    for app, port in ((build_lucky_app(state), args.lucky_port), (build_qbit_app(state), args.qbit_port)):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        runners.append(runner)
+    print(f"READY lucky={args.lucky_port} qbit={args.qbit_port}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Lucky / qBittorrent 模拟服务器")
+    parser.add_argument("--lucky-port", type=int, default=18601)
+    parser.add_argument("--qbit-port", type=int, default=18080)
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--instances", type=int, default=1)
+    parser.add_argument("--rules", type=int, default=50)
+    parser.add_argument("--services-per-rule", type=int, default=4)
+    parser.add_argument("--torrents", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--webapi-version", default="2.9.3")
+    return parser
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(build_arg_parser().parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+离线基准测试
+启动本地 Lucky / qBittorrent 模拟服务器，按脚本场景驱动 SpeedController、
+LuckyMonitor 和 QBittorrentManager，统计周期延迟、响应延迟、每次切换的请求数、
+CPU 和内存，并保存结果用于跨版本对比
+
+用法:
+    python bench/run_bench.py --devices 2 --instances 3 --rules 200 --torrents 5000
+    python bench/run_bench.py --latency-ms 20 --failure-rate 0.05
+    python bench/run_bench.py --compare bench/results/<旧结果>.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import yaml
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCH_DIR.parent
+RESULTS_DIR = BENCH_DIR / "results"
+
+sys.path.insert(0, str(BENCH_DIR))
+from fake_servers import STREAM_SERVICE_KEY, build_arg_parser  # noqa: E402
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rss_mb() -> float:
+    """当前进程常驻内存（MB）"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return 0.0
+
+
+def _progress(message: str):
+    """进度输出（不受被测程序的标准输出重定向影响）"""
+    print(message, file=sys.__stdout__, flush=True)
+
+
+def _summarize(samples: list) -> dict:
+    """延迟样本统计（毫秒）"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 3),
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "max_ms": round(ordered[-1] * 1000, 3)
+    }
+
+
+class FakeServerProcess:
+    """在独立进程中运行模拟服务器，避免其 CPU 开销计入被测进程"""
+
+    def __init__(self, args):
+        self.args = args
+        self.lucky_port = _free_port()
+        self.qbit_port = _free_port()
+        self.process = None
+
+    def start(self):
+        cmd = [
+            sys.executable, str(BENCH_DIR / "fake_servers.py"),
+            "--lucky-port", str(self.lucky_port),
+            "--qbit-port", str(self.qbit_port),
+            "--devices", str(self.args.devices),
+            "--instances", str(self.args.instances),
+            "--rules", str(self.args.rules),
+            "--services-per-rule", str(self.args.services_per_rule),
+            "--torrents", str(self.args.torrents),
+            "--latency-ms", str(self.args.latency_ms),
+            "--failure-rate", str(self.args.failure_rate),
+            "--webapi-version", self.args.webapi_version
+        ]
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+        line = self.process.stdout.readline()
+        if not line.startswith("READY"):
+            raise RuntimeError(f"模拟服务器启动失败: {line!r}")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+
+    @property
+    def lucky_base(self) -> str:
+        return f"http://127.0.0.1:{self.lucky_port}"
+
+    @property
+    def qbit_base(self) -> str:
+        return f"http://127.0.0.1:{self.qbit_port}"
+
+
+def _prepare_workdir(args, fakes: FakeServerProcess) -> Path:
+    """创建临时工作目录，写入指向模拟服务器的配置"""
+    workdir = Path(tempfile.mkdtemp(prefix="speedhive-bench-"))
+    (workdir / "config").mkdir()
+    (workdir / "data" / "config").mkdir(parents=True)
+    shutil.copytree(REPO_ROOT / "app" / "templates", workdir / "app" / "templates")
+    (workdir / "app" / "static").mkdir(parents=True)
+
+    config = {
+        "lucky_devices": [
+            {
+                "name": f"bench-lucky-{i}",
+                "api_url": f"{fakes.lucky_base}/lucky{i}/api/webservice/rules?openToken=bench",
+                "weight": 1.0,
+                "enabled": True
+            }
+            for i in range(args.devices)
+        ],
+        "qbittorrent_instances": [
+            {
+                "name": f"bench-qb-{i}",
+                "host": f"{fakes.qbit_base}/qb{i}",
+                "username": "admin",
+                "password": "adminadmin",
+                "enabled": True
+            }
+            for i in range(args.instances)
+        ],
+        "controller_settings": {
+            # 延迟设为0，使每个周期都能立即做出决策，便于统计单周期开销
+            "poll_interval": 0,
+            "limit_on_delay": 0,
+            "limit_off_delay": 0,
+            "retry_interval": 10,
+            "limited_download": 1024,
+            "limited_upload": 512,
+            "normal_download": 0,
+            "normal_upload": 0,
+            "throttle_mode": args.throttle_mode,
+            # 定向模式：限制模拟种子中的 movies / tv 分类
+            "targeting": {"categories": ["movies", "tv"], "upload_limit": 128}
+        }
+    }
+    with open(workdir / "config" / "config.yaml", "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f, allow_unicode=True)
+    with open(workdir / "data" / "config" / "service_control.json", "w", encoding="utf-8") as f:
+        json.dump({STREAM_SERVICE_KEY: True}, f)
+    return workdir
+
+
+class BenchRunner:
+    def __init__(self, args, fakes: FakeServerProcess, main_module):
+        self.args = args
+        self.fakes = fakes
+        self.main = main_module
+        self.controller = main_module.speed_controller
+        self.control_session = None
+
+    async def _fake_state(self, **updates) -> dict:
+        """读取/修改模拟服务器状态"""
+        import aiohttp
+        if self.control_session is None:
+            self.control_session = aiohttp.ClientSession()
+        # 两个模拟服务器共享同一份状态（请求计数包含 Lucky 和 qB 两侧），只通过一个控制接口读写，避免重复累加
+        if updates:
+            async with self.control_session.post(f"{self.fakes.qbit_base}/_bench/state", json=updates) as resp:
+                return await resp.json()
+        async with self.control_session.get(f"{self.fakes.qbit_base}/_bench/state") as resp:
+            return await resp.json()
+
+    async def _reset_fake_counters(self):
+        async with self.control_session.post(f"{self.fakes.qbit_base}/_bench/reset") as resp:
+            await resp.read()
+
+    async def _measure(self, name: str, coro_factory, iterations: int) -> dict:
+        """重复执行并统计延迟、CPU和内存"""
+        samples = []
+        cpu_start = time.process_time()
+        rss_start = _rss_mb()
+        for _ in range(iterations):
+            started = time.perf_counter()
+            await coro_factory()
+            samples.append(time.perf_counter() - started)
+        cpu_used = time.process_time() - cpu_start
+        result = _summarize(samples)
+        result.update({
+            "cpu_seconds": round(cpu_used, 4),
+            "cpu_ms_per_iteration": round(cpu_used / max(1, iterations) * 1000, 3),
+            "rss_start_mb": round(rss_start, 2),
+            "rss_end_mb": round(_rss_mb(), 2)
+        })
+        _progress(f"  {name}: p50={result.get('p50_ms')}ms p95={result.get('p95_ms')}ms cpu/iter={result['cpu_ms_per_iteration']}ms")
+        return result
+
+    async def scenario_idle_cycles(self) -> dict:
+        """无连接时的稳态周期开销"""
+        await self._fake_state(connections=0)
+        return await self._measure("idle_cycles", self.controller._control_cycle, self.args.cycles)
+
+    async def scenario_transitions(self) -> dict:
+        """限速/恢复切换：响应延迟和每次切换的上游请求数"""
+        reaction = {"limit": [], "restore": []}
+        requests_per_transition = {"limit": [], "restore": []}
+        cycles_to_react = {"limit": [], "restore": []}
+        cpu_start = time.process_time()
+
+        for _ in range(self.args.transitions):
+            for kind, connections, target in (("limit", 5, True), ("restore", 0, False)):
+                await self._fake_state(connections=connections)
+                await self._reset_fake_counters()
+                started = time.perf_counter()
+                cycles = 0
+                while self.controller.is_limited != target and cycles < 50:
+                    await self.controller._control_cycle()
+                    cycles += 1
+                reaction[kind].append(time.perf_counter() - started)
+                cycles_to_react[kind].append(cycles)
+                state = await self._fake_state()
+                # 只统计推送限速相关的请求（排除 Lucky 轮询）
+                pushes = sum(v for k, v in state["request_counts"].items() if k.startswith("qb"))
+                requests_per_transition[kind].append(pushes)
+
+        result = {
+            "cpu_seconds": round(time.process_time() - cpu_start, 4)
+        }
+        for kind in ("limit", "restore"):
+            result[kind] = _summarize(reaction[kind])
+            result[kind]["qbit_requests_per_transition"] = round(statistics.mean(requests_per_transition[kind]), 2)
+            result[kind]["cycles_to_react"] = round(statistics.mean(cycles_to_react[kind]), 2)
+        _progress(f"  transitions: limit p50={result['limit'].get('p50_ms')}ms "
+              f"requests={result['limit']['qbit_requests_per_transition']}, "
+              f"restore p50={result['restore'].get('p50_ms')}ms "
+              f"requests={result['restore']['qbit_requests_per_transition']}")
+        return result
+
+    async def _simulate_restart(self):
+        """模拟进程重启：关闭连接池，清空认证、版本和响应缓存，控制器状态回到初始值"""
+        await self.main.lucky_monitor.close()
+        await self.main.qbit_manager.close()
+        manager = self.main.qbit_manager
+        for cache in (manager.cookies, manager.sid_cache, manager.transfer_cache,
+                      manager.webapi_versions, manager.limit_strategies):
+            cache.clear()
+        self.main.lucky_monitor._payload_cache.clear()
+        self.controller.is_limited = False
+        self.controller.limit_timer = self.controller.normal_timer = 0
+        self.controller.first_throttle_after = None
+        self.controller.started_at = self.controller.clock.time()
+
+    async def scenario_cold_start(self):
+        """重启后首次限速生效耗时（含预热），以及限速中重启时多余的推送请求数"""
+        warm_up = getattr(self.controller, "warm_up", None)
+        settings = (await self.main.config_manager.load_config_async())["controller_settings"]
+        first_throttle = []
+        decision = []
+        redundant_pushes = []
+        for _ in range(self.args.transitions):
+            # 从全速状态重启，重启后立即有观看连接
+            await self._fake_state(connections=0)
+            await self.controller._apply_normal_mode(settings)
+            await self._simulate_restart()
+            await self._fake_state(connections=5)
+            started = time.perf_counter()
+            if warm_up is not None:
+                await warm_up()
+            cycles = 0
+            while not self.controller.is_limited and cycles < 50:
+                cycle_started = time.perf_counter()
+                await self.controller._control_cycle()
+                cycles += 1
+            first_throttle.append(time.perf_counter() - started)
+            # 做出限速决策的那个周期（生产配置中预热早已在 limit_on_delay 等待期间完成）
+            decision.append(time.perf_counter() - cycle_started)
+
+            # 限速中重启：实例已是限速值，不应重复推送
+            await self._simulate_restart()
+            await self._reset_fake_counters()
+            if warm_up is not None:
+                await warm_up()
+            await self.controller._control_cycle()
+            state = await self._fake_state()
+            redundant_pushes.append(sum(v for k, v in state["request_counts"].items()
+                                        if k.startswith("qb") and ".set" in k))
+
+        result = _summarize(first_throttle)
+        result["decision_cycle"] = _summarize(decision)
+        result["limit_pushes_after_limited_restart"] = round(statistics.mean(redundant_pushes), 2)
+        _progress(f"  cold_start: first throttle p50={result.get('p50_ms')}ms "
+                  f"decision cycle p50={result['decision_cycle'].get('p50_ms')}ms "
+                  f"pushes after limited restart={result['limit_pushes_after_limited_restart']}")
+        return result
+
+    async def scenario_lucky_fetch(self) -> dict:
+        """单设备采集（请求 + 解析）"""
+        device = (await self.main.config_manager.load_config_async())["lucky_devices"][0]
+        monitor = self.main.lucky_monitor
+        return await self._measure("lucky_fetch", lambda: monitor.get_device_connections(device), self.args.cycles)
+
+    async def scenario_qbit_status(self) -> dict:
+        """qBittorrent 实例状态采集（含大种子列表）"""
+        instance = (await self.main.config_manager.load_config_async())["qbittorrent_instances"][0]
+        manager = self.main.qbit_manager
+        return await self._measure("qbit_status", lambda: manager.get_instance_status(instance),
+                                   max(1, self.args.cycles // 10))
+
+    async def run(self) -> dict:
+        scenarios = {}
+        for name in ("idle_cycles", "transitions", "cold_start", "lucky_fetch", "qbit_status"):
+            if self.args.scenarios and name not in self.args.scenarios:
+                continue
+            scenarios[name] = await getattr(self, f"scenario_{name}")()
+        if self.control_session is not None:
+            await self.control_session.close()
+        await self.main.lucky_monitor.close()
+        await self.main.qbit_manager.close()
+        return scenarios
+
+
+def _flatten(prefix: str, value, out: dict):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}.{k}" if prefix else k, v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+
+
+def compare_results(old: dict, new: dict):
+    """打印两次结果的关键指标对比"""
+    old_flat, new_flat = {}, {}
+    _flatten("", old.get("scenarios", {}), old_flat)
+    _flatten("", new.get("scenarios", {}), new_flat)
+    _progress(f"\n对比 {old.get('version')} -> {new.get('version')}")
+    for key in sorted(new_flat):
+        if key not in old_flat or not any(key.endswith(s) for s in ("_ms", "cpu_seconds", "per_transition", "_mb")):
+            continue
+        before, after = old_flat[key], new_flat[key]
+        change = ((after - before) / before * 100) if before else 0.0
+        marker = "⚠️" if change > 10 else ("✅" if change < -10 else "  ")
+        _progress(f"{marker} {key:60s} {before:>12.3f} -> {after:>12.3f} ({change:+.1f}%)")
+
+
+def parse_args():
+    fake_parser = build_arg_parser()
+    parser = argparse.ArgumentParser(description="SpeedHiveHome 离线基准测试", parents=[fake_parser], add_help=True,
+                                     conflict_handler="resolve")
+    parser.add_argument("--cycles", type=int, default=200, help="稳态周期/采集次数")
+    parser.add_argument("--transitions", type=int, default=10, help="限速/恢复切换次数")
+    parser.add_argument("--scenarios", nargs="*", help="只运行指定场景")
+    parser.add_argument("--output", default=str(RESULTS_DIR), help="结果保存目录")
+    parser.add_argument("--compare", help="与已有结果文件对比")
+    parser.add_argument("--throttle-mode", choices=["global", "targeted"], default="global", help="限速模式")
+    parser.add_argument("--verbose", action="store_true", help="显示被测程序的输出")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    fakes = FakeServerProcess(args)
+    fakes.start()
+    original_cwd = os.getcwd()
+    workdir = _prepare_workdir(args, fakes)
+    try:
+        os.chdir(workdir)
+        sys.path.insert(0, str(REPO_ROOT / "app"))
+        sys.path.insert(0, str(REPO_ROOT))
+        # 被测程序的 print 输出重定向到空设备，进度信息直接写到真实标准输出
+        devnull = open(os.devnull, "w")
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+        with output:
+            import main as main_module
+            if not args.verbose:
+                main_module.logger.removeHandler(main_module.console_handler)
+            _progress(f"基准测试: devices={args.devices} instances={args.instances} rules={args.rules} "
+                      f"torrents={args.torrents} latency={args.latency_ms}ms failure={args.failure_rate}")
+            scenarios = asyncio.run(BenchRunner(args, fakes, main_module).run())
+        ru = resource.getrusage(resource.RUSAGE_SELF)
+        result = {
+            "version": main_module.VERSION_INFO.get("version"),
+            "commit_hash": main_module.VERSION_INFO.get("commit_hash"),
+            "timestamp": datetime.now().isoformat(),
+            "python": sys.version.split()[0],
+            "params": {k: getattr(args, k) for k in ("devices", "instances", "rules", "services_per_rule", "torrents",
+                                                     "latency_ms", "failure_rate", "cycles", "transitions",
+                                                     "webapi_version", "throttle_mode")},
+            "process": {
+                "max_rss_mb": round(ru.ru_maxrss / 1024, 2),
+                "user_cpu_seconds": round(ru.ru_utime, 3),
+                "system_cpu_seconds": round(ru.ru_stime, 3)
+            },
+            "scenarios": scenarios
+        }
+    finally:
+        os.chdir(original_cwd)
+        fakes.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_file = output_dir / f"bench-{result['version']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    _progress(f"\n✅ 结果已保存: {output_file}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare_results(json.load(f), result)
+
+
+if __name__ == "__main__":
+    main()
@@ -142,6 +142,9 @@ copy_project_files() {
     cp -f "$SCRIPT_DIR/requirements.txt" "$PROJECT_DIR/"
     cp -f "$SCRIPT_DIR/version.py" "$PROJECT_DIR/"
     
+    # 在宿主机生成版本信息（镜像内没有 git）
+    (cd "$SCRIPT_DIR" && python3 version.py --write "$PROJECT_DIR/version_info.json") || log_warning "版本信息生成失败，将使用默认版本"
+    
     # 复制应用代码
     cp -rf "$SCRIPT_DIR/app" "$PROJECT_DIR/"
     
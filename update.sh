@@ -94,6 +94,8 @@ git log -1 --oneline
 # 步骤5：重新构建并启动
 print_header "🏗️ 步骤 4/5: 重新构建 Docker 镜像"
 print_info "正在构建 Docker 镜像..."
+# 在宿主机生成版本信息（镜像内没有 git）
+python3 version.py --write || print_warning "版本信息生成失败，将使用默认版本"
 docker compose build --no-cache
 
 print_success "Docker 镜像构建完成"
@@ -1,48 +1,37 @@
 #!/usr/bin/env python3
 """
 自动版本管理模块
-基于Git提交信息自动生成版本号
+基于Git提交信息自动生成版本号；构建时可预先写入 version_info.json，运行时直接读取
 """
 
 import subprocess
 import os
+import sys
 import json
 from datetime import datetime
 from pathlib import Path
 
-def get_git_version():
-    """获取基于Git的版本信息"""
-    # 优先从静态版本文件读取（Docker容器中使用）
-    version_file = Path(__file__).parent / "version_info.json"
-    if version_file.exists():
-        try:
-            with open(version_file, 'r') as f:
-                return json.load(f)
-        except Exception:
-            pass
-    
-    # 从Git仓库获取版本信息
+VERSION_FILE = Path(__file__).parent / "version_info.json"
+
+# 进程内缓存：版本信息在进程生命周期内不变，只计算一次
+_cached_version = None
+
+
+def _run_git(*args):
+    return subprocess.check_output(
+        ['git', *args],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stderr=subprocess.DEVNULL
+    ).decode('utf-8').strip()
+
+
+def _read_git_version():
+    """从Git仓库读取版本信息（两次 git 调用）"""
     try:
-        # 获取最新的提交hash（短版本）
-        commit_hash = subprocess.check_output(
-            ['git', 'rev-parse', '--short', 'HEAD'],
-            cwd=os.path.dirname(os.path.abspath(__file__)),
-            stderr=subprocess.DEVNULL
-        ).decode('utf-8').strip()
-        
-        # 获取提交数量
-        commit_count = subprocess.check_output(
-            ['git', 'rev-list', '--count', 'HEAD'],
-            cwd=os.path.dirname(os.path.abspath(__file__)),
-            stderr=subprocess.DEVNULL
-        ).decode('utf-8').strip()
-        
-        # 获取最新提交的时间
-        commit_date = subprocess.check_output(
-            ['git', 'log', '-1', '--format=%cd', '--date=short'],
-            cwd=os.path.dirname(os.path.abspath(__file__)),
-            stderr=subprocess.DEVNULL
-        ).decode('utf-8').strip()
+        # 最新提交的hash（短版本）和提交日期
+        commit_hash, commit_date = _run_git('log', '-1', '--format=%h %cd', '--date=short').split(' ', 1)
+        # 提交数量
+        commit_count = _run_git('rev-list', '--count', 'HEAD')
         
         return {
             'commit_hash': commit_hash,
@@ -51,7 +40,7 @@ def get_git_version():
             'version': f"2.{commit_count}.{commit_hash}",
             'build_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
-    except (subprocess.CalledProcessError, FileNotFoundError):
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
         # 如果Git不可用，返回默认版本
         return {
             'commit_hash': 'unknown',
@@ -61,16 +50,52 @@ def get_git_version():
             'build_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
 
+def get_git_version():
+    """获取基于Git的版本信息"""
+    global _cached_version
+    if _cached_version is not None:
+        return _cached_version
+    
+    # 优先从构建时生成的静态版本文件读取（Docker容器中使用）
+    if VERSION_FILE.exists():
+        try:
+            with open(VERSION_FILE, 'r') as f:
+                _cached_version = json.load(f)
+                return _cached_version
+        except Exception:
+            pass
+    
+    _cached_version = _read_git_version()
+    return _cached_version
+
+def write_version_file(path=VERSION_FILE, if_missing=False):
+    """构建时生成静态版本文件，运行时不再调用 git"""
+    path = Path(path)
+    if if_missing and path.exists():
+        return json.loads(path.read_text())
+    version_info = _read_git_version()
+    path.write_text(json.dumps(version_info, ensure_ascii=False, indent=2))
+    return version_info
+
+def format_version_string(version_info):
+    return f"v{version_info['version']} (Build: {version_info['build_time']})"
+
 def get_version_string():
     """获取完整的版本字符串"""
-    version_info = get_git_version()
-    return f"v{version_info['version']} (Build: {version_info['build_time']})"
+    return format_version_string(get_git_version())
 
 def get_version_info():
     """获取版本信息字典"""
     return get_git_version()
 
 if __name__ == "__main__":
+    if "--write" in sys.argv:
+        # python version.py --write [输出文件] [--if-missing]
+        args = [a for a in sys.argv[1:] if not a.startswith("--")]
+        info = write_version_file(args[0] if args else VERSION_FILE, if_missing="--if-missing" in sys.argv)
+        print(f"✅ 版本信息已写入: {format_version_string(info)}")
+        sys.exit(0)
+    
     # 测试版本信息
     print("版本信息:")
     version_info = get_version_info()